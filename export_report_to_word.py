@@ -1,849 +1,1746 @@
-from docx import Document
-from docx.shared import Inches, Pt, RGBColor
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.oxml.ns import qn
-from docx.oxml import OxmlElement
-from datetime import datetime
+"""Export the PetPal technical report to a Word document.
+
+The report can be built from Python with ``build_report()`` /
+``render_report()`` or from the command line::
+
+    python export_report_to_word.py --output PetPal_Technical_Report.docx
+    python export_report_to_word.py --config report.json --stdout > report.docx
+    python export_report_to_word.py --output PetPal_Technical_Report.pdf
+    python export_report_to_word.py --batch manifest.jsonl --jobs 8
+    python export_report_to_word.py --serve 8750 --jobs 4
+    python export_report_to_word.py --trace trace.json --trace-memory
+
+python-docx is only imported once a document is actually built, so importing
+this module, ``--help`` and ``--check`` stay cheap. PDF output is laid out
+natively from the same sections (see ``report_pdf.py``), with no office suite.
+
+The static report text lives in ``report_spec.json`` (see ``report_spec.py``),
+compiled once per spec content into nodes both backends replay; the sections
+built from app sources and data exports are Python functions it places.
+
+Expensive, reusable artefacts (the styled template, highlighted snippets, the
+Dart symbol index, the parsed Firestore schema and pub lockfile) are cached
+in memory and under ``PETPAL_REPORT_CACHE`` (default ``~/.cache/petpal_report``);
+set it to an empty string to disable the on-disk cache.
+
+``--trace`` times every section and helper and writes a Chrome trace plus a
+summary table (see ``report_trace.py``); without it the spans are no-ops.
+"""
+import argparse
+import functools
+import hashlib
+import inspect
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+import zipfile
+from datetime import date, datetime, timezone
+from xml.sax.saxutils import escape
+
+from report_trace import annotate, span, traced
+
+DEFAULT_OUTPUT = 'PetPal_Technical_Report.docx'
+
+OUTPUT_FORMATS = ('docx', 'pdf')
+
+CACHE_DIR = os.environ.get('PETPAL_REPORT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'petpal_report'))
+
+# Characters XML 1.0 does not allow, even escaped
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Bump whenever new_document() or add_cover_page() changes what they produce
+TEMPLATE_VERSION = 2
+
+# Bump whenever code outside this module changes what sections render
+# (e.g. report_highlight.py); sections' own code is fingerprinted automatically
+SECTION_CACHE_VERSION = 3
+
+DEFAULT_CONFIG = {
+    'title': 'PETPAL MOBILE APPLICATION',
+    'subtitle': 'Technical Report',
+    'version': '1.0',
+    'repository': 'ammaribrahim95/MobileApp_PetPal',
+    'prepared_by': 'Technical Analysis Team',
+    # ISO date (YYYY-MM-DD) the report is as of; defaults to the
+    # SOURCE_DATE_EPOCH environment variable's date if set, else today
+    'report_date': None,
+    # Firestore export files (JSON or NDJSON) for the statistics appendix;
+    # users are optional and only used to group vet bookings by clinic
+    'bookings_export': None,
+    'activities_export': None,
+    'users_export': None,
+    # Inclusive ISO date window for the statistics; open-ended if unset
+    'stats_start': None,
+    'stats_end': None,
+    # Rows per statistics table, busiest groups first; 0 lists every group
+    'stats_table_rows': 20,
+    # Pets export for the photo appendix; photos (and vets' and sitters'
+    # profile pictures from the users export) are read only from images_dir,
+    # a directory mirroring the Firebase Storage bucket (local paths in the
+    # exports are looked up under it too)
+    'pets_export': None,
+    'images_dir': None,
+    # Print resolution photos are downscaled to
+    'image_dpi': 150,
+    # Photos per gallery; 0 shows every photo
+    'photo_limit': 60,
+    # Report content spec (JSON, or YAML with PyYAML); see report_spec.py
+    'spec': None,
+    # Audience variant declared by the spec, e.g. "owner"; None is the
+    # technical report (see report_variants.py)
+    'variant': None,
+    # Output compression: 0 stores the .docx parts uncompressed (fastest),
+    # 1-9 deflates them from fastest to smallest; PDF streams likewise
+    'compression_level': 6,
+    # Byte-identical output for identical inputs: the .docx zip entries are
+    # sorted and dated report_date, as are the core properties
+    'reproducible': False,
+    # Write the .docx body as it is rendered instead of building it in
+    # memory first (see report_stream.py); always a full build in one process
+    'streaming': False,
+}
+
+DATE_KEYS = ('report_date', 'stats_start', 'stats_end')
+PATH_KEYS = ('bookings_export', 'activities_export', 'users_export', 'pets_export', 'images_dir', 'spec')
+
+DEFAULT_SPEC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'report_spec.json')
+
+DEFAULT_VARIANT = 'technical'
+
+
+def _parse_date(value, key):
+    """Accept a date, datetime or YYYY-MM-DD string for a config key"""
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f'Report config "{key}" must be YYYY-MM-DD, got {value!r}') from None
+    if isinstance(value, datetime):
+        return value.date()
+    if not isinstance(value, date):
+        raise ValueError(f'Report config "{key}" must be a date or YYYY-MM-DD string')
+    return value
+
+
+def default_report_date():
+    """Return the date of ``SOURCE_DATE_EPOCH`` (UTC) if it is set, else today"""
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if not epoch:
+        return date.today()
+    try:
+        return datetime.fromtimestamp(int(epoch), timezone.utc).date()
+    except (ValueError, OverflowError, OSError):
+        raise ValueError(f'SOURCE_DATE_EPOCH must be a Unix timestamp, got {epoch!r}') from None
+
+
+def resolve_config(config=None):
+    """Merge a report config over the defaults and validate it"""
+    resolved = dict(DEFAULT_CONFIG)
+    if config:
+        unknown = sorted(set(config) - set(DEFAULT_CONFIG))
+        if unknown:
+            raise ValueError(f'Unknown report config keys: {", ".join(unknown)}')
+        resolved.update(config)
+
+    for key in ('title', 'subtitle', 'version', 'repository', 'prepared_by'):
+        if not isinstance(resolved[key], str):
+            raise ValueError(f'Report config "{key}" must be a string')
+    if resolved['variant'] is not None and (not isinstance(resolved['variant'], str) or not resolved['variant']):
+        raise ValueError('Report config "variant" must be a variant name')
+    for key in ('reproducible', 'streaming'):
+        if not isinstance(resolved[key], bool):
+            raise ValueError(f'Report config "{key}" must be true or false')
+    for key in PATH_KEYS:
+        if resolved[key] is not None and not isinstance(resolved[key], str):
+            raise ValueError(f'Report config "{key}" must be a path')
+
+    for key in ('stats_table_rows', 'photo_limit'):
+        value = resolved[key]
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise ValueError(f'Report config "{key}" must be a non-negative integer')
+    level = resolved['compression_level']
+    if not isinstance(level, int) or isinstance(level, bool) or not 0 <= level <= 9:
+        raise ValueError('Report config "compression_level" must be an integer from 0 to 9')
+    dpi = resolved['image_dpi']
+    if not isinstance(dpi, int) or isinstance(dpi, bool) or not 72 <= dpi <= 1200:
+        raise ValueError('Report config "image_dpi" must be an integer from 72 to 1200')
+
+    if resolved['report_date'] is None:
+        resolved['report_date'] = default_report_date()
+    for key in DATE_KEYS:
+        if resolved[key] is not None:
+            resolved[key] = _parse_date(resolved[key], key)
+    if resolved['stats_start'] and resolved['stats_end'] and resolved['stats_start'] > resolved['stats_end']:
+        raise ValueError('Report config "stats_start" must not be after "stats_end"')
+    return resolved
+
+
+def content_hash(*parts):
+    """Return a hex SHA-256 over strings/bytes, used as a cache key"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def cache_path(kind, key, suffix=''):
+    """Return the on-disk cache path for an entry, or None if disabled"""
+    if not CACHE_DIR:
+        return None
+    return os.path.join(CACHE_DIR, kind, f'{key}{suffix}')
+
+
+def read_cache(kind, key, suffix=''):
+    """Return cached bytes, or None on a miss"""
+    path = cache_path(kind, key, suffix)
+    if path is None:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_cache(kind, key, data, suffix=''):
+    """Store bytes in the on-disk cache; failures only cost a future miss"""
+    path = cache_path(kind, key, suffix)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent workers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+_parsed_files = {}
+
+
+def parse_file_cached(kind, version, path, parse):
+    """Return ``parse(text)`` for a file, cached by its content hash
+
+    ``parse`` must return JSON-serialisable data. Results are kept in memory
+    and in the ``kind`` cache, so each distinct file content is parsed once;
+    the file is recorded as a dependency of the section being rendered.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    digest = content_hash(data)
+    record_dependency(path, digest)
+    key = content_hash(str(version), kind, parse.__name__, digest)
+    if key in _parsed_files:
+        return _parsed_files[key]
+    cached = read_cache(kind, key, '.json')
+    if cached is not None:
+        result = json.loads(cached)
+    else:
+        result = parse(data.decode('utf-8', errors='replace'))
+        write_cache(kind, key, json.dumps(result, separators=(',', ':')).encode('utf-8'), '.json')
+    _parsed_files[key] = result
+    return result
+
+
+def warm_up():
+    """Import python-docx and prime the base template, e.g. in a pool worker"""
+    import docx  # noqa: F401
+    import docx.enum.text  # noqa: F401
+    import docx.oxml  # noqa: F401
+    import docx.shared  # noqa: F401
+
+    base_template()
+
+
+def text_runs(text, rpr=''):
+    """Return run XML for text, turning newlines and tabs into breaks and tabs"""
+    text = _INVALID_XML_CHARS.sub('', str(text))
+    if not text:
+        return ''
+    parts = []
+    for i, line in enumerate(text.split('\n')):
+        if i:
+            parts.append('<w:br/>')
+        for j, chunk in enumerate(line.split('\t')):
+            if j:
+                parts.append('<w:tab/>')
+            if chunk:
+                # Like python-docx, only mark text whose edges Word would trim;
+                # xml:space attributes are costly when lxml moves elements
+                space = ' xml:space="preserve"' if chunk != chunk.strip() else ''
+                parts.append(f'<w:t{space}>{escape(chunk)}</w:t>')
+    rpr = f'<w:rPr>{rpr}</w:rPr>' if rpr else ''
+    return f'<w:r>{rpr}{"".join(parts)}</w:r>'
+
+
+TABLE_LOOK = (
+    '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0"'
+    ' w:noHBand="0" w:noVBand="1" w:val="04A0"/>'
+)
+
+# Keys accepted in a column style: width in twips, paragraph alignment
+# ('left', 'center', 'right'), bold, monospaced font and cell fill colour
+COLUMN_STYLE_KEYS = ('width', 'align', 'bold', 'mono', 'fill')
+
+_ALIGNMENTS = {'left': 'left', 'center': 'center', 'right': 'right'}
+
+
+def _column_formats(cols, text_width, column_styles):
+    """Return ``(widths, cell_open, rpr)`` lists for each column"""
+    column_styles = list(column_styles or [])
+    if len(column_styles) > cols:
+        raise ValueError(f'{len(column_styles)} column styles given for {cols} columns')
+    column_styles += [{}] * (cols - len(column_styles))
+    fixed = sum(style.get('width') or 0 for style in column_styles)
+    flexible = sum(1 for style in column_styles if not style.get('width'))
+    default_width = max(text_width - fixed, 0) // flexible if flexible else 0
+
+    widths, cell_opens, rprs = [], [], []
+    for style in column_styles:
+        unknown = sorted(set(style) - set(COLUMN_STYLE_KEYS))
+        if unknown:
+            raise ValueError(f'Unknown column style keys: {", ".join(unknown)}')
+        align = style.get('align')
+        if align is not None and align not in _ALIGNMENTS:
+            raise ValueError(f'column align must be left, center or right, got {align!r}')
+        width = int(style.get('width') or default_width)
+        fill = f'<w:shd w:val="clear" w:color="auto" w:fill="{style["fill"]}"/>' if style.get('fill') else ''
+        ppr = f'<w:pPr><w:jc w:val="{_ALIGNMENTS[align]}"/></w:pPr>' if align else ''
+        rpr = ''
+        if style.get('mono'):
+            rpr += '<w:rFonts w:ascii="Courier New" w:hAnsi="Courier New"/>'
+        if style.get('bold'):
+            rpr += '<w:b/>'
+        widths.append(width)
+        cell_opens.append(f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/>{fill}</w:tcPr><w:p>{ppr}')
+        rprs.append(rpr)
+    return widths, cell_opens, rprs
+
+
+def table_xml(rows, style_id, text_width, header=None, cols=None, column_styles=None,
+              chunk_rows=None, separator='<w:p/>'):
+    """Yield the XML of one or more ``w:tbl`` elements, a few rows at a time
+
+    ``rows`` is any iterable of row sequences and is consumed lazily. The
+    column count comes from ``cols``, the header or the first row. The
+    header row repeats at the top of every page, and of every table when
+    ``chunk_rows`` splits the rows into several tables joined by
+    ``separator`` (an empty paragraph, so Word does not merge them). With
+    neither a header nor any rows nothing is yielded, as Word reports a
+    table without rows as corrupt.
+    """
+    if chunk_rows is not None and chunk_rows < 1:
+        raise ValueError(f'chunk_rows must be at least 1, got {chunk_rows}')
+    rows = iter(rows)
+    first = None
+    if header is None:
+        first = next(rows, None)
+        if first is None:
+            return
+    if cols is None:
+        cols = len(header) if header is not None else len(first)
+    widths, cell_opens, rprs = _column_formats(cols, text_width, column_styles)
+
+    grid = ''.join(f'<w:gridCol w:w="{width}"/>' for width in widths)
+    table_open = (
+        f'<w:tbl><w:tblPr><w:tblStyle w:val="{style_id}"/>'
+        f'<w:tblW w:type="auto" w:w="0"/>{TABLE_LOOK}</w:tblPr><w:tblGrid>{grid}</w:tblGrid>'
+    )
+    columns = tuple(zip(cell_opens, rprs))
+
+    def row_xml(values, trpr=''):
+        values = tuple(values)
+        if len(values) != cols:
+            raise ValueError(f'table row has {len(values)} cells, expected {cols}')
+        cells = ''.join(
+            f'{cell_open}{text_runs(value, rpr) if value is not None else ""}</w:p></w:tc>'
+            for (cell_open, rpr), value in zip(columns, values)
+        )
+        return f'<w:tr>{trpr}{cells}</w:tr>'
+
+    header_xml = row_xml(header, '<w:trPr><w:tblHeader/></w:trPr>') if header is not None else ''
+    if first is not None:
+        rows = itertools.chain((first,), rows)
+
+    yield table_open + header_xml
+    in_table = 0
+    for values in rows:
+        if chunk_rows is not None and in_table == chunk_rows:
+            yield f'</w:tbl>{separator}{table_open}{header_xml}'
+            in_table = 0
+        yield row_xml(values)
+        in_table += 1
+    yield '</w:tbl>'
+
+
+@traced()
+def add_bulk_table(doc, rows=None, header=None, columns=None, style='Light Grid Accent 1',
+                   column_styles=None, chunk_rows=None):
+    """Add a table built as XML in one pass, rather than cell by cell
+
+    Pass either ``rows`` (an iterable of row sequences) or ``columns`` (a
+    list of equal-length sequences, or a mapping of header -> sequence, whose
+    keys become the header). ``column_styles`` is a list of dicts using
+    ``COLUMN_STYLE_KEYS``. Cell values are converted with ``str()``; None
+    leaves a cell empty. See ``table_xml()`` for headers and chunking.
+    """
+    if (rows is None) == (columns is None):
+        raise ValueError('pass either rows or columns')
+    if columns is not None:
+        if isinstance(columns, dict):
+            if header is None:
+                header = list(columns)
+            columns = list(columns.values())
+        lengths = {len(column) for column in columns}
+        if len(lengths) > 1:
+            raise ValueError(f'columns have different lengths: {sorted(lengths)}')
+        rows = zip(*columns)
+        cols = len(columns)
+    else:
+        cols = None
+    if getattr(doc, 'backend', 'docx') != 'docx':
+        doc.add_bulk_table(rows, header=header, cols=cols, column_styles=column_styles, style=style,
+                           chunk_rows=chunk_rows)
+        return
+
+    section = doc.sections[-1]
+    # Section lengths are EMU; table widths are twips (1 twip = 635 EMU)
+    text_width = (section.page_width - section.left_margin - section.right_margin) // 635
+    xml = ''.join(table_xml(rows, style_id(doc.part, style), text_width, header=header, cols=cols,
+                            column_styles=column_styles, chunk_rows=chunk_rows))
+    _append_section_xml(doc, xml)
+
 
 def add_heading_with_line(doc, text, level=1):
     """Add a heading with a line underneath"""
     heading = doc.add_heading(text, level=level)
     heading.style = f'Heading {level}'
 
-def add_table_of_contents(doc):
-    """Add a table of contents"""
+def add_table_of_contents(doc, config=None):
+    """Add a table of contents, filled in from the heading index once the build finishes"""
     doc.add_heading('Table of Contents', level=1)
-    # Note: Word will auto-update this when document is opened
     paragraph = doc.add_paragraph()
-    run = paragraph.add_run('[Table of Contents will be generated when document is opened in Word]')
-    run.italic = True
+    index = getattr(doc, 'heading_index', None)
+    if index is not None:
+        index.set_placeholder(paragraph)
+    else:
+        run = paragraph.add_run('[Table of Contents will be generated when document is opened in Word]')
+        run.italic = True
     doc.add_page_break()
 
-def shade_paragraph(paragraph, color="D3D3D3"):
-    """Add shading to a paragraph"""
+def style_id(part, name):
+    """Return the ID of a style by name, looked up once per document part
+
+    python-docx scans styles.xml on every lookup, which dominates building
+    documents with thousands of styled paragraphs.
+    """
+    ids = part.__dict__.setdefault('_report_style_ids', {})
+    if name not in ids:
+        ids[name] = part.styles[name].style_id
+    return ids[name]
+
+
+def shade_paragraph(paragraph, color=None):
+    """Shade a paragraph with a fill of ``color``, by default the 'Shaded' style's
+
+    Without a colour, a Normal paragraph takes the 'Shaded' style; any other
+    paragraph keeps its own style (a heading or list item) and is shaded
+    directly.
+    """
+    if color is None:
+        p_style = paragraph._p.style
+        if p_style is None or p_style == style_id(paragraph.part, 'Normal'):
+            paragraph._p.style = style_id(paragraph.part, SHADED_STYLE)
+            return
+        color = SHADED_FILL
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+
     shading_elm = OxmlElement('w:shd')
+    shading_elm.set(qn('w:val'), 'clear')
+    shading_elm.set(qn('w:color'), 'auto')
     shading_elm.set(qn('w:fill'), color)
     paragraph._element.get_or_add_pPr().append(shading_elm)
 
+@traced()
 def add_code_block(doc, code, language=""):
-    """Add a formatted code block"""
-    paragraph = doc.add_paragraph()
-    paragraph.style = 'Normal'
-    shade_paragraph(paragraph, "F5F5F5")
-    
-    run = paragraph.add_run(code)
-    run.font.name = 'Courier New'
-    run.font.size = Pt(9)
-    run.font.color.rgb = RGBColor(0, 0, 0)
-    
-    # Add left indent for code block
-    paragraph.paragraph_format.left_indent = Inches(0.5)
-    paragraph.paragraph_format.space_before = Pt(6)
-    paragraph.paragraph_format.space_after = Pt(6)
-
-# Create Document
-doc = Document()
-
-# Set default font
-style = doc.styles['Normal']
-style.font.name = 'Calibri'
-style.font.size = Pt(11)
-
-# ===== COVER PAGE =====
-title = doc.add_heading('PETPAL MOBILE APPLICATION', level=0)
-title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-title_run = title.runs[0]
-title_run.font.color.rgb = RGBColor(0, 102, 204)
-title_run.font.size = Pt(28)
-title_run.bold = True
-
-doc.add_paragraph()
-
-subtitle = doc.add_heading('Technical Report', level=1)
-subtitle.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-subtitle_run = subtitle.runs[0]
-subtitle_run.font.size = Pt(20)
-
-doc.add_paragraph()
-doc.add_paragraph()
-
-# Add metadata
-info = doc.add_paragraph()
-info.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-info_run = info.add_run(f'Report Date: {datetime.now().strftime("%B %d, %Y")}\n')
-info_run.font.size = Pt(12)
-info_run = info.add_run('Version: 1.0\n')
-info_run.font.size = Pt(12)
-info_run = info.add_run('Repository: ammaribrahim95/MobileApp_PetPal')
-info_run.font.size = Pt(12)
-
-doc.add_page_break()
-
-# ===== TABLE OF CONTENTS =====
-add_table_of_contents(doc)
-
-# ===== EXECUTIVE SUMMARY =====
-doc.add_heading('1. Executive Summary', level=1)
-doc.add_paragraph(
-    'PetPal is a comprehensive pet care management mobile application developed using Flutter and Firebase. '
-    'The application connects pet owners with veterinarians, pet sitters, and hotel services while providing robust '
-    'pet management, booking, and activity tracking capabilities. This report outlines the technical architecture, '
-    'development approach, and implementation details of the PetPal application.'
-)
+    """Add a formatted code block, syntax highlighted if the language is known"""
+    if getattr(doc, 'backend', 'docx') != 'docx':
+        doc.add_code_block(code, language)
+        return
+    from report_highlight import highlighted_runs
+
+    # Font, shading, indent and spacing all come from the Code Block style,
+    # so runs only carry the highlighting colours
+    runs = highlighted_runs(code, language)
+    if runs is None:
+        runs = text_runs(code)
+    code_style = style_id(doc.part, CODE_BLOCK_STYLE)
+    _append_section_xml(doc, f'<w:p><w:pPr><w:pStyle w:val="{code_style}"/></w:pPr>{runs}</w:p>')
+
+@traced()
+def add_source_snippet(doc, ref, language="dart", start=None, max_lines=None):
+    """Add a code block resolved from the app sources, e.g. 'lib/main.dart::main'"""
+    from report_sources import resolve_snippet
+
+    add_code_block(doc, resolve_snippet(ref, start=start, max_lines=max_lines), language)
+
+
+class HeadingIndex:
+    """Record every heading as it is added so the TOC can be written without a second pass
+
+    ``attach()`` wraps ``doc.add_heading`` to bookmark each heading and log
+    ``(level, text, bookmark)``. ``write_toc()`` then fills the placeholder
+    left by ``add_table_of_contents()`` with one hyperlinked entry per
+    heading added after it, down to ``max_level``.
+    """
+
+    def __init__(self, max_level=2):
+        self.max_level = max_level
+        self.entries = []
+        self.placeholder = None
+        self.toc_start = None
+
+    @classmethod
+    def attach(cls, doc, max_level=2):
+        index = cls(max_level)
+        add_heading = doc.add_heading
+
+        def add_indexed_heading(text='', level=1):
+            heading = add_heading(text, level)
+            index.bookmark(heading._p, level, text)
+            return heading
+
+        doc.add_heading = add_indexed_heading
+        doc.heading_index = index
+        return index
+
+    def bookmark(self, p, level, text):
+        """Wrap a heading paragraph's content in a bookmark and record it"""
+        from docx.oxml import OxmlElement
+        from docx.oxml.ns import qn
+
+        name, bookmark_id = self.bookmark_ids(level, text, len(self.entries))
+        start = OxmlElement('w:bookmarkStart')
+        start.set(qn('w:id'), bookmark_id)
+        start.set(qn('w:name'), name)
+        end = OxmlElement('w:bookmarkEnd')
+        end.set(qn('w:id'), bookmark_id)
+        p_pr = p.pPr
+        if p_pr is not None:
+            p_pr.addnext(start)
+        else:
+            p.insert(0, start)
+        p.append(end)
+        self.entries.append((level, text, name))
+
+    @staticmethod
+    def bookmark_ids(level, text, position):
+        """Return the bookmark ``(name, id)`` for the ``position``-th heading of a document"""
+        key = content_hash(str(level), text, str(position))
+        return f'_Toc{key[:8]}', str(int(key[8:15], 16))
+
+    def set_placeholder(self, paragraph):
+        """Mark where the TOC goes; only headings added after this are listed"""
+        self.placeholder = paragraph._p
+        self.toc_start = len(self.entries)
+
+    def write_toc(self):
+        """Fill the placeholder with one hyperlink paragraph per heading"""
+        if self.placeholder is None:
+            return
+        fill_toc(self.placeholder, self.entries[self.toc_start:], self.max_level)
+        self.placeholder = None
+
+
+def toc_xml(entries, max_level=2):
+    """Return the TOC paragraphs' XML for ``(level, text, bookmark)`` headings"""
+    rows = []
+    for level, text, name in entries:
+        if not 1 <= level <= max_level:
+            continue
+        rows.append(
+            f'<w:p><w:pPr><w:spacing w:after="60"/><w:ind w:left="{(level - 1) * 360}"/></w:pPr>'
+            f'<w:hyperlink w:anchor="{name}" w:history="1">'
+            f'{text_runs(text, "<w:b/>" if level == 1 else "")}</w:hyperlink></w:p>'
+        )
+    return ''.join(rows)
+
+
+def fill_toc(placeholder, entries, max_level=2):
+    """Replace a placeholder paragraph with TOC entries for ``(level, text, bookmark)`` headings"""
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+
+    for element in parse_xml(f'<w:body {nsdecls("w")}>{toc_xml(entries, max_level)}</w:body>'):
+        placeholder.addprevious(element)
+    placeholder.getparent().remove(placeholder)
+
+
+# ===== CODE SNIPPETS =====
+# What each direct dependency in pubspec.yaml is used for
+PACKAGE_PURPOSES = {
+    'cupertino_icons': 'iOS-style icons',
+    'flutter_bloc': 'BLoC pattern implementation',
+    'equatable': 'Value equality for states and events',
+    'firebase_core': 'Firebase initialization',
+    'firebase_auth': 'Authentication',
+    'cloud_firestore': 'NoSQL database',
+    'firebase_storage': 'File storage',
+    'firebase_messaging': 'Push notifications',
+    'cloud_functions': 'Server-side functions',
+    'firebase_app_check': 'App attestation',
+    'firebase_crashlytics': 'Crash reporting',
+    'uuid': 'Unique identifiers',
+    'intl': 'Internationalization and date formatting',
+    'shared_preferences': 'Local key-value storage',
+    'image_picker': 'Image selection',
+    'file_picker': 'File selection',
+    'cached_network_image': 'Image caching',
+    'pdf': 'PDF generation',
+    'printing': 'Printing and PDF preview',
+    'file_saver': 'Saving exported files',
+    'share_plus': 'Native share sheet',
+    'flutter_svg': 'SVG rendering',
+    'url_launcher': 'Opening links, phone and email',
+    'google_fonts': 'Typography',
+    'connectivity_plus': 'Network status',
+    'dotted_border': 'Dotted borders for upload areas',
+    'table_calendar': 'Booking calendar',
+    'flutter_local_notifications': 'Local notifications',
+    'flutter_lints': 'Lint rules (dev)',
+    'bloc_test': 'BLoC unit testing (dev)',
+    'mocktail': 'Mocking in tests (dev)',
+}
+
+# Snippets resolved from petpal_app by symbol (see report_sources.py)
+APP_USER_FROM_MAP = 'lib/models/app_user.dart::AppUser.fromMap'
+APP_USER_TO_MAP = 'lib/models/app_user.dart::AppUser.toMap'
+
+
+# Paragraph styles the report adds to the base document
+CODE_BLOCK_STYLE = 'Code Block'
+SHADED_STYLE = 'Shaded'
+SHADED_FILL = 'D3D3D3'
+
+
+def add_paragraph_style(doc, name, fill=None):
+    """Add a paragraph style based on Normal, shaded with ``fill`` if given"""
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+
+    style = doc.styles.add_style(name, WD_STYLE_TYPE.PARAGRAPH)
+    style.base_style = doc.styles['Normal']
+    style.quick_style = True
+    if fill:
+        # Shading goes in first: python-docx inserts spacing and indent after it
+        style.element.get_or_add_pPr().append(
+            parse_xml(f'<w:shd {nsdecls("w")} w:val="clear" w:color="auto" w:fill="{fill}"/>'))
+    return style
+
+
+def new_document():
+    """Create an empty document with the report's base styles"""
+    from docx import Document
+    from docx.shared import Inches, Pt, RGBColor
+
+    doc = Document()
+
+    # Set default font
+    style = doc.styles['Normal']
+    style.font.name = 'Calibri'
+    style.font.size = Pt(11)
+
+    add_paragraph_style(doc, SHADED_STYLE, SHADED_FILL)
+
+    code = add_paragraph_style(doc, CODE_BLOCK_STYLE, 'F5F5F5')
+    code.font.name = 'Courier New'
+    code.font.size = Pt(9)
+    code.font.color.rgb = RGBColor(0, 0, 0)
+    code.paragraph_format.left_indent = Inches(0.5)
+    code.paragraph_format.space_before = Pt(6)
+    code.paragraph_format.space_after = Pt(6)
+    return doc
+
+
+@traced()
+def add_cover_page(doc, config):
+    """Add the cover page"""
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    from docx.shared import Pt, RGBColor
+
+    title = doc.add_heading(config['title'], level=0)
+    title.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    title_run = title.runs[0]
+    title_run.font.color.rgb = RGBColor(0, 102, 204)
+    title_run.font.size = Pt(28)
+    title_run.bold = True
+
+    doc.add_paragraph()
+
+    subtitle = doc.add_heading(config['subtitle'], level=1)
+    subtitle.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    subtitle_run = subtitle.runs[0]
+    subtitle_run.font.size = Pt(20)
+
+    doc.add_paragraph()
+    doc.add_paragraph()
+
+    # Add metadata
+    info = doc.add_paragraph()
+    info.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    info_run = info.add_run(f'Report Date: {config["report_date"].strftime("%B %d, %Y")}\n')
+    info_run.font.size = Pt(12)
+    info_run = info.add_run(f'Version: {config["version"]}\n')
+    info_run.font.size = Pt(12)
+    info_run = info.add_run(f'Repository: {config["repository"]}')
+    info_run.font.size = Pt(12)
 
-# ===== DEVELOPMENT APPROACH =====
-doc.add_heading('2. Development Approach and Workflow', level=1)
+    doc.add_page_break()
 
-doc.add_heading('2.1 Architecture Pattern', level=2)
-doc.add_paragraph(
-    'The application follows a BLoC (Business Logic Component) architecture pattern, which provides:'
-)
-doc.add_paragraph('Clear separation of concerns between UI, business logic, and data layers', style='List Bullet')
-doc.add_paragraph('Reactive state management using streams', style='List Bullet')
-doc.add_paragraph('Testability and maintainability', style='List Bullet')
-doc.add_paragraph('Predictable state transitions', style='List Bullet')
-
-doc.add_heading('2.2 Project Structure', level=2)
-doc.add_paragraph('The application follows a layered architecture:')
-
-# Add structure visualization
-structure = [
-    ('PetPalApp Architecture', 'Root'),
-    ('├── Presentation Layer (UI)', 'Layer'),
-    ('│   ├── Screens (Views)', 'Component'),
-    ('│   └── Widgets (Reusable Components)', 'Component'),
-    ('├── Business Logic Layer', 'Layer'),
-    ('│   ├── BLoCs (State Management)', 'Component'),
-    ('│   └── Events & States', 'Component'),
-    ('├── Data Layer', 'Layer'),
-    ('│   ├── Repositories (Data Abstraction)', 'Component'),
-    ('│   ├── Services (External APIs)', 'Component'),
-    ('│   └── Models (Data Structures)', 'Component'),
-    ('└── Core/Utils', 'Layer'),
-    ('    ├── Constants', 'Component'),
-    ('    └── Helpers', 'Component'),
-]
-
-for line, _ in structure:
-    p = doc.add_paragraph(line, style='List Bullet')
-    p.paragraph_format.left_indent = Inches(0.25)
-
-doc.add_heading('2.3 Development Workflow', level=2)
-workflow_items = [
-    'Feature-Based Development: Each feature (authentication, pet management, bookings) is developed as an independent module',
-    'Dependency Injection: All dependencies are injected through the widget tree using RepositoryProvider',
-    'State Management: BLoC pattern ensures unidirectional data flow',
-    'Firebase Integration: Backend-as-a-Service for authentication, database, storage, and notifications'
-]
-for i, item in enumerate(workflow_items, 1):
-    doc.add_paragraph(f'{i}. {item}')
-
-doc.add_page_break()
-
-# ===== SOFTWARE, TOOLS, AND FRAMEWORKS =====
-doc.add_heading('3. Software, Tools, and Frameworks', level=1)
-
-doc.add_heading('3.1 Core Technologies', level=2)
-
-# Create table for technologies
-table = doc.add_table(rows=4, cols=3)
-table.style = 'Light Grid Accent 1'
-hdr_cells = table.rows[0].cells
-hdr_cells[0].text = 'Technology'
-hdr_cells[1].text = 'Version'
-hdr_cells[2].text = 'Purpose'
-
-tech_data = [
-    ('Flutter', 'Latest Stable', 'Cross-platform mobile framework'),
-    ('Dart', '3.0+', 'Programming language'),
-    ('Firebase', 'Latest', 'Backend services'),
-]
-
-for i, (tech, version, purpose) in enumerate(tech_data, 1):
-    row_cells = table.rows[i].cells
-    row_cells[0].text = tech
-    row_cells[1].text = version
-    row_cells[2].text = purpose
-
-doc.add_heading('3.2 Key Dependencies', level=2)
-
-dependencies = """flutter_bloc: ^8.0.0           // BLoC pattern implementation
-firebase_core: ^2.0.0           // Firebase initialization
-firebase_auth: ^4.0.0           // Authentication
-cloud_firestore: ^4.0.0         // NoSQL database
-firebase_storage: ^11.0.0       // File storage
-firebase_messaging: ^14.0.0     // Push notifications
-flutter_local_notifications: ^15.0.0
-pdf: PDF generation
-image_picker: Image selection
-intl: Internationalization and date formatting"""
-
-add_code_block(doc, dependencies, "yaml")
-
-doc.add_heading('3.3 Development Tools', level=2)
-tools = [
-    'IDE: Android Studio / Visual Studio Code',
-    'Version Control: Git',
-    'Firebase Console: Backend management',
-    'Flutter DevTools: Debugging and profiling'
-]
-for tool in tools:
-    doc.add_paragraph(tool, style='List Bullet')
-
-doc.add_page_break()
-
-# ===== DATABASE AND DATA HANDLING =====
-doc.add_heading('4. Database and Data Handling Design', level=1)
-
-doc.add_heading('4.1 Firebase Firestore Structure', level=2)
-doc.add_paragraph('The application uses Cloud Firestore with the following collection structure:')
-
-firestore_structure = """firestore
-├── users/
-│   ├── {userId}
-│   │   ├── email: string
-│   │   ├── name: string
-│   │   ├── phoneNumber: string
-│   │   ├── address: string
-│   │   ├── profileImageUrl: string
-│   │   └── role: string (owner/vet/sitter)
-│
-├── pets/
-│   ├── {petId}
-│   │   ├── ownerId: string
-│   │   ├── name: string
-│   │   ├── species: string
-│   │   ├── breed: string
-│   │   ├── age: number
-│   │   ├── imageUrl: string
-│   │   └── medicalHistory: array
-│
-├── bookings/
-│   ├── {bookingId}
-│   │   ├── ownerId: string
-│   │   ├── petId: string
-│   │   ├── providerId: string (vet/sitter)
-│   │   ├── serviceType: string
-│   │   ├── date: timestamp
-│   │   ├── status: string
-│   │   └── notes: string
-│
-├── vets/
-│   ├── {vetId}
-│   │   ├── userId: string
-│   │   ├── clinicName: string
-│   │   ├── specialization: string
-│   │   ├── rating: number
-│   │   └── availability: array
-│
-├── sitters/
-│   ├── {sitterId}
-│   │   ├── userId: string
-│   │   ├── experience: string
-│   │   ├── hourlyRate: number
-│   │   └── availability: array
-│
-└── activities/
-    ├── {activityId}
-        ├── petId: string
-        ├── type: string (feeding/walking/medication)
-        ├── timestamp: timestamp
-        └── notes: string"""
-
-add_code_block(doc, firestore_structure)
-
-doc.add_heading('4.2 Data Models', level=2)
-doc.add_paragraph('Example AppUser Model:')
-
-app_user_code = """class AppUser {
-  final String id;
-  final String email;
-  final String name;
-  final String? phoneNumber;
-  final String? address;
-  final String? profileImageUrl;
-  final UserRole role;
-
-  AppUser({
-    required this.id,
-    required this.email,
-    required this.name,
-    this.phoneNumber,
-    this.address,
-    this.profileImageUrl,
-    required this.role,
-  });
-
-  Map<String, dynamic> toMap() {
-    return {
-      'id': id,
-      'email': email,
-      'name': name,
-      'phoneNumber': phoneNumber,
-      'address': address,
-      'profileImageUrl': profileImageUrl,
-      'role': role.toString(),
-    };
-  }
-
-  factory AppUser.fromMap(Map<String, dynamic> map) {
-    return AppUser(
-      id: map['id'],
-      email: map['email'],
-      name: map['name'],
-      phoneNumber: map['phoneNumber'],
-      address: map['address'],
-      profileImageUrl: map['profileImageUrl'],
-      role: UserRole.values.firstWhere(
-        (e) => e.toString() == map['role'],
-      ),
-    );
-  }
-}"""
-
-add_code_block(doc, app_user_code, "dart")
-
-doc.add_page_break()
-
-# ===== CRUD OPERATIONS =====
-doc.add_heading('5. Implementation of CRUD Operations', level=1)
-
-doc.add_heading('5.1 Create Operation', level=2)
-doc.add_paragraph('BLoC Event Handler for Adding a Pet:')
-
-create_code = """on<AddPet>((event, emit) async {
-  emit(state.copyWith(status: PetStatus.loading));
-  
-  try {
-    String? imageUrl;
-    
-    if (event.imageFile != null) {
-      imageUrl = await _storageService.uploadPetImage(
-        event.pet.id,
-        event.imageFile!,
-      );
-    }
-    
-    final pet = event.pet.copyWith(imageUrl: imageUrl);
-    await _petRepository.addPet(pet);
-    
-    emit(state.copyWith(
-      status: PetStatus.success,
-      pets: [...state.pets, pet],
-    ));
-  } catch (e) {
-    emit(state.copyWith(
-      status: PetStatus.error,
-      errorMessage: e.toString(),
-    ));
-  }
-});"""
-
-add_code_block(doc, create_code, "dart")
-
-doc.add_heading('5.2 Read Operation', level=2)
-doc.add_paragraph('Real-time Data Subscription:')
-
-read_code = """on<LoadPets>((event, emit) async {
-  emit(state.copyWith(status: PetStatus.loading));
-  
-  await emit.forEach<List<Pet>>(
-    _petRepository.getPetsByOwner(event.ownerId),
-    onData: (pets) => state.copyWith(
-      status: PetStatus.success,
-      pets: pets,
-    ),
-    onError: (error, stackTrace) => state.copyWith(
-      status: PetStatus.error,
-      errorMessage: error.toString(),
-    ),
-  );
-});"""
-
-add_code_block(doc, read_code, "dart")
-
-doc.add_heading('5.3 Update Operation', level=2)
-doc.add_paragraph('BLoC Handler for Updating a Pet:')
-
-update_code = """on<UpdatePet>((event, emit) async {
-  emit(state.copyWith(status: PetStatus.loading));
-  
-  try {
-    String? imageUrl = event.pet.imageUrl;
-    
-    if (event.newImageFile != null) {
-      if (imageUrl != null) {
-        await _storageService.deleteFile(imageUrl);
-      }
-      
-      imageUrl = await _storageService.uploadPetImage(
-        event.pet.id,
-        event.newImageFile!,
-      );
-    }
-    
-    final updatedPet = event.pet.copyWith(imageUrl: imageUrl);
-    await _petRepository.updatePet(updatedPet);
-    
-    final updatedPets = state.pets.map((pet) => 
-      pet.id == updatedPet.id ? updatedPet : pet
-    ).toList();
-    
-    emit(state.copyWith(
-      status: PetStatus.success,
-      pets: updatedPets,
-    ));
-  } catch (e) {
-    emit(state.copyWith(
-      status: PetStatus.error,
-      errorMessage: e.toString(),
-    ));
-  }
-});"""
-
-add_code_block(doc, update_code, "dart")
-
-doc.add_heading('5.4 Delete Operation', level=2)
-doc.add_paragraph('BLoC Handler for Deleting a Pet:')
-
-delete_code = """on<DeletePet>((event, emit) async {
-  emit(state.copyWith(status: PetStatus.loading));
-  
-  try {
-    final pet = state.pets.firstWhere((p) => p.id == event.petId);
-    
-    if (pet.imageUrl != null) {
-      await _storageService.deleteFile(pet.imageUrl!);
-    }
-    
-    await _petRepository.deletePet(event.petId);
-    
-    final updatedPets = state.pets.where((p) => p.id != event.petId).toList();
-    
-    emit(state.copyWith(
-      status: PetStatus.success,
-      pets: updatedPets,
-    ));
-  } catch (e) {
-    emit(state.copyWith(
-      status: PetStatus.error,
-      errorMessage: e.toString(),
-    ));
-  }
-});"""
-
-add_code_block(doc, delete_code, "dart")
-
-doc.add_page_break()
-
-# ===== IMPORTANT SOURCE CODE SNIPPETS =====
-doc.add_heading('6. Important Source Code Snippets with Explanations', level=1)
-
-doc.add_heading('6.1 Main Application Initialization', level=2)
-doc.add_paragraph('From main.dart - Application entry point:')
-
-main_code = """void main() async {
-  WidgetsFlutterBinding.ensureInitialized();
-  await Firebase.initializeApp(
-    options: DefaultFirebaseOptions.currentPlatform
-  );
-  
-  Bloc.observer = AppBlocObserver();
-
-  final notificationService = NotificationService(
-    FirebaseMessaging.instance,
-    FlutterLocalNotificationsPlugin(),
-  );
-
-  final authService = FirebaseAuthService(FirebaseAuth.instance);
-  final firestoreService = FirestoreService(FirebaseFirestore.instance);
-  final storageService = StorageService(FirebaseStorage.instance);
-  final pdfService = PdfService();
-
-  final authRepository = AuthRepository(
-    authService: authService,
-    firestoreService: firestoreService,
-  );
-  
-  // ... other repositories initialization
-
-  runApp(PetPalApp(
-    authRepository: authRepository,
-    // ... other dependencies
-  ));
-}"""
-
-add_code_block(doc, main_code, "dart")
-
-doc.add_paragraph(
-    'Explanation: Ensures Flutter bindings are initialized before Firebase, '
-    'initializes all Firebase services and custom services, and creates repository instances '
-    'with dependency injection for clean separation of concerns.'
-)
 
-doc.add_heading('6.2 Dependency Injection Setup', level=2)
-doc.add_paragraph('Widget tree dependency configuration:')
-
-di_code = """@override
-Widget build(BuildContext context) {
-  return MultiRepositoryProvider(
-    providers: [
-      RepositoryProvider.value(value: widget.authRepository),
-      RepositoryProvider.value(value: widget.userRepository),
-      RepositoryProvider.value(value: widget.petRepository),
-      // ... other repositories
-    ],
-    child: MultiBlocProvider(
-      providers: [
-        BlocProvider(
-          create: (_) => AuthBloc(widget.authRepository)
-            ..add(const AuthStatusRequested()),
-        ),
-        BlocProvider(
-          create: (_) => PetBloc(
-            petRepository: widget.petRepository,
-            storageService: widget.storageService,
-          ),
-        ),
-        // ... other BLoCs
-      ],
-      child: MaterialApp(/* ... */),
-    ),
-  );
-}"""
-
-add_code_block(doc, di_code, "dart")
-
-doc.add_paragraph(
-    'Explanation: MultiRepositoryProvider makes repositories available throughout the widget tree. '
-    'MultiBlocProvider creates and provides BLoC instances with their required dependencies. '
-    'Initial events are dispatched on creation.'
-)
+# ===== TEMPLATE =====
+
+def _save_bytes(doc):
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=None)
+def base_template():
+    """Return the styled, empty base document as .docx bytes"""
+    key = content_hash('base', str(TEMPLATE_VERSION))
+    data = read_cache('templates', key, '.docx')
+    if data is None:
+        data = _save_bytes(new_document())
+        write_cache('templates', key, data, '.docx')
+    return data
+
+
+@functools.lru_cache(maxsize=32)
+def _front_matter_template(title, subtitle, version, repository, report_date):
+    key = content_hash('cover', str(TEMPLATE_VERSION), title, subtitle, version, repository, report_date)
+    data = read_cache('templates', key, '.docx')
+    if data is None:
+        from docx import Document
+
+        doc = Document(io.BytesIO(base_template()))
+        add_cover_page(doc, {
+            'title': title,
+            'subtitle': subtitle,
+            'version': version,
+            'repository': repository,
+            'report_date': date.fromisoformat(report_date),
+        })
+        data = _save_bytes(doc)
+        write_cache('templates', key, data, '.docx')
+    return data
+
+
+def template_document(config):
+    """Return a fresh document holding the styles and cover page for a resolved config
+
+    The serialized template is built once per template version and cover
+    text, then every report just reopens a copy of those bytes.
+    """
+    from docx import Document
+
+    data = _front_matter_template(
+        config['title'],
+        config['subtitle'],
+        config['version'],
+        config['repository'],
+        config['report_date'].strftime('%Y-%m-%d'),
+    )
+    return Document(io.BytesIO(data))
+
+
+# ===== SECTIONS =====
+
+def add_software_and_tools(doc, config):
+    """Add the software, tools, and frameworks section"""
+    doc.add_heading('3. Software, Tools, and Frameworks', level=1)
+
+    doc.add_heading('3.1 Core Technologies', level=2)
+
+    from report_pubspec import load_dependencies
+
+    deps = load_dependencies()
+    resolved = {package['name']: package['resolved'] for package in deps['direct']}
+
+    tech_data = [
+        ('Flutter', deps['sdks'].get('flutter', 'any'), 'Cross-platform mobile framework'),
+        ('Dart', deps['sdk'] or deps['sdks'].get('dart', 'any'), 'Programming language'),
+        ('Firebase', f"firebase_core {resolved.get('firebase_core') or 'n/a'}", 'Backend services'),
+        ('BLoC', f"flutter_bloc {resolved.get('flutter_bloc') or 'n/a'}", 'State management'),
+    ]
+
+    add_bulk_table(doc, tech_data, header=('Technology', 'Version', 'Purpose'))
+
+    doc.add_heading('3.2 Key Dependencies', level=2)
+    hosted = [package for package in deps['direct'] if package['source'] != 'sdk']
+    dev = sum(package['dev'] for package in hosted)
+    doc.add_paragraph(
+        f'pubspec.yaml declares {len(hosted) - dev} packages and {dev} development packages; '
+        f'pubspec.lock resolves them together with {len(deps["transitive"])} transitive packages.'
+    )
+
+    add_bulk_table(
+        doc,
+        ((package['name'], package['constraint'], package['resolved'] or package['source'],
+          PACKAGE_PURPOSES.get(package['name'], '')) for package in hosted),
+        header=('Package', 'Constraint', 'Resolved', 'Purpose'),
+        column_styles=[{'mono': True}, {'mono': True}, {'mono': True}],
+    )
+
+    doc.add_heading('3.3 Development Tools', level=2)
+    tools = [
+        'IDE: Android Studio / Visual Studio Code',
+        'Version Control: Git',
+        'Firebase Console: Backend management',
+        'Flutter DevTools: Debugging and profiling'
+    ]
+    for tool in tools:
+        doc.add_paragraph(tool, style='List Bullet')
 
-doc.add_heading('6.3 Authentication Flow with BLoC Listener', level=2)
-
-auth_listener_code = """BlocListener<AuthBloc, AuthState>(
-  listenWhen: (previous, current) => previous.status != current.status,
-  listener: (context, state) {
-    if (state.status == AuthStatus.unauthenticated) {
-      _navigatorKey.currentState?.pushNamedAndRemoveUntil(
-        LoginScreen.routeName,
-        (route) => false,
-      );
-    }
-  },
-  child: MaterialApp(
-    navigatorKey: _navigatorKey,
-    // ... routes
-  ),
-)"""
-
-add_code_block(doc, auth_listener_code, "dart")
-
-doc.add_paragraph(
-    'Explanation: BlocListener monitors auth state changes without rebuilding UI. '
-    'listenWhen prevents unnecessary listener executions. '
-    'Global navigation key allows navigation from outside widget context, and '
-    'pushNamedAndRemoveUntil clears the navigation stack when logging out.'
-)
+    doc.add_page_break()
 
-doc.add_page_break()
 
-doc.add_heading('6.4 Firestore Service Implementation', level=2)
+def add_database_design(doc, config):
+    """Add the database and data handling section"""
+    doc.add_heading('4. Database and Data Handling Design', level=1)
 
-firestore_code = """class FirestoreService {
-  final FirebaseFirestore _firestore;
+    doc.add_heading('4.1 Firebase Firestore Structure', level=2)
+    from report_schema import load_schema, schema_tree
 
-  FirestoreService(this._firestore);
+    schema = load_schema()
+    doc.add_paragraph(
+        'The application uses Cloud Firestore with the following collection structure, '
+        'generated from the toMap() methods in lib/models and the paths in firestore.rules:'
+    )
 
-  CollectionReference collection(String path) {
-    return _firestore.collection(path);
-  }
+    add_code_block(doc, schema_tree(schema))
 
-  Future<DocumentSnapshot> getDocument(String path, String id) async {
-    return await _firestore.collection(path).doc(id).get();
-  }
+    doc.add_heading('4.2 Data Models', level=2)
+    doc.add_paragraph('Each model is stored in the collections its repositories read it from:')
 
-  Stream<QuerySnapshot> getCollectionStream(
-    String path,
-    {List<WhereCondition>? where, String? orderBy}
-  ) {
-    Query query = _firestore.collection(path);
+    add_bulk_table(
+        doc,
+        ((model, ', '.join(schema['model_collections'].get(model, [])) or '-', len(fields))
+         for model, fields in sorted(schema['models'].items())),
+        header=('Model', 'Collections', 'Stored Fields'),
+        column_styles=[{}, {}, {'align': 'right'}],
+    )
 
-    if (where != null) {
-      for (var condition in where) {
-        query = query.where(condition.field, isEqualTo: condition.value);
-      }
-    }
+    doc.add_paragraph('Example AppUser Model (AppUser.fromMap and AppUser.toMap):')
 
-    if (orderBy != null) {
-      query = query.orderBy(orderBy);
-    }
+    add_source_snippet(doc, APP_USER_FROM_MAP)
+    add_source_snippet(doc, APP_USER_TO_MAP)
 
-    return query.snapshots();
-  }
-}"""
+    doc.add_page_break()
 
-add_code_block(doc, firestore_code, "dart")
 
-doc.add_paragraph(
-    'Explanation: Wraps FirebaseFirestore for easier testing and mocking. '
-    'Provides generic CRUD operations, supports real-time streams for reactive UI, '
-    'and allows query composition with where clauses and ordering.'
-)
+def add_security_considerations(doc, config):
+    """Add the security considerations section"""
+    doc.add_heading('8. Security Considerations', level=1)
 
-doc.add_heading('6.5 Storage Service for Image Handling', level=2)
-
-storage_code = """class StorageService {
-  final FirebaseStorage _storage;
-
-  StorageService(this._storage);
-
-  Future<String> uploadPetImage(String petId, File imageFile) async {
-    try {
-      final ref = _storage.ref()
-          .child('pets/$petId/${DateTime.now().millisecondsSinceEpoch}');
-      
-      final uploadTask = ref.putFile(imageFile);
-      final snapshot = await uploadTask.whenComplete(() {});
-      
-      final downloadUrl = await snapshot.ref.getDownloadURL();
-      return downloadUrl;
-    } catch (e) {
-      throw Exception('Failed to upload image: $e');
-    }
-  }
-
-  Future<void> deleteFile(String url) async {
-    try {
-      final ref = _storage.refFromURL(url);
-      await ref.delete();
-    } catch (e) {
-      throw Exception('Failed to delete file: $e');
-    }
-  }
-}"""
-
-add_code_block(doc, storage_code, "dart")
-
-doc.add_paragraph(
-    'Explanation: Encapsulates Firebase Storage operations, generates unique file paths, '
-    'returns download URLs for Firestore storage, and handles cleanup when images are updated/deleted.'
-)
+    doc.add_heading('8.1 Authentication Security', level=2)
+    security_points = [
+        'Firebase Authentication handles password hashing and secure token management',
+        'Email verification for new accounts',
+        'Password reset functionality with secure tokens'
+    ]
+    for point in security_points:
+        doc.add_paragraph(point, style='List Bullet')
+
+    doc.add_heading('8.2 Data Access Rules', level=2)
+    from report_schema import load_schema
+
+    schema = load_schema()
+    doc.add_paragraph('Access to each collection is enforced by firestore.rules:')
+
+    rows = []
+    for collection in schema['collections']:
+        rules = collection['rules'] or [{'operations': ['all'], 'condition': 'no rule (denied by default)'}]
+        for rule in rules:
+            rows.append((f"{collection['name']}/{collection['doc_id']}", ', '.join(rule['operations']),
+                         rule['condition']))
+    add_bulk_table(doc, rows, header=('Collection', 'Operations', 'Condition'),
+                   column_styles=[{}, {}, {'mono': True}])
+
+    doc.add_paragraph('The deployed rules file:')
+    add_code_block(doc, schema['rules_text'], "rules")
+
+    doc.add_heading('8.3 Storage Security', level=2)
+    doc.add_paragraph('Firebase Storage rules for authenticated access only:', style='List Bullet')
+    doc.add_paragraph('User-specific paths prevent unauthorized access', style='List Bullet')
+
+    doc.add_page_break()
 
-doc.add_page_break()
-
-# ===== TECHNICAL CHALLENGES =====
-doc.add_heading('7. Technical Challenges and Solutions', level=1)
-
-challenges = [
-    {
-        'title': 'Asynchronous Initialization',
-        'problem': 'Firebase and notification services require async initialization that could block app startup.',
-        'solution': 'Initialize critical services (Firebase) synchronously in main(), then initialize non-critical services (notifications) asynchronously in widget\'s initState().',
-        'outcome': 'Faster app startup with better user experience.'
-    },
-    {
-        'title': 'State Management Complexity',
-        'problem': 'Managing multiple interconnected states across different screens.',
-        'solution': 'Implemented BLoC pattern with separate domain-specific BLoCs (AuthBloc, PetBloc, BookingBloc).',
-        'outcome': 'Predictable state transitions, easy debugging, and testable business logic.'
-    },
-    {
-        'title': 'Real-time Data Synchronization',
-        'problem': 'Keeping UI synchronized with Firestore changes from multiple users/devices.',
-        'solution': 'Use Firestore streams instead of futures. BLoCs subscribe to streams using emit.forEach().',
-        'outcome': 'Automatic UI updates when Firestore data changes, no manual refresh required.'
-    },
-    {
-        'title': 'Navigation After Logout',
-        'problem': 'Users could navigate back to authenticated screens after logout.',
-        'solution': 'Use pushNamedAndRemoveUntil() to clear entire navigation stack on logout.',
-        'outcome': 'Complete navigation stack cleared, better security, consistent auth flow.'
-    },
-    {
-        'title': 'Image Upload and Management',
-        'problem': 'Handling image uploads, storage, and cleanup efficiently.',
-        'solution': 'Encapsulate image operations in StorageService, delete old images before uploading new ones.',
-        'outcome': 'Optimized storage usage, proper error handling, consistent image URLs.'
-    },
-    {
-        'title': 'Role-Based Access Control',
-        'problem': 'Different user types need access to different features.',
-        'solution': 'Use UserRole enum, implement conditional routing and UI rendering based on role.',
-        'outcome': 'Secure access control, customized user experience per role.'
-    },
-]
-
-for i, challenge in enumerate(challenges, 1):
-    doc.add_heading(f'7.{i} {challenge["title"]}', level=2)
-    doc.add_paragraph(f'Problem: {challenge["problem"]}', style='List Bullet')
-    doc.add_paragraph(f'Solution: {challenge["solution"]}', style='List Bullet')
-    doc.add_paragraph(f'Outcome: {challenge["outcome"]}', style='List Bullet')
-
-doc.add_page_break()
-
-# ===== SECURITY CONSIDERATIONS =====
-doc.add_heading('8. Security Considerations', level=1)
-
-doc.add_heading('8.1 Authentication Security', level=2)
-security_points = [
-    'Firebase Authentication handles password hashing and secure token management',
-    'Email verification for new accounts',
-    'Password reset functionality with secure tokens'
-]
-for point in security_points:
-    doc.add_paragraph(point, style='List Bullet')
-
-doc.add_heading('8.2 Data Access Rules', level=2)
-doc.add_paragraph('Firestore security rules should enforce user-specific access:')
-
-firestore_rules = """rules_version = '2';
-service cloud.firestore {
-  match /databases/{database}/documents {
-    match /users/{userId} {
-      allow read: if request.auth != null;
-      allow write: if request.auth.uid == userId;
-    }
-    
-    match /pets/{petId} {
-      allow read: if request.auth != null;
-      allow write: if request.auth != null && 
-                    resource.data.ownerId == request.auth.uid;
-    }
-    
-    match /bookings/{bookingId} {
-      allow read: if request.auth != null && 
-                 (resource.data.ownerId == request.auth.uid ||
-                  resource.data.providerId == request.auth.uid);
-    }
-  }
-}"""
-
-add_code_block(doc, firestore_rules)
-
-doc.add_heading('8.3 Storage Security', level=2)
-doc.add_paragraph('Firebase Storage rules for authenticated access only:', style='List Bullet')
-doc.add_paragraph('User-specific paths prevent unauthorized access', style='List Bullet')
-
-doc.add_page_break()
-
-# ===== PERFORMANCE OPTIMIZATIONS =====
-doc.add_heading('9. Performance Optimizations', level=1)
-
-doc.add_heading('9.1 Lazy Loading', level=2)
-doc.add_paragraph('BLoCs created only when needed', style='List Bullet')
-doc.add_paragraph('Images loaded on demand with caching', style='List Bullet')
-
-doc.add_heading('9.2 Real-time Data Optimization', level=2)
-doc.add_paragraph('Firestore queries with indexes for faster retrieval', style='List Bullet')
-doc.add_paragraph('Limited collection queries with where clauses', style='List Bullet')
-doc.add_paragraph('Pagination for large lists (recommended implementation)', style='List Bullet')
-
-doc.add_heading('9.3 State Management Efficiency', level=2)
-doc.add_paragraph('listenWhen and buildWhen prevent unnecessary rebuilds', style='List Bullet')
-doc.add_paragraph('emit.forEach handles stream subscriptions efficiently', style='List Bullet')
-doc.add_paragraph('Immutable state with copyWith for predictable updates', style='List Bullet')
-
-doc.add_page_break()
-
-# ===== TESTING STRATEGY =====
-doc.add_heading('10. Testing Strategy', level=1)
-
-doc.add_heading('10.1 Unit Testing', level=2)
-doc.add_paragraph('BLoC business logic tested in isolation:', style='List Bullet')
-doc.add_paragraph('Mock repositories and services', style='List Bullet')
-doc.add_paragraph('Test state transitions and event handling', style='List Bullet')
-
-unit_test_code = """void main() {
-  group('PetBloc', () {
-    late PetRepository mockRepository;
-    late PetBloc petBloc;
-
-    setUp(() {
-      mockRepository = MockPetRepository();
-      petBloc = PetBloc(petRepository: mockRepository);
-    });
-
-    test('emits success state when pets are loaded', () async {
-      when(() => mockRepository.getPetsByOwner(any()))
-          .thenAnswer((_) => Stream.value([mockPet]));
-
-      expectLater(
-        petBloc.stream,
-        emitsInOrder([
-          isA<PetState>().having((s) => s.status, 'status', PetStatus.loading),
-          isA<PetState>().having((s) => s.status, 'status', PetStatus.success),
-        ]),
-      );
-
-      petBloc.add(LoadPets(ownerId: 'test-owner'));
-    });
-  });
-}"""
-
-add_code_block(doc, unit_test_code, "dart")
-
-doc.add_heading('10.2 Widget Testing', level=2)
-doc.add_paragraph('UI components tested in isolation', style='List Bullet')
-doc.add_paragraph('Mock BLoC states', style='List Bullet')
-doc.add_paragraph('Test user interactions', style='List Bullet')
-
-doc.add_heading('10.3 Integration Testing', level=2)
-doc.add_paragraph('Complete user flows tested', style='List Bullet')
-doc.add_paragraph('Firebase integration tested', style='List Bullet')
-doc.add_paragraph('Navigation flows tested', style='List Bullet')
-
-doc.add_page_break()
-
-# ===== FUTURE ENHANCEMENTS =====
-doc.add_heading('11. Future Enhancements', level=1)
-
-doc.add_heading('11.1 Recommended Technical Improvements', level=2)
-
-enhancements = [
-    'Pagination: Implement pagination for large lists',
-    'Offline Support: Enhanced offline capabilities with local database (Hive/Drift)',
-    'Error Tracking: Integrate Crashlytics for production monitoring',
-    'Analytics: Add Firebase Analytics for user behavior tracking',
-    'Automated Testing: Increase test coverage to 80%+',
-    'CI/CD: Set up automated build and deployment pipelines',
-    'Performance Monitoring: Integrate Firebase Performance Monitoring',
-    'Search Functionality: Implement Algolia or Elasticsearch',
-    'Payment Integration: Add Stripe/PayPal for booking payments',
-    'Chat Feature: Real-time messaging between owners and providers'
-]
-
-for i, enhancement in enumerate(enhancements, 1):
-    doc.add_paragraph(f'{i}. {enhancement}')
-
-doc.add_page_break()
-
-# ===== CONCLUSION =====
-doc.add_heading('12. Conclusion', level=1)
-
-conclusion_text = (
-    'PetPal demonstrates a well-architected Flutter application following industry best practices. '
-    'The application successfully integrates multiple Firebase services (Authentication, Firestore, Storage, Messaging) '
-    'with a robust state management solution, providing a solid foundation for a production-ready pet care management platform.\n\n'
-    'Key Strengths:\n'
-    '• Clean Architecture: Clear separation of concerns with BLoC pattern\n'
-    '• Scalability: Modular design allows easy feature additions\n'
-    '• Maintainability: Consistent code structure and patterns\n'
-    '• Real-time Capabilities: Leveraging Firebase for real-time data sync\n'
-    '• User Experience: Responsive UI with proper loading and error states\n'
-    '• Security: Firebase Authentication and Firestore rules for data protection'
-)
 
-doc.add_paragraph(conclusion_text)
+# Long statistics tables are split into tables of this many rows, which
+# Word lays out much faster than one huge table
+STATS_CHUNK_ROWS = 5000
 
-doc.add_paragraph()
-doc.add_paragraph('---')
-doc.add_paragraph('Report Prepared By: Technical Analysis Team')
-doc.add_paragraph(f'Date: {datetime.now().strftime("%B %d, %Y")}')
-doc.add_paragraph('Version: 1.0')
+STATS_HEADERS = ('Total', 'Completed', 'Upcoming', 'Pending', 'Unique Vets')
 
-# Save document
-output_path = r'c:\Users\ammar\Documents\GitHub\MobileApp_PetPal\PetPal_Technical_Report.docx'
-doc.save(output_path)
-print(f'Document successfully created at: {output_path}')
\ No newline at end of file
+
+@traced()
+def add_stats_table(doc, first_header, rows, keys, headers, limit=None):
+    """Add a statistics table with one row per group, noting any rows left out"""
+    shown = rows[:limit] if limit else rows
+    add_bulk_table(
+        doc,
+        ((row['key'],) + tuple(f'{row[key]:,}' for key in keys) for row in shown),
+        header=(first_header,) + tuple(headers),
+        column_styles=[{}] + [{'align': 'right'}] * len(keys),
+        chunk_rows=STATS_CHUNK_ROWS,
+    )
+    if len(shown) < len(rows):
+        doc.add_paragraph(f'Showing the {len(shown)} busiest of {len(rows):,}.')
+
+
+def add_data_statistics(doc, config):
+    """Add the booking and activity statistics appendix, if exports are configured"""
+    bookings, activities = config['bookings_export'], config['activities_export']
+    if not (bookings or activities):
+        return
+    import report_data
+
+    data = report_data.load_export(bookings, activities, config['users_export'])
+    start, end = report_data.window_bounds(config['stats_start'], config['stats_end'])
+    as_of = report_data.day_start(config['report_date'])
+    limit = config['stats_table_rows']
+
+    doc.add_page_break()
+    doc.add_heading('Appendix A. Booking and Activity Statistics', level=1)
+    if start is None and end is None:
+        period = 'all dates'
+    elif end is None:
+        period = f'dates from {config["stats_start"].isoformat()}'
+    elif start is None:
+        period = f'dates until {config["stats_end"].isoformat()}'
+    else:
+        period = f'{config["stats_start"].isoformat()} to {config["stats_end"].isoformat()}'
+    doc.add_paragraph(
+        f'Computed from a Firestore export of {data.bookings:,} bookings and {data.activities:,} activity logs '
+        f'covering {period}. Upcoming counts accepted bookings on or after '
+        f'{config["report_date"].strftime("%B %d, %Y")}.'
+    )
+
+    # Start the charts first so they are drawn while the tables are built
+    charts = []
+    month_rows = report_data.booking_stats(data, 'month', as_of, start, end) if bookings else []
+    activity_month_rows = report_data.activity_stats(data, 'month', start, end) if activities else []
+    import report_charts
+
+    if report_charts.available():
+        for caption, spec in stats_chart_specs(data, month_rows, activity_month_rows, start, end):
+            charts.append((caption, report_charts.submit(spec)))
+
+    keys = report_data.STAT_KEYS
+    # Subsections are numbered as written, since some are skipped without data
+    numbers = itertools.count(1)
+    if bookings:
+        doc.add_heading(f'A.{next(numbers)} Bookings by Pet', level=2)
+        add_stats_table(doc, 'Pet', report_data.booking_stats(data, 'pet', as_of, start, end),
+                        keys, STATS_HEADERS, limit)
+
+        doc.add_heading(f'A.{next(numbers)} Bookings by Vet', level=2)
+        add_stats_table(doc, 'Vet', report_data.booking_stats(data, 'vet', as_of, start, end),
+                        keys, STATS_HEADERS, limit)
+
+        if data.clinic_of:
+            doc.add_heading(f'A.{next(numbers)} Bookings by Clinic', level=2)
+            add_stats_table(doc, 'Clinic', report_data.booking_stats(data, 'clinic', as_of, start, end),
+                            keys, STATS_HEADERS, limit)
+
+        doc.add_heading(f'A.{next(numbers)} Bookings by Month', level=2)
+        add_stats_table(doc, 'Month', month_rows, keys, STATS_HEADERS)
+
+    if activities:
+        activity_keys = ('total',) + report_data.ACTIVITY_TYPES
+        activity_headers = ('Total',) + tuple(kind.title() for kind in report_data.ACTIVITY_TYPES)
+        doc.add_heading(f'A.{next(numbers)} Activity Mix by Pet', level=2)
+        add_stats_table(doc, 'Pet', report_data.activity_stats(data, 'pet', start, end),
+                        activity_keys, activity_headers, limit)
+
+        doc.add_heading(f'A.{next(numbers)} Activity Mix by Month', level=2)
+        add_stats_table(doc, 'Month', activity_month_rows, activity_keys, activity_headers)
+
+    if charts:
+        from docx.shared import Inches
+
+        doc.add_heading(f'A.{next(numbers)} Charts', level=2)
+        for caption, future in charts:
+            doc.add_picture(io.BytesIO(future.result()), width=Inches(6.5))
+            doc.add_paragraph(caption, style='Caption')
+
+
+def stats_chart_specs(data, month_rows, activity_month_rows, start, end):
+    """Return ``(caption, chart spec)`` pairs for the statistics appendix, captions numbered in order"""
+    import report_data
+
+    specs = []
+    if month_rows:
+        specs.append(('Booking volume per month', {
+            'kind': 'line',
+            'title': 'Booking Volume',
+            'labels': [row['key'] for row in month_rows],
+            'series': {'Total': [row['total'] for row in month_rows],
+                       'Completed': [row['completed'] for row in month_rows]},
+            'ylabel': 'Bookings',
+        }))
+        statuses = report_data.status_counts(data, start, end)
+        specs.append(('Bookings by status', {
+            'kind': 'pie',
+            'title': 'Status Breakdown',
+            'labels': [status.title() for status in statuses],
+            'series': {'Bookings': list(statuses.values())},
+        }))
+    if activity_month_rows:
+        specs.append(('Activity logs per month by type', {
+            'kind': 'bar',
+            'title': 'Activity Mix',
+            'labels': [row['key'] for row in activity_month_rows],
+            'series': {kind.title(): [row[kind] for row in activity_month_rows]
+                       for kind in report_data.ACTIVITY_TYPES},
+            'ylabel': 'Activities',
+        }))
+    return [(f'Figure A.{number}: {caption}', spec) for number, (caption, spec) in enumerate(specs, 1)]
+
+
+PHOTO_WIDTH = 2.0  # inches
+PHOTO_COLUMNS = 3
+
+PROVIDER_ROLES = ('vet', 'sitter')
+
+
+def photo_subjects(config):
+    """Return the pets and providers with a picture as ``(kind, caption, image ref)``"""
+    import report_data
+
+    subjects = []
+    if config['pets_export']:
+        pets = [doc for doc in report_data.iter_documents(config['pets_export']) if doc.get('imageUrl')]
+        pets.sort(key=lambda pet: (str(pet.get('name') or ''), str(pet.get('id'))))
+        for pet in pets:
+            details = ' \u00b7 '.join(str(pet[key]) for key in ('species', 'breed') if pet.get(key))
+            subjects.append(('pet', f'{pet.get("name") or pet.get("id")}\n{details}'.rstrip(), pet['imageUrl']))
+    if config['users_export']:
+        providers = [doc for doc in report_data.iter_documents(config['users_export'])
+                     if doc.get('role') in PROVIDER_ROLES and doc.get('profileImageUrl')]
+        providers.sort(key=lambda user: (user['role'], str(user.get('name') or ''), str(user.get('id'))))
+        for user in providers:
+            detail = user.get('clinicLocation') or user.get('serviceArea') or ''
+            caption = f'{user.get("name") or user.get("id")}\n{user["role"].title()}'
+            subjects.append(('provider', f'{caption} \u00b7 {detail}' if detail else caption, user['profileImageUrl']))
+    return subjects
+
+
+@traced()
+def add_photo_grid(doc, entries):
+    """Add ``(caption, image bytes)`` pairs as a borderless grid of captioned photos"""
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Inches
+
+    if getattr(doc, 'backend', 'docx') != 'docx':
+        doc.add_image_grid(entries, Inches(PHOTO_WIDTH), PHOTO_COLUMNS)
+        return
+    table = doc.add_table(rows=0, cols=PHOTO_COLUMNS)
+    for start in range(0, len(entries), PHOTO_COLUMNS):
+        cells = table.add_row().cells
+        for cell, (caption, image) in zip(cells, entries[start:start + PHOTO_COLUMNS]):
+            picture = cell.paragraphs[0]
+            picture.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            picture.add_run().add_picture(io.BytesIO(image), width=Inches(PHOTO_WIDTH))
+            label = cell.add_paragraph(caption, style='Caption')
+            label.alignment = WD_ALIGN_PARAGRAPH.CENTER
+
+
+def add_photo_gallery(doc, config):
+    """Add the pet and provider photo appendix, if a pets or users export is configured"""
+    if not (config['pets_export'] or config['users_export']):
+        return
+    import report_images
+
+    subjects = photo_subjects(config)
+    limit = config['photo_limit']
+    shown = {kind: [s for s in subjects if s[0] == kind][:limit or None] for kind in ('pet', 'provider')}
+    images, missing = report_images.prepare_images(
+        [ref for kind in shown for _, _, ref in shown[kind]],
+        PHOTO_WIDTH, config['image_dpi'], config['images_dir'],
+    )
+    if not images:
+        return
+
+    # The statistics appendix comes first when this report (spec and variant) has one
+    stats = (config['bookings_export'] or config['activities_export']) and any(
+        add_section is add_data_statistics for _, add_section in report_sections(config))
+    appendix = 'B' if stats else 'A'
+    doc.add_page_break()
+    doc.add_heading(f'Appendix {appendix}. Pet and Provider Photos', level=1)
+    doc.add_paragraph(
+        f'Photos are downscaled to {PHOTO_WIDTH:g} inches at {config["image_dpi"]} DPI; '
+        'a photo used more than once is stored once in this document.'
+    )
+    titles = {'pet': 'Pets', 'provider': 'Vets and Sitters'}
+    number = 0
+    for kind in ('pet', 'provider'):
+        entries = [(caption, images[ref]) for _, caption, ref in shown[kind] if ref in images]
+        if not entries:
+            continue
+        number += 1
+        doc.add_heading(f'{appendix}.{number} {titles[kind]}', level=2)
+        add_photo_grid(doc, entries)
+        total = sum(1 for s in subjects if s[0] == kind)
+        if len(shown[kind]) < total:
+            doc.add_paragraph(f'Showing the first {len(shown[kind])} of {total:,} photos.')
+    if missing:
+        doc.add_paragraph(f'{len(missing):,} photo(s) could not be found or read.')
+
+
+# Sections built from data in Python, which the report spec places by name;
+# each is called as ``add_section(doc, config)``
+BUILTIN_SECTIONS = {
+    'toc': add_table_of_contents,
+    'software_and_tools': add_software_and_tools,
+    'database_design': add_database_design,
+    'security_considerations': add_security_considerations,
+    'data_statistics': add_data_statistics,
+    'photo_gallery': add_photo_gallery,
+}
+
+
+def render_nodes(doc, nodes, config):
+    """Add the content of compiled spec nodes (see report_spec.py)"""
+    from docx.shared import Emu
+
+    for node in nodes:
+        kind = node[0]
+        if kind == 'heading':
+            _, text, level, template = node
+            doc.add_heading(text.format_map(config) if template else text, level=level)
+        elif kind == 'paragraph':
+            _, text, style, indent, template = node
+            paragraph = doc.add_paragraph(text.format_map(config) if template else text, style=style)
+            if indent is not None:
+                paragraph.paragraph_format.left_indent = Emu(indent)
+        elif kind == 'code':
+            add_code_block(doc, node[1], node[2])
+        elif kind == 'snippet':
+            _, ref, language, start, max_lines = node
+            add_source_snippet(doc, ref, language, start=start, max_lines=max_lines)
+        elif kind == 'page_break':
+            doc.add_page_break()
+        else:
+            raise ValueError(f'unknown report spec node {kind!r}')
+
+
+class SpecSection:
+    """A section described by the report spec, called like any ``add_section``"""
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        # Stands in for the section's source in its fingerprint
+        self.key = content_hash(repr(nodes))
+
+    def __call__(self, doc, config):
+        render_nodes(doc, self.nodes, config)
+
+
+def report_sections(config):
+    """Return the ``[(name, add_section)]`` list for a config's report spec and variant"""
+    from report_spec import load_sections
+
+    variant = config['variant'] or DEFAULT_VARIANT
+    check_variant(config, variant)
+    return [(name, add_section) for name, add_section, variants in load_sections(config['spec'] or DEFAULT_SPEC)
+            if variants is None or variant in variants]
+
+
+def check_variant(config, variant):
+    """Raise ValueError unless the config's report spec declares ``variant``"""
+    from report_spec import load_variants
+
+    declared = load_variants(config['spec'] or DEFAULT_SPEC)
+    if variant not in declared:
+        raise ValueError(f'Report variant {variant!r} is not in the report spec; '
+                         f'expected one of {", ".join(declared)}')
+
+
+def variant_config(config, variant=None):
+    """Return a resolved config for ``variant`` (default: its own), with the spec's overrides applied"""
+    from report_spec import load_variants
+
+    variant = variant or config['variant'] or DEFAULT_VARIANT
+    check_variant(config, variant)
+    overrides = load_variants(config['spec'] or DEFAULT_SPEC)[variant]
+    return dict(config, variant=None if variant == DEFAULT_VARIANT else variant, **overrides)
+
+
+# ===== INCREMENTAL BUILD =====
+
+# Section functions that hold live references into the document (the TOC
+# placeholder) and so are always rendered afresh, whatever the spec names them
+UNCACHED_SECTIONS = (BUILTIN_SECTIONS['toc'],)
+
+# Input files read and directories listed by the section being rendered
+# incrementally, path -> hash
+_dependencies = None
+
+
+def record_dependency(path, digest):
+    """Note that the section being rendered read ``path`` with content hash ``digest``
+
+    ``path`` may be a directory the section listed, hashed by
+    ``directory_digest``, so that adding or removing a file invalidates it.
+    """
+    if _dependencies is not None:
+        _dependencies[path] = digest
+
+
+def file_digest(path):
+    """Return the content hash of a file, or None if it cannot be read
+
+    Matches ``content_hash(data)`` but reads in blocks, since dependencies
+    include data exports far larger than the sources.
+    """
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            digest.update(os.fstat(f.fileno()).st_size.to_bytes(8, 'little'))
+            for block in iter(functools.partial(f.read, 1 << 20), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def directory_digest(path):
+    """Return the content hash of the file names under a directory tree, or None if it is not a directory"""
+    if not os.path.isdir(path):
+        return None
+    names = sorted(
+        os.path.relpath(os.path.join(dirpath, name), path).replace(os.sep, '/')
+        for dirpath, _, filenames in os.walk(path)
+        for name in filenames
+    )
+    return content_hash('listing', *names)
+
+
+def dependency_digest(path):
+    """Return the current hash of a recorded dependency: a directory's listing, else the file's content"""
+    return directory_digest(path) if os.path.isdir(path) else file_digest(path)
+
+
+class _ConfigReads(dict):
+    """Config mapping that remembers which keys a section reads"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.reads = set()
+
+    def __getitem__(self, key):
+        self.reads.add(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.reads.add(key)
+        return super().get(key, default)
+
+
+def _config_token(value):
+    return value.isoformat() if isinstance(value, date) else value
+
+
+@functools.lru_cache(maxsize=None)
+def section_fingerprint(add_section):
+    """Hash a section's code plus the module-level helpers and constants it uses"""
+    if isinstance(add_section, SpecSection):
+        return content_hash(section_fingerprint(render_nodes), add_section.key)
+    parts, seen = [], set()
+
+    def names(code):
+        yield from code.co_names
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                yield from names(const)
+
+    def visit(func):
+        # Look through report_trace wrappers to the code they wrap
+        func = inspect.unwrap(func)
+        if func in seen:
+            return
+        seen.add(func)
+        parts.append(inspect.getsource(func))
+        for name in sorted(set(names(func.__code__))):
+            value = func.__globals__.get(name)
+            if inspect.isfunction(value) and value.__module__ == func.__module__:
+                visit(value)
+            elif isinstance(value, (str, int, float, list, tuple, dict)):
+                try:
+                    parts.append(f'{name}={json.dumps(value, sort_keys=True)}')
+                except TypeError:
+                    pass
+
+    visit(add_section)
+    return content_hash(str(SECTION_CACHE_VERSION), str(TEMPLATE_VERSION), *parts)
+
+
+def section_wrapper(xml):
+    """Parse block-level XML into the ``w:body`` wrapper ``_append_section_xml`` unwraps"""
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import nsdecls
+
+    return parse_xml(f'<w:body {nsdecls("w")}>{xml}</w:body>')
+
+
+def _append_section_xml(doc, xml):
+    """Insert block-level XML (or a ``section_wrapper``) at the end of the body, before the final sectPr"""
+    from docx.oxml.ns import qn
+
+    body = doc.element.body
+    # The section properties are always the body's last child; python-docx's
+    # body.sectPr (like len(body)) walks every child, which is quadratic over
+    # many appends
+    sect_pr = next(body.iterchildren(reversed=True), None)
+    if sect_pr is not None and sect_pr.tag != qn('w:sectPr'):
+        sect_pr = None
+    wrapper = section_wrapper(xml) if isinstance(xml, str) else xml
+    # Move the fragment's root across documents, then unwrap it in place:
+    # lxml reconciles namespaces for every node when moving a child out of
+    # another document, which is quadratic for large tables
+    if sect_pr is not None:
+        sect_pr.addprevious(wrapper)
+    else:
+        body.append(wrapper)
+    for element in list(wrapper):
+        wrapper.addprevious(element)
+    body.remove(wrapper)
+
+
+def render_section(doc, name, add_section, config):
+    """Add a section, reusing its cached XML when none of its inputs changed
+
+    A section's cache entry is keyed by its code fingerprint and the values
+    of the config keys it read last time; the input files it read must still
+    have the same content. Returns True if the cached XML was reused.
+    """
+    global _dependencies
+    from lxml import etree
+
+    index = getattr(doc, 'heading_index', None)
+    fingerprint = section_fingerprint(add_section)
+    reads_key = content_hash('reads', fingerprint, name)
+    reads = read_cache('sections', reads_key, '.json')
+    if reads is not None:
+        reads = json.loads(reads)
+        variant = content_hash(fingerprint, name, json.dumps(
+            {key: _config_token(config.get(key)) for key in reads}, sort_keys=True))
+        entry = read_cache('sections', variant, '.json')
+        if entry is not None:
+            entry = json.loads(entry)
+            if all(dependency_digest(path) == digest for path, digest in entry['deps'].items()):
+                _append_section_xml(doc, entry['xml'])
+                if index is not None:
+                    index.entries.extend(tuple(heading) for heading in entry['headings'])
+                return True
+
+    body = doc.element.body
+    start = len(body) - (body.sectPr is not None)
+    rels = len(doc.part.rels)
+    headings = len(index.entries) if index is not None else 0
+    tracked = _ConfigReads(config)
+    _dependencies = {}
+    try:
+        add_section(doc, tracked)
+        deps = _dependencies
+    finally:
+        _dependencies = None
+    if isinstance(config, _ConfigReads):
+        config.reads |= tracked.reads
+
+    # Sections that add images or links need their parts too, so are not cached
+    if len(doc.part.rels) != rels:
+        return False
+    end = len(body) - (body.sectPr is not None)
+    xml = ''.join(etree.tostring(element, encoding='unicode') for element in body[start:end])
+
+    reads = sorted(tracked.reads)
+    variant = content_hash(fingerprint, name, json.dumps(
+        {key: _config_token(config.get(key)) for key in reads}, sort_keys=True))
+    write_cache('sections', reads_key, json.dumps(reads).encode('utf-8'), '.json')
+    entry = {'xml': xml, 'deps': deps, 'headings': index.entries[headings:] if index is not None else []}
+    write_cache('sections', variant, json.dumps(entry).encode('utf-8'), '.json')
+    return False
+
+
+def add_report_section(doc, name, add_section, config, incremental=False):
+    """Add one section, from the section cache if ``incremental`` allows"""
+    with span(name, 'section', doc):
+        if incremental and CACHE_DIR and add_section not in UNCACHED_SECTIONS:
+            annotate(cached=render_section(doc, name, add_section, config))
+        else:
+            add_section(doc, config)
+
+
+def build_report(config=None, incremental=False, workers=None):
+    """Build the report and return the python-docx ``Document``
+
+    With ``incremental``, sections whose code, config and input files are
+    unchanged since a previous build are spliced in from the section cache.
+    With ``workers``, sections are rendered by that many worker processes
+    and merged (see report_parallel.py).
+    """
+    if workers:
+        import report_parallel
+        return report_parallel.build_report(config, workers, incremental)
+    config = resolve_config(config)
+    with span('spec', 'template'):
+        config = variant_config(config)
+        sections = report_sections(config)
+    with span('template', 'template'):
+        doc = template_document(config)
+    index = HeadingIndex.attach(doc)
+    for name, add_section in sections:
+        add_report_section(doc, name, add_section, config, incremental)
+    with span('write_toc', 'section', doc):
+        index.write_toc()
+    set_core_properties(doc, config)
+    return doc
+
+
+def set_core_properties(doc, config):
+    """Describe the report in the document's core properties
+
+    They are dated when the report was built, or on ``report_date`` for
+    reproducible output, instead of python-docx's template defaults.
+    """
+    props = doc.core_properties
+    props.title = config['title']
+    props.subject = config['subtitle']
+    props.author = props.last_modified_by = config['prepared_by']
+    props.version = config['version']
+    props.comments = f'Generated from {config["repository"]}'
+    props.revision = 1
+    if config['reproducible']:
+        stamp = datetime.combine(config['report_date'], datetime.min.time())
+    else:
+        stamp = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    props.created = props.modified = stamp
+
+
+def render_pdf(config, out):
+    """Render the report as PDF to a path or writable binary stream
+
+    The same sections are laid out by ``report_pdf.PdfDocument``, which
+    writes each page as soon as it is full.
+    """
+    import report_pdf
+
+    config = variant_config(resolve_config(config))
+    with span('spec', 'template'):
+        sections = report_sections(config)
+    # A layout that raises leaves no output file behind
+    with report_pdf.PdfDocument(out, title=config['title'], author=config['prepared_by'],
+                                subject=config['subtitle'], compression_level=config['compression_level']) as doc:
+        add_cover_page(doc, config)
+        doc.start_outline()
+        for name, add_section in sections:
+            with span(name, 'section', doc):
+                add_section(doc, config)
+        with span('close', 'save'):
+            doc.close()
+    return doc
+
+
+def render_stream(config, out):
+    """Render the report as .docx to a path or writable binary stream, writing the body as it goes
+
+    The same sections are written by ``report_stream.StreamingDocument``
+    after the cover page and core properties of the usual template.
+    """
+    import report_stream
+
+    config = variant_config(resolve_config(config))
+    with span('template', 'template'):
+        template = template_document(config)
+        set_core_properties(template, config)
+        base = _save_bytes(template)
+    date_time = config['report_date'].timetuple()[:6] if config['reproducible'] else None
+    with span('spec', 'template'):
+        sections = report_sections(config)
+    # A build that raises leaves no output file behind
+    with report_stream.StreamingDocument(out, base, config['compression_level'], date_time) as doc:
+        for name, add_section in sections:
+            with span(name, 'section', doc):
+                add_section(doc, config)
+        # Close inside the block so the save is traced on its own
+        with span('close', 'save'):
+            doc.close()
+    return doc
+
+
+def resolve_output_format(out, output_format=None):
+    """Return 'docx' or 'pdf': the format asked for, else the one a path's extension names"""
+    if output_format is None:
+        output_format = 'pdf' if isinstance(out, str) and out.lower().endswith('.pdf') else 'docx'
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'output format must be one of {", ".join(OUTPUT_FORMATS)}, got {output_format!r}')
+    return output_format
+
+
+def zip_options(level):
+    """Return ZipFile ``(compression, compresslevel)`` for a 0-9 level; 0 stores"""
+    return (zipfile.ZIP_STORED, None) if level == 0 else (zipfile.ZIP_DEFLATED, level)
+
+
+# Earliest timestamp a zip entry can carry
+ZIP_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+CONTENT_TYPES_MEMBER = '[Content_Types].xml'
+
+
+def zip_entry(name, date_time):
+    """Return a ZipInfo for ``name`` dated ``date_time``, with the same attributes on every platform"""
+    info = zipfile.ZipInfo(name, max(tuple(date_time), ZIP_EPOCH))
+    info.create_system = 3
+    info.external_attr = 0o644 << 16
+    return info
+
+
+class _ZipPackageWriter:
+    """The physical package writer python-docx's PackageWriter expects, with our zip settings
+
+    With ``date_time``, entries are held back and written on ``close()`` in
+    name order ([Content_Types].xml first), all dated ``date_time`` and with
+    the same attributes whatever the platform, so equal parts make equal bytes.
+    """
+
+    def __init__(self, out, compression_level, date_time=None):
+        self._compression, self._compresslevel = zip_options(compression_level)
+        # ZipFile writes data descriptors when ``out`` cannot seek (pipes, sockets)
+        self._zip = zipfile.ZipFile(out, 'w', self._compression, compresslevel=self._compresslevel)
+        self._date_time = date_time
+        self._pending = [] if date_time else None
+
+    def write(self, pack_uri, blob):
+        if self._pending is not None:
+            self._pending.append((pack_uri.membername, blob))
+        else:
+            self._zip.writestr(pack_uri.membername, blob)
+
+    def close(self):
+        for name, blob in sorted(self._pending or (), key=lambda item: (item[0] != CONTENT_TYPES_MEMBER, item[0])):
+            self._zip.writestr(zip_entry(name, self._date_time), blob, self._compression, self._compresslevel)
+        self._pending = None
+        self._zip.close()
+
+
+def save_document(doc, out, compression_level=6, date_time=None):
+    """Save a python-docx document to a path or writable binary stream
+
+    Like ``doc.save(out)``, but with the zip compression level chosen:
+    0 stores the parts as they are, 1-9 deflate them. Streams need not be
+    seekable, so a socket or ``sys.stdout.buffer`` can be written directly.
+    ``date_time`` (a ``(year, month, day, hour, minute, second)`` tuple)
+    makes the zip itself reproducible; see ``_ZipPackageWriter``.
+    """
+    from docx.opc.pkgwriter import PackageWriter
+
+    package = doc.part.package
+    parts = list(package.iter_parts())
+    for part in parts:
+        part.before_marshal()
+    writer = _ZipPackageWriter(out, compression_level, date_time)
+    try:
+        PackageWriter._write_content_types_stream(writer, parts)
+        PackageWriter._write_pkg_rels(writer, package.rels)
+        PackageWriter._write_parts(writer, parts)
+    finally:
+        writer.close()
+
+
+def render_report(config, out, incremental=False, output_format=None, workers=None):
+    """Build the report and save it to a path or writable binary stream
+
+    ``output_format`` is 'docx' or 'pdf'; by default it follows the output
+    path's extension. PDFs, and .docx files with the ``streaming`` config,
+    are always built in full and in one process, as the section cache and
+    section fragments are python-docx XML trees.
+    """
+    config = resolve_config(config)
+    if resolve_output_format(out, output_format) == 'pdf':
+        return render_pdf(config, out)
+    if config['streaming']:
+        return render_stream(config, out)
+    doc = build_report(config, incremental=incremental, workers=workers)
+    date_time = config['report_date'].timetuple()[:6] if config['reproducible'] else None
+    with span('save', 'save'):
+        save_document(doc, out, config['compression_level'], date_time)
+    return doc
+
+
+def render_bytes(config=None, incremental=False, output_format='docx', workers=None):
+    """Render the report in memory and return the file's bytes"""
+    buffer = io.BytesIO()
+    render_report(config, buffer, incremental=incremental, output_format=output_format, workers=workers)
+    return buffer.getvalue()
+
+
+def load_config(path):
+    """Read a JSON report config file"""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError(f'{path}: report config must be a JSON object')
+    return config
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Export the PetPal technical report to a Word document or PDF.')
+    parser.add_argument('--config', help='JSON file with report config overrides')
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('-o', '--output', default=DEFAULT_OUTPUT,
+                        help=f'path of the .docx or .pdf to write (default: {DEFAULT_OUTPUT})')
+    target.add_argument('--stdout', action='store_true', help='write the document bytes to stdout')
+    target.add_argument('--batch', metavar='MANIFEST',
+                        help='render every report in a JSONL manifest (see report_batch.py)')
+    target.add_argument('--serve', type=int, metavar='PORT',
+                        help='serve renders over HTTP on PORT (see report_service.py)')
+    target.add_argument('--diff', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two generated .docx reports section by section (see report_diff.py)')
+    parser.add_argument('--variants', metavar='NAMES',
+                        help='comma-separated report variants to render from one shared build, '
+                             'each next to --output (see report_variants.py)')
+    parser.add_argument('--parallel', action='store_true',
+                        help='render the sections in --jobs worker processes and merge them (see report_parallel.py)')
+    parser.add_argument('--jobs', type=int,
+                        help='worker processes for --batch, --serve and --parallel (default: CPU count)')
+    parser.add_argument('--host', default='127.0.0.1', help='address for --serve to listen on (default: 127.0.0.1)')
+    parser.add_argument('--max-queue', type=int,
+                        help='renders --serve queues beyond --jobs before answering 429 (default: --jobs)')
+    parser.add_argument('--data-root',
+                        help='directory --serve requests may name spec, export and image paths in '
+                             '(default: none, so such paths are refused)')
+    parser.add_argument('--output-dir', help='base directory for relative --batch output paths')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS,
+                        help='output format (default: from the --output extension, else docx)')
+    parser.add_argument('--compression-level', type=int, choices=range(10), metavar='0-9',
+                        help='0 stores the output uncompressed (fastest), 9 compresses most '
+                             '(default: the config\'s compression_level, else 6)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='reuse cached sections whose inputs have not changed')
+    parser.add_argument('--stream', action='store_true',
+                        help='write the .docx body as it is rendered, in flat memory (see report_stream.py)')
+    parser.add_argument('--check', action='store_true',
+                        help='validate the config and exit without rendering')
+    parser.add_argument('--trace', metavar='PATH',
+                        help='write a Chrome trace of the build to PATH and print a per-span summary')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='with --trace, also record allocations (slows the build)')
+    args = parser.parse_args(argv)
+    if args.variants:
+        # Variants are written next to --output, in the format of its extension, from one serial build
+        clashes = [flag for flag, given in (
+            ('--stdout', args.stdout), ('--batch', args.batch), ('--serve', args.serve is not None),
+            ('--diff', args.diff), ('--parallel', args.parallel), ('--jobs', args.jobs is not None),
+            ('--format', args.format),
+        ) if given]
+        if clashes:
+            parser.error(f'--variants cannot be combined with {", ".join(clashes)}')
+    if args.batch:
+        # Each manifest line carries its own config; the output extension picks the format
+        clashes = [flag for flag, given in (
+            ('--config', args.config), ('--format', args.format),
+            ('--compression-level', args.compression_level is not None), ('--stream', args.stream),
+            ('--parallel', args.parallel), ('--check', args.check),
+            ('--trace', args.trace), ('--trace-memory', args.trace_memory),
+        ) if given]
+        if clashes:
+            parser.error(f'--batch cannot be combined with {", ".join(clashes)}; '
+                         'set config keys on the manifest lines instead')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.batch:
+        import report_batch
+        return report_batch.main(args.batch, workers=args.jobs, output_dir=args.output_dir,
+                                 incremental=args.incremental)
+    if args.diff:
+        import report_diff
+        return report_diff.main(args.diff)
+    if args.serve is not None:
+        import report_service
+        return report_service.main(args.serve, host=args.host, workers=args.jobs, max_queue=args.max_queue,
+                                   incremental=args.incremental, data_root=args.data_root)
+
+    variants = [name for name in (args.variants or '').split(',') if name]
+    workers = (args.jobs or os.cpu_count() or 1) if args.parallel else None
+    try:
+        config = load_config(args.config) if args.config else {}
+        if args.compression_level is not None:
+            config['compression_level'] = args.compression_level
+        if args.stream:
+            config['streaming'] = True
+        config = resolve_config(config)
+        for variant in variants:
+            check_variant(config, variant)
+    except (OSError, ValueError) as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 2
+
+    if args.check:
+        try:
+            report_sections(config)
+        except (OSError, ValueError) as e:
+            print(f'error: {e}', file=sys.stderr)
+            return 2
+        print('Report config OK', file=sys.stderr)
+        return 0
+
+    import report_trace
+
+    tracer = report_trace.enable(memory=args.trace_memory) if args.trace else None
+    try:
+        if variants:
+            import report_variants
+            report_variants.main(config, variants, args.output, incremental=args.incremental)
+        elif args.stdout:
+            render_report(config, sys.stdout.buffer, incremental=args.incremental, output_format=args.format,
+                          workers=workers)
+            sys.stdout.buffer.flush()
+        else:
+            render_report(config, args.output, incremental=args.incremental, output_format=args.format,
+                          workers=workers)
+            print(f'Document successfully created at: {args.output}')
+    finally:
+        if tracer is not None:
+            report_trace.disable()
+    if tracer is not None:
+        tracer.write_chrome_trace(args.trace)
+        print(tracer.summary(), file=sys.stderr)
+        print(f'Trace written to: {args.trace}', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    # Helper modules import this one by name; share the running instance so
+    # they see the same caches and dependency tracking instead of a copy
+    sys.modules.setdefault('export_report_to_word', sys.modules[__name__])
+    sys.exit(main())
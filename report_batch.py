@@ -0,0 +1,150 @@
+"""Render many PetPal reports from a JSONL manifest across a process pool.
+
+Each manifest line is a JSON object with an ``output`` path, an optional
+``id`` and any report config keys accepted by ``export_report_to_word``::
+
+    {"id": "clinic-42", "output": "clinics/42.docx", "subtitle": "Clinic 42 Report"}
+
+An ``output`` ending in ``.pdf`` is rendered as PDF.
+
+Workers are started once and warmed up, so every job after the first only
+pays for building and saving its own document. Results are yielded as jobs
+finish; a bad line or a failing render is reported and the batch carries on.
+Each successful result carries the output's ``sha256``, which is stable
+across runs for jobs with ``"reproducible": true``, so unchanged reports
+can be recognised and their uploads skipped.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import export_report_to_word as report
+
+# Manifest keys that describe the job rather than the report itself
+JOB_KEYS = ('id', 'output')
+
+
+def read_manifest(path):
+    """Yield ``(job, error)`` pairs from a JSONL manifest, one per non-blank line"""
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as e:
+                yield {'id': f'line-{line_no}'}, f'invalid JSON: {e}'
+                continue
+            if not isinstance(job, dict):
+                yield {'id': f'line-{line_no}'}, 'manifest entry must be a JSON object'
+                continue
+            job.setdefault('id', f'line-{line_no}')
+            if not job.get('output'):
+                yield job, 'manifest entry has no "output" path'
+                continue
+            yield job, None
+
+
+def init_worker():
+    """Pay the per-process setup once when a worker starts"""
+    import report_charts
+
+    report.warm_up()
+    # The batch already runs a report per core; draw charts in-process
+    report_charts.set_workers(0)
+
+
+def render_job(job, output_dir=None, incremental=False):
+    """Render one manifest job and return its result record"""
+    started = time.perf_counter()
+    output = job['output']
+    if output_dir and not os.path.isabs(output):
+        output = os.path.join(output_dir, output)
+    result = {'id': job['id'], 'output': output, 'ok': False}
+    try:
+        config = {k: v for k, v in job.items() if k not in JOB_KEYS}
+        parent = os.path.dirname(output)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        report.render_report(config, output, incremental=incremental)
+        with open(output, 'rb') as f:
+            result['sha256'] = hashlib.sha256(f.read()).hexdigest()
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['seconds'] = round(time.perf_counter() - started, 4)
+    result['pid'] = os.getpid()
+    return result
+
+
+def _failed(job, error):
+    return {'id': job.get('id'), 'output': job.get('output'), 'ok': False, 'error': error, 'seconds': 0.0}
+
+
+def run_batch(jobs, workers=None, output_dir=None, incremental=False):
+    """Render ``(job, error)`` pairs on a process pool, yielding results as they finish
+
+    At most ``2 * workers`` jobs are in flight at once, so huge manifests are
+    streamed rather than loaded up front. If a worker process dies the jobs
+    it took down are reported as failed and a fresh pool takes over.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = workers * 2
+    jobs = iter(jobs)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    pending = {}
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    job, error = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if error:
+                    yield _failed(job, error)
+                    continue
+                pending[executor.submit(render_job, job, output_dir, incremental)] = job
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    yield future.result()
+                except BrokenProcessPool as e:
+                    broken = True
+                    yield _failed(job, f'worker process died: {e}')
+                except Exception as e:
+                    yield _failed(job, f'{type(e).__name__}: {e}')
+            if broken:
+                for future, job in pending.items():
+                    yield _failed(job, 'worker process died')
+                pending.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def main(manifest, workers=None, output_dir=None, incremental=False, out=None, err=None):
+    """Run a manifest, print one JSON result per line and a summary; return the exit code"""
+    out = out or sys.stdout
+    err = err or sys.stderr
+    started = time.perf_counter()
+    total = failed = 0
+    for result in run_batch(read_manifest(manifest), workers=workers, output_dir=output_dir,
+                            incremental=incremental):
+        total += 1
+        failed += not result['ok']
+        print(json.dumps(result), file=out, flush=True)
+    elapsed = time.perf_counter() - started
+    print(f'Rendered {total - failed}/{total} reports in {elapsed:.2f}s ({failed} failed)', file=err)
+    return 1 if failed else 0
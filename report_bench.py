@@ -0,0 +1,245 @@
+"""Benchmark report building and saving across synthetic report sizes.
+
+Each workload fills a document made from the report's base template with
+``size`` items using the same helpers the report does:
+
+    paragraphs   body paragraphs, every other one shaded (``shade_paragraph``)
+    code_blocks  highlighted Dart code blocks, all distinct (``add_code_block``)
+    table_rows   one statistics table of ``size`` rows (``add_stats_table``)
+
+For every workload and size it records the build and ``doc.save()`` times
+(best of ``--repeat`` runs), the peak traced memory of each phase from a
+separate run under tracemalloc (which slows the code it traces, so it is
+never timed), and the size of the saved .docx. tracemalloc sees Python
+allocations only; the XML tree itself lives in libxml2 and is not counted::
+
+    python report_bench.py --sizes 10,1000,100000 --output bench.json
+    python report_bench.py --repeat 3 --compare bench.json --threshold 0.25
+
+Results are written as JSON. With ``--compare``, cases whose time or memory
+grew by more than the threshold relative to an earlier results file are
+listed and the exit status is 1. The on-disk report cache is disabled
+while benchmarking, so every run pays the full cost.
+"""
+import argparse
+import gc
+import io
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import export_report_to_word as report
+
+# Bump whenever the workloads change, so older results are not compared
+BENCH_VERSION = 1
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+
+# Metrics compared between results files; sizes of output are reported only
+COMPARED_METRICS = ('build_seconds', 'save_seconds', 'build_peak_bytes', 'save_peak_bytes')
+
+_TEXT = ('PetPal keeps each pet profile, booking and activity in Firestore and '
+         'streams changes to every signed-in device.')
+
+_STATS_KEYS = ('total', 'completed', 'upcoming', 'pending', 'vets')
+
+
+def _code(i):
+    return (
+        f'Future<void> loadPets{i}(String ownerId) async {{\n'
+        f'  // Batch {i}: stream the owner\'s pets\n'
+        f'  final pets = await repository.getPetsByOwner(ownerId).first;\n'
+        f'  emit(state.copyWith(status: PetStatus.success, pets: pets, page: {i}));\n'
+        f'}}'
+    )
+
+
+def fill_paragraphs(doc, size):
+    for i in range(size):
+        paragraph = doc.add_paragraph(f'{i + 1}. {_TEXT}')
+        if i % 2:
+            report.shade_paragraph(paragraph)
+
+
+def fill_code_blocks(doc, size):
+    for i in range(size):
+        report.add_code_block(doc, _code(i), 'dart')
+
+
+def fill_table_rows(doc, size):
+    rows = [
+        {'key': f'vet-{i:06d}', 'total': 40 + i % 97, 'completed': 30 + i % 53,
+         'upcoming': i % 7, 'pending': i % 5, 'vets': 1 + i % 3}
+        for i in range(size)
+    ]
+    report.add_stats_table(doc, 'Vet', rows, _STATS_KEYS, report.STATS_HEADERS)
+
+
+WORKLOADS = {
+    'paragraphs': fill_paragraphs,
+    'code_blocks': fill_code_blocks,
+    'table_rows': fill_table_rows,
+}
+
+
+def _new_document():
+    from docx import Document
+
+    return Document(io.BytesIO(report.base_template()))
+
+
+def run_case(fill, size, traced=False):
+    """Build and save one synthetic document; returns ``(times, peaks, output_bytes)``"""
+    from report_highlight import highlighted_runs
+
+    # Every run starts cold, as a fresh report process would
+    highlighted_runs.cache_clear()
+    gc.collect()
+    if traced:
+        tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        doc = _new_document()
+        fill(doc, size)
+        built = time.perf_counter()
+        build_peak = tracemalloc.get_traced_memory()[1] if traced else None
+        if traced:
+            tracemalloc.reset_peak()
+        buffer = io.BytesIO()
+        doc.save(buffer)
+        saved = time.perf_counter()
+        save_peak = tracemalloc.get_traced_memory()[1] if traced else None
+    finally:
+        if traced:
+            tracemalloc.stop()
+    return (built - started, saved - built), (build_peak, save_peak), buffer.tell()
+
+
+def benchmark(workloads, sizes, repeat=1, progress=None):
+    """Yield one result record per workload and size"""
+    for name in workloads:
+        fill = WORKLOADS[name]
+        for size in sizes:
+            runs = [run_case(fill, size) for _ in range(repeat)]
+            _, (build_peak, save_peak), output_bytes = run_case(fill, size, traced=True)
+            result = {
+                'workload': name,
+                'size': size,
+                'build_seconds': round(min(times[0] for times, _, _ in runs), 6),
+                'save_seconds': round(min(times[1] for times, _, _ in runs), 6),
+                'build_peak_bytes': build_peak,
+                'save_peak_bytes': save_peak,
+                'output_bytes': output_bytes,
+            }
+            if progress:
+                progress(result)
+            yield result
+
+
+def environment():
+    """Describe what the results were measured on"""
+    try:
+        from importlib.metadata import version
+        docx_version = version('python-docx')
+    except Exception:
+        docx_version = None
+    return {
+        'bench_version': BENCH_VERSION,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'python_docx': docx_version,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return a line per metric that grew by more than ``threshold`` over the baseline"""
+    previous = {(r['workload'], r['size']): r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        before = previous.get((result['workload'], result['size']))
+        if before is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = before.get(metric), result.get(metric)
+            if old and new is not None and new > old * (1 + threshold):
+                regressions.append(f'{result["workload"]} size {result["size"]}: {metric} '
+                                   f'{old:,} -> {new:,} (+{(new / old - 1) * 100:.0f}%)')
+    return regressions
+
+
+def format_result(result):
+    return (f'{result["workload"]:<12} {result["size"]:>8,}  build {result["build_seconds"]:8.3f}s  '
+            f'save {result["save_seconds"]:8.3f}s  peak {max(result["build_peak_bytes"], result["save_peak_bytes"]) / 2**20:8.1f} MiB  '
+            f'docx {result["output_bytes"] / 2**10:10.1f} KiB')
+
+
+def _sizes(value):
+    try:
+        sizes = [int(size) for size in value.split(',') if size.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'sizes must be comma-separated integers, got {value!r}') from None
+    if not sizes or min(sizes) < 1:
+        raise argparse.ArgumentTypeError('sizes must be positive')
+    return sizes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark PetPal report generation on synthetic reports.')
+    parser.add_argument('--sizes', type=_sizes, default=list(DEFAULT_SIZES),
+                        help=f'comma-separated item counts (default: {",".join(map(str, DEFAULT_SIZES))})')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS),
+                        help=f'comma-separated workloads (default: {",".join(WORKLOADS)})')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs per case; the fastest counts (default: 1)')
+    parser.add_argument('-o', '--output', help='write the JSON results here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative growth counted as a regression (default: 0.2)')
+    args = parser.parse_args(argv)
+    args.workloads = [name for name in args.workloads.split(',') if name]
+    unknown = sorted(set(args.workloads) - set(WORKLOADS))
+    if unknown:
+        parser.error(f'unknown workloads: {", ".join(unknown)}')
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    report.CACHE_DIR = ''
+    report.warm_up()
+    results = list(benchmark(args.workloads, args.sizes, args.repeat,
+                             progress=lambda result: print(format_result(result), file=sys.stderr)))
+    document = dict(environment(), results=results)
+    text = json.dumps(document, indent=2) + '\n'
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+    if baseline is not None:
+        if baseline.get('bench_version') != BENCH_VERSION:
+            print(f'warning: {args.compare} is from benchmark version {baseline.get("bench_version")}, '
+                  f'not {BENCH_VERSION}', file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f'regression: {line}', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
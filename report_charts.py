@@ -0,0 +1,169 @@
+"""Render report charts to PNG on a worker pool, with an on-disk image cache.
+
+A chart is described by a plain, JSON-serialisable spec::
+
+    {'kind': 'bar', 'title': 'Bookings per Month',
+     'labels': ['2025-01', '2025-02'], 'series': {'Total': [120, 98]}}
+
+``kind`` is ``'line'``, ``'bar'`` (grouped when there are several series)
+or ``'pie'`` (first series only). The PNG for a spec is cached under the
+hash of the spec, which includes the data, so re-rendering a report whose
+data did not change never redraws a chart.
+
+``submit()`` returns a future straight away: cached charts are already
+resolved, the rest are drawn in a process pool while the caller goes on
+assembling the document. Charts need matplotlib; without it ``available()``
+is False and callers leave charts out.
+"""
+import atexit
+import io
+import json
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import export_report_to_word as report
+
+# Bump whenever the drawing code or the default styling changes
+CHART_VERSION = 1
+
+CHART_KINDS = ('line', 'bar', 'pie')
+
+DEFAULT_SIZE = (6.5, 3.2)  # inches
+DEFAULT_DPI = 150
+
+# Drawing processes; 0 renders in the calling process
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+PALETTE = ('#2E74B5', '#70AD47', '#ED7D31', '#A5A5A5', '#FFC000', '#5B9BD5')
+
+_pool = None
+_workers = MAX_WORKERS
+
+
+def available():
+    """True if matplotlib can be imported"""
+    try:
+        import matplotlib  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def chart_key(spec):
+    """Cache key for a chart spec"""
+    return report.content_hash(str(CHART_VERSION), json.dumps(spec, sort_keys=True, separators=(',', ':')))
+
+
+def validate_spec(spec):
+    """Raise ValueError unless ``spec`` describes a chart that can be drawn"""
+    if spec.get('kind') not in CHART_KINDS:
+        raise ValueError(f'chart kind must be one of {", ".join(CHART_KINDS)}, got {spec.get("kind")!r}')
+    labels = spec.get('labels')
+    series = spec.get('series')
+    if not isinstance(labels, list) or not isinstance(series, dict) or not series:
+        raise ValueError('chart spec needs a "labels" list and a non-empty "series" mapping')
+    for name, values in series.items():
+        if len(values) != len(labels):
+            raise ValueError(f'chart series {name!r} has {len(values)} values for {len(labels)} labels')
+
+
+def draw_chart(spec):
+    """Draw a chart spec and return the PNG bytes"""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    width, height = spec.get('size', DEFAULT_SIZE)
+    figure = Figure(figsize=(width, height), dpi=spec.get('dpi', DEFAULT_DPI))
+    axes = figure.add_subplot()
+    labels = spec['labels']
+    series = list(spec['series'].items())
+
+    if spec['kind'] == 'pie':
+        name, values = series[0]
+        shown = [(label, value) for label, value in zip(labels, values) if value]
+        axes.pie([value for _, value in shown], labels=[label for label, _ in shown],
+                 colors=PALETTE[:len(shown)], autopct='%1.0f%%', startangle=90, counterclock=False)
+        axes.set_aspect('equal')
+    else:
+        positions = range(len(labels))
+        if spec['kind'] == 'line':
+            for i, (name, values) in enumerate(series):
+                axes.plot(positions, values, marker='o', markersize=3, color=PALETTE[i % len(PALETTE)], label=name)
+        else:
+            bar_width = 0.8 / len(series)
+            for i, (name, values) in enumerate(series):
+                offset = (i - (len(series) - 1) / 2) * bar_width
+                axes.bar([p + offset for p in positions], values, bar_width,
+                         color=PALETTE[i % len(PALETTE)], label=name)
+        # Thin out crowded category labels
+        step = max(1, len(labels) // 12)
+        axes.set_xticks(list(positions)[::step])
+        crowded = len(labels) > 6
+        axes.set_xticklabels(labels[::step], rotation=45 if crowded else 0, ha='right' if crowded else 'center')
+        axes.set_ylabel(spec.get('ylabel', ''))
+        axes.spines[['top', 'right']].set_visible(False)
+        axes.grid(axis='y', alpha=0.3)
+        if len(series) > 1:
+            axes.legend(frameon=False)
+
+    axes.set_title(spec.get('title', ''))
+    figure.tight_layout()
+    out = io.BytesIO()
+    # Leave the matplotlib version out of the file so cached PNGs stay comparable
+    figure.savefig(out, format='png', metadata={'Software': None})
+    return out.getvalue()
+
+
+def render_chart(spec):
+    """Return the PNG for a spec, drawing and caching it on a miss"""
+    key = chart_key(spec)
+    cached = report.read_cache('charts', key, '.png')
+    if cached is not None:
+        return cached
+    png = draw_chart(spec)
+    report.write_cache('charts', key, png, '.png')
+    return png
+
+
+def set_workers(workers):
+    """Set the number of drawing processes; 0 draws in the calling process
+
+    Batch workers use 0, since the batch already runs one report per core.
+    """
+    global _workers
+    shutdown()
+    _workers = workers
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_workers)
+    return _pool
+
+
+def shutdown():
+    """Stop the drawing processes, if any were started"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+# Registered once; a no-op unless a pool is running at exit
+atexit.register(shutdown)
+
+
+def submit(spec):
+    """Start rendering a chart and return a future for its PNG bytes"""
+    validate_spec(spec)
+    cached = report.read_cache('charts', chart_key(spec), '.png')
+    if cached is not None or not _workers:
+        future = Future()
+        try:
+            future.set_result(cached if cached is not None else render_chart(spec))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    return _executor().submit(render_chart, spec)
@@ -0,0 +1,532 @@
+"""Booking and activity statistics computed from Firestore export files.
+
+Exports are read as a stream, one document at a time, from any of:
+
+* NDJSON / JSON Lines (``.ndjson``, ``.jsonl``): one document per line;
+* a JSON array of documents;
+* a JSON object mapping document IDs to documents.
+
+A document is either the plain ``toMap()`` fields, those fields under a
+``data`` key, or the typed ``fields`` of the Firestore REST API. Timestamps
+may be ISO strings, epoch seconds or milliseconds, or ``{"_seconds": ...}`` /
+``{"seconds": ...}`` objects.
+
+Records are packed into columnar arrays as they are read (string IDs become
+integer codes), so memory stays at a few bytes per field however large the
+export is. The same statistics as ``ReportRepository.buildPetReportPdf``
+(total, completed, upcoming, pending, unique vets) are then computed per
+pet, vet, clinic or month with vectorised group-bys when NumPy is installed,
+and with a single pass over the columns when it is not.
+"""
+import array
+import codecs
+import hashlib
+import json
+import math
+import os
+from datetime import datetime, time, timezone
+
+import export_report_to_word as report
+
+# Enum values in the order the Dart models declare them
+BOOKING_STATUSES = ('pending', 'accepted', 'completed', 'cancelled', 'rejected')
+ACTIVITY_TYPES = ('food', 'walk', 'medicine')
+
+PENDING = BOOKING_STATUSES.index('pending')
+ACCEPTED = BOOKING_STATUSES.index('accepted')
+COMPLETED = BOOKING_STATUSES.index('completed')
+
+STAT_KEYS = ('total', 'completed', 'upcoming', 'pending', 'unique_vets')
+
+GROUPINGS = ('pet', 'vet', 'clinic', 'month')
+
+CHUNK_SIZE = 1 << 20
+
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl')
+
+_WHITESPACE = ' \t\r\n'
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# ===== STREAMING READER =====
+
+def _read_text(path):
+    """Yield decoded text chunks of a file, recording its content hash when done"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    # Same digest as report.content_hash(data), without holding the whole file
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(os.fstat(f.fileno()).st_size.to_bytes(8, 'little'))
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            digest.update(chunk)
+            if not chunk:
+                break
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+    report.record_dependency(path, digest.hexdigest())
+
+
+def _iter_ndjson(chunks):
+    pending = ''
+    line_no = 0
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield None, _loads(line, line_no)
+    if pending.strip():
+        yield None, _loads(pending, line_no + 1)
+
+
+def _loads(line, line_no):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        raise ValueError(f'line {line_no}: invalid JSON: {e}') from None
+
+
+class _JsonStream:
+    """Decode the members of one top-level JSON array or object incrementally"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it, or ''"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f'invalid JSON export: expected {char!r}, found {found or "end of file"!r}')
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError as e:
+                if self._eof or not self._fill():
+                    raise ValueError(f'invalid JSON export: {e.msg}') from None
+                continue
+            # A number ending the buffer may continue in the next chunk
+            if end == len(self._buf) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def members(self):
+        """Yield ``(key, value)`` pairs; keys are None for array items"""
+        opener = self._peek()
+        if opener not in '[{':
+            raise ValueError('invalid JSON export: expected an array or object of documents')
+        self._pos += 1
+        closer = ']' if opener == '[' else '}'
+        first = True
+        while True:
+            if self._peek() == closer:
+                self._pos += 1
+                return
+            if not first:
+                self._expect(',')
+            first = False
+            key = None
+            if opener == '{':
+                key = self._value()
+                self._expect(':')
+            yield key, self._value()
+
+
+def _typed_value(value):
+    """Unwrap a Firestore REST API typed value"""
+    if not isinstance(value, dict) or len(value) != 1:
+        return value
+    (kind, inner), = value.items()
+    if kind == 'integerValue':
+        return int(inner)
+    if kind == 'mapValue':
+        return {k: _typed_value(v) for k, v in inner.get('fields', {}).items()}
+    if kind == 'arrayValue':
+        return [_typed_value(v) for v in inner.get('values', [])]
+    if kind.endswith('Value'):
+        return inner
+    return value
+
+
+def _document(key, value):
+    if not isinstance(value, dict):
+        raise ValueError(f'invalid JSON export: document {key!r} is not an object')
+    if isinstance(value.get('fields'), dict):
+        doc = {k: _typed_value(v) for k, v in value['fields'].items()}
+        name = value.get('name')
+        doc.setdefault('id', name.rsplit('/', 1)[-1] if isinstance(name, str) else key)
+        return doc
+    if isinstance(value.get('data'), dict):
+        doc = dict(value['data'])
+        doc.setdefault('id', value.get('id', key))
+        return doc
+    if key is not None and 'id' not in value:
+        value = dict(value, id=key)
+    return value
+
+
+def iter_documents(path):
+    """Yield the documents of an export file one at a time"""
+    chunks = _read_text(path)
+    if path.lower().endswith(NDJSON_SUFFIXES):
+        members = _iter_ndjson(chunks)
+    else:
+        members = _JsonStream(chunks).members()
+    for key, value in members:
+        yield _document(key, value)
+    # Read to the end so the file's hash is recorded
+    for _ in chunks:
+        pass
+
+
+def to_epoch(value):
+    """Convert an exported timestamp to epoch seconds, or NaN if missing/invalid"""
+    if isinstance(value, dict):
+        seconds = value.get('_seconds', value.get('seconds'))
+        if seconds is None:
+            inner = value.get('__time__', value.get('value'))
+            return to_epoch(inner) if inner is not None else math.nan
+        nanos = value.get('_nanoseconds', value.get('nanos', 0)) or 0
+        return float(seconds) + float(nanos) / 1e9
+    if isinstance(value, bool) or value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        # Treat anything past the year 5138 in seconds as milliseconds
+        return value / 1000.0 if abs(value) >= 1e11 else float(value)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return math.nan
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    return math.nan
+
+
+def day_start(day):
+    """Epoch seconds at 00:00 UTC of a date"""
+    return datetime.combine(day, time.min, tzinfo=timezone.utc).timestamp()
+
+
+# ===== COLUMNAR STORE =====
+
+class Codes:
+    """Dictionary-encode strings as dense integer codes"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        if value is None or value == '':
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ExportData:
+    """Bookings and activity logs packed into parallel typed arrays
+
+    Pets are coded once across both collections, so the two can be joined
+    on ``pet`` codes. A code of -1 means the field was missing.
+    """
+
+    def __init__(self):
+        self.pets = Codes()
+        self.pet_names = {}
+        self.providers = Codes()
+        self.clinic_of = {}
+
+        self.booking_pet = array.array('i')
+        self.booking_provider = array.array('i')
+        self.booking_is_vet = array.array('b')
+        self.booking_status = array.array('b')
+        self.booking_date = array.array('d')
+
+        self.activity_pet = array.array('i')
+        self.activity_type = array.array('b')
+        self.activity_time = array.array('d')
+
+    @property
+    def bookings(self):
+        return len(self.booking_pet)
+
+    @property
+    def activities(self):
+        return len(self.activity_pet)
+
+    def add_booking(self, doc):
+        pet = self.pets.code(doc.get('petId'))
+        if pet >= 0 and doc.get('petName'):
+            self.pet_names.setdefault(pet, doc['petName'])
+        vet_id = doc.get('vetId')
+        self.booking_pet.append(pet)
+        self.booking_provider.append(self.providers.code(vet_id or doc.get('sitterId')))
+        self.booking_is_vet.append(bool(vet_id))
+        status = doc.get('status')
+        self.booking_status.append(BOOKING_STATUSES.index(status) if status in BOOKING_STATUSES else -1)
+        self.booking_date.append(to_epoch(doc.get('date')))
+
+    def add_activity(self, doc):
+        kind = doc.get('type')
+        self.activity_pet.append(self.pets.code(doc.get('petId')))
+        self.activity_type.append(ACTIVITY_TYPES.index(kind) if kind in ACTIVITY_TYPES else -1)
+        self.activity_time.append(to_epoch(doc.get('timestamp')))
+
+    def add_user(self, doc):
+        """Remember a vet's clinic so bookings can be grouped by clinic"""
+        if doc.get('clinicLocation') and doc.get('id'):
+            self.clinic_of[doc['id']] = doc['clinicLocation']
+
+    def pet_label(self, code):
+        pet_id = self.pets.values[code]
+        name = self.pet_names.get(code)
+        return f'{name} ({pet_id})' if name else pet_id
+
+
+def load_export(bookings=None, activities=None, users=None):
+    """Stream export files into an ``ExportData``; each path is optional"""
+    data = ExportData()
+    # Users first, so clinics are known; pets are coded in booking order
+    for path, add in ((users, data.add_user), (bookings, data.add_booking), (activities, data.add_activity)):
+        if path:
+            for doc in iter_documents(path):
+                add(doc)
+    return data
+
+
+# ===== STATISTICS =====
+
+def _month_label(epoch):
+    day = datetime.fromtimestamp(epoch, tz=timezone.utc)
+    return f'{day.year:04d}-{day.month:02d}'
+
+
+def _group_codes_py(data, by, epochs, is_booking):
+    """Return per-record group codes and their labels, without NumPy"""
+    pets = data.booking_pet if is_booking else data.activity_pet
+    if by == 'pet':
+        return pets, [data.pet_label(code) for code in range(len(data.pets))]
+    if by == 'month':
+        months = Codes()
+        codes = [months.code(_month_label(t)) if t == t else -1 for t in epochs]
+        return codes, months.values
+    providers = data.booking_provider
+    if by == 'vet':
+        return [p if v else -1 for p, v in zip(providers, data.booking_is_vet)], list(data.providers.values)
+    clinics = Codes()
+    clinic_codes = [clinics.code(data.clinic_of.get(value)) for value in data.providers.values]
+    return [clinic_codes[p] if v and p >= 0 else -1 for p, v in zip(providers, data.booking_is_vet)], clinics.values
+
+
+def _group_codes_np(np, data, by, epochs, is_booking):
+    """Return a group code array and labels, with -1 for records outside any group"""
+    if by == 'pet':
+        pets = data.booking_pet if is_booking else data.activity_pet
+        return np.frombuffer(pets, dtype=np.int32).astype(np.int64), \
+            [data.pet_label(code) for code in range(len(data.pets))]
+    if by == 'month':
+        valid = ~np.isnan(epochs)
+        months = np.full(len(epochs), -1, dtype=np.int64)
+        months[valid] = epochs[valid].astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+        present, codes = np.unique(months[valid], return_inverse=True)
+        months[valid] = codes
+        labels = [str(m) for m in present.astype('datetime64[M]')]
+        return months, labels
+    providers = np.frombuffer(data.booking_provider, dtype=np.int32).astype(np.int64)
+    is_vet = np.frombuffer(data.booking_is_vet, dtype=np.int8).astype(bool)
+    if by == 'vet':
+        return np.where(is_vet, providers, -1), list(data.providers.values)
+    clinics = Codes()
+    lookup = np.array([clinics.code(data.clinic_of.get(value)) for value in data.providers.values] + [-1],
+                      dtype=np.int64)
+    # providers of -1 index the trailing -1
+    return np.where(is_vet, lookup[providers], -1), clinics.values
+
+
+def _rows(labels, columns, keys, by):
+    """Turn per-group columns into row dicts: months in order, other groups busiest first"""
+    rows = []
+    for code, label in enumerate(labels):
+        values = {key: int(column[code]) for key, column in zip(keys, columns)}
+        if any(values.values()):
+            rows.append(dict(values, key=label))
+    if by == 'month':
+        rows.sort(key=lambda row: row['key'])
+    else:
+        rows.sort(key=lambda row: (-row[keys[0]], row['key']))
+    return rows
+
+
+def booking_stats(data, by, as_of, start=None, end=None):
+    """Booking statistics per group
+
+    ``by`` is one of ``GROUPINGS``. ``as_of`` (epoch seconds) separates
+    upcoming accepted bookings from past ones, and ``start``/``end`` (epoch
+    seconds, inclusive) restrict the bookings counted. Returns a list of
+    ``{'key', 'total', 'completed', 'upcoming', 'pending', 'unique_vets'}``.
+    """
+    if by not in GROUPINGS:
+        raise ValueError(f'unknown grouping {by!r}; expected one of {", ".join(GROUPINGS)}')
+    np = _numpy()
+    if np is None:
+        return _booking_stats_py(data, by, as_of, start, end)
+
+    dates = np.frombuffer(data.booking_date, dtype=np.float64)
+    status = np.frombuffer(data.booking_status, dtype=np.int8)
+    providers = np.frombuffer(data.booking_provider, dtype=np.int32).astype(np.int64)
+    is_vet = np.frombuffer(data.booking_is_vet, dtype=np.int8).astype(bool)
+    groups, labels = _group_codes_np(np, data, by, dates, True)
+
+    selected = groups >= 0
+    if start is not None:
+        selected &= dates >= start
+    if end is not None:
+        selected &= dates <= end
+    n = len(labels)
+
+    def count(mask):
+        return np.bincount(groups[mask], minlength=n)
+
+    completed = selected & (status == COMPLETED)
+    # Distinct (group, vet) pairs among completed vet bookings
+    vet_done = completed & is_vet & (providers >= 0)
+    pairs = np.unique(groups[vet_done] * max(len(data.providers), 1) + providers[vet_done])
+    unique_vets = np.bincount(pairs // max(len(data.providers), 1), minlength=n)
+
+    columns = (
+        count(selected),
+        count(completed),
+        count(selected & (status == ACCEPTED) & (dates >= as_of)),
+        count(selected & (status == PENDING)),
+        unique_vets,
+    )
+    return _rows(labels, columns, STAT_KEYS, by)
+
+
+def _booking_stats_py(data, by, as_of, start, end):
+    groups, labels = _group_codes_py(data, by, data.booking_date, True)
+    n = len(labels)
+    totals, completed, upcoming, pending = [0] * n, [0] * n, [0] * n, [0] * n
+    vets = [set() for _ in range(n)]
+    for group, status, when, provider, is_vet in zip(
+            groups, data.booking_status, data.booking_date, data.booking_provider, data.booking_is_vet):
+        # NaN dates fail both comparisons, as in the vectorised path
+        if group < 0 or (start is not None and not when >= start) or (end is not None and not when <= end):
+            continue
+        totals[group] += 1
+        if status == COMPLETED:
+            completed[group] += 1
+            if is_vet and provider >= 0:
+                vets[group].add(provider)
+        elif status == PENDING:
+            pending[group] += 1
+        elif status == ACCEPTED and when >= as_of:
+            upcoming[group] += 1
+    return _rows(labels, (totals, completed, upcoming, pending, [len(v) for v in vets]), STAT_KEYS, by)
+
+
+def activity_stats(data, by, start=None, end=None):
+    """Activity log counts per type for each group (``'pet'`` or ``'month'``)"""
+    if by not in ('pet', 'month'):
+        raise ValueError(f"activities can only be grouped by 'pet' or 'month', not {by!r}")
+    keys = ('total',) + ACTIVITY_TYPES
+    np = _numpy()
+    if np is None:
+        groups, labels = _group_codes_py(data, by, data.activity_time, False)
+        n = len(labels)
+        counts = [[0] * n for _ in keys]
+        for group, kind, when in zip(groups, data.activity_type, data.activity_time):
+            if group < 0 or (start is not None and not when >= start) or (end is not None and not when <= end):
+                continue
+            counts[0][group] += 1
+            if kind >= 0:
+                counts[kind + 1][group] += 1
+        return _rows(labels, counts, keys, by)
+
+    times = np.frombuffer(data.activity_time, dtype=np.float64)
+    kinds = np.frombuffer(data.activity_type, dtype=np.int8).astype(np.int64)
+    groups, labels = _group_codes_np(np, data, by, times, False)
+    selected = groups >= 0
+    if start is not None:
+        selected &= times >= start
+    if end is not None:
+        selected &= times <= end
+    n = len(labels)
+    typed = selected & (kinds >= 0)
+    # One bincount over (group, type) cells, reshaped into a type per column
+    by_type = np.bincount(groups[typed] * len(ACTIVITY_TYPES) + kinds[typed],
+                          minlength=n * len(ACTIVITY_TYPES)).reshape(n, len(ACTIVITY_TYPES))
+    columns = [np.bincount(groups[selected], minlength=n)] + [by_type[:, i] for i in range(len(ACTIVITY_TYPES))]
+    return _rows(labels, columns, keys, by)
+
+
+def status_counts(data, start=None, end=None):
+    """Return ``{status: count}`` over the bookings in a window, in enum order"""
+    np = _numpy()
+    if np is None:
+        counts = [0] * len(BOOKING_STATUSES)
+        for status, when in zip(data.booking_status, data.booking_date):
+            if status < 0 or (start is not None and not when >= start) or (end is not None and not when <= end):
+                continue
+            counts[status] += 1
+    else:
+        dates = np.frombuffer(data.booking_date, dtype=np.float64)
+        status = np.frombuffer(data.booking_status, dtype=np.int8).astype(np.int64)
+        selected = status >= 0
+        if start is not None:
+            selected &= dates >= start
+        if end is not None:
+            selected &= dates <= end
+        counts = np.bincount(status[selected], minlength=len(BOOKING_STATUSES)).tolist()
+    return dict(zip(BOOKING_STATUSES, (int(count) for count in counts)))
+
+
+def window_bounds(start=None, end=None):
+    """Epoch bounds for an inclusive date window, as in buildPetReportPdf"""
+    lower = day_start(start) if start is not None else None
+    upper = day_start(end) + 86400 - 0.001 if end is not None else None
+    return lower, upper
+
@@ -0,0 +1,337 @@
+"""Compare two generated reports section by section, without opening them in Word.
+
+    python report_diff.py nightly-old.docx nightly-new.docx
+    python export_report_to_word.py --diff nightly-old.docx nightly-new.docx
+
+Each document's ``word/document.xml`` is streamed with lxml's iterparse and
+every body block is dropped as soon as it has been read, so memory stays
+flat and time linear in the size of the files however long the reports
+are; python-docx is never loaded. Every heading starts a section, named by
+its heading path ("5. Implementation of CRUD Operations > 5.1 Create
+Operation"), and every block in it is fingerprinted:
+
+    paragraph   style, text and the CRC of any image it shows
+    code block  a paragraph in the Code Block style; its text
+    table       each row's cell text
+
+Sections are matched by name between the two reports and reported as
+added, removed or changed. For a changed section, tables are compared in
+order and their rows matched by the first cell (the statistics tables' key
+column), code blocks by content, with unmatched ones paired up as changed,
+and other paragraphs as a multiset. Bookmark names, relationship IDs and
+formatting that is not a style are ignored, so re-rendering identical
+content reports no changes.
+
+The exit status is 0 when the reports match, 1 when they differ and 2 when
+one cannot be read, like ``diff``.
+"""
+import argparse
+import hashlib
+import json
+import re
+import sys
+import zipfile
+from collections import Counter
+
+import export_report_to_word as report
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_RELS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# styles.xml names built-in styles in lower case ("heading 1")
+_HEADING_STYLE = re.compile(r'heading (\d)$', re.IGNORECASE)
+
+# Name of the blocks before the first heading
+FRONT_MATTER = '(front matter)'
+
+DEFAULT_MAX_ROWS = 10
+
+
+def _digest(*parts):
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _parse_part(archive, name):
+    from lxml import etree
+
+    try:
+        data = archive.read(name)
+    except KeyError:
+        return None
+    return etree.fromstring(data)
+
+
+def read_style_names(archive):
+    """Return ``{style ID: style name}`` from a package's styles part"""
+    styles = _parse_part(archive, 'word/styles.xml')
+    if styles is None:
+        return {}
+    names = {}
+    for style in styles.iterchildren(f'{_W}style'):
+        name = style.find(f'{_W}name')
+        names[style.get(f'{_W}styleId')] = name.get(f'{_W}val') if name is not None else style.get(f'{_W}styleId')
+    return names
+
+
+def read_image_crcs(archive):
+    """Return ``{rId: CRC}`` for the document's images, from the zip directory (nothing is inflated)"""
+    rels = _parse_part(archive, 'word/_rels/document.xml.rels')
+    if rels is None:
+        return {}
+    crcs = {}
+    for rel in rels.iterchildren(f'{_RELS}Relationship'):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target', '')
+        name = target.lstrip('/') if target.startswith('/') else f'word/{target}'
+        try:
+            crcs[rel.get('Id')] = f'{archive.getinfo(name).CRC:08x}'
+        except KeyError:
+            pass
+    return crcs
+
+
+def _text(element):
+    parts = []
+    for node in element.iter(f'{_W}t', f'{_W}tab', f'{_W}br', f'{_W}cr'):
+        if node.tag == f'{_W}t':
+            parts.append(node.text or '')
+        else:
+            parts.append('\t' if node.tag == f'{_W}tab' else '\n')
+    return ''.join(parts)
+
+
+def _row_cells(row):
+    return tuple(_text(cell) for cell in row.iterchildren(f'{_W}tc'))
+
+
+def iter_blocks(path):
+    """Yield ``('p', style name, text, image CRCs)`` or ``('tbl', rows)`` per body block of a .docx"""
+    from lxml import etree
+
+    with zipfile.ZipFile(path) as archive:
+        styles = read_style_names(archive)
+        images = read_image_crcs(archive)
+        with archive.open('word/document.xml') as f:
+            for _, element in etree.iterparse(f, events=('end',), tag=(f'{_W}p', f'{_W}tbl')):
+                parent = element.getparent()
+                if parent is None or parent.tag != f'{_W}body':
+                    continue
+                if element.tag == f'{_W}tbl':
+                    yield 'tbl', [_row_cells(row) for row in element.iterchildren(f'{_W}tr')]
+                else:
+                    style = element.find(f'{_W}pPr/{_W}pStyle')
+                    style_name = styles.get(style.get(f'{_W}val'), style.get(f'{_W}val')) if style is not None else 'Normal'
+                    crcs = tuple(images.get(blip.get(f'{_R}embed'), '?')
+                                 for blip in element.iter('{http://schemas.openxmlformats.org/drawingml/2006/main}blip'))
+                    yield 'p', style_name, _text(element), crcs
+                # Drop what has been read so the tree never holds more than one block
+                element.clear()
+                while element.getprevious() is not None:
+                    del parent[0]
+
+
+def heading_level(style_name):
+    """Return the outline level of a heading style name, or None for other styles"""
+    if style_name.lower() == 'title':
+        return 0
+    match = _HEADING_STYLE.match(style_name)
+    return int(match.group(1)) if match else None
+
+
+def outline(path):
+    """Return a report's sections in order as dicts
+
+    Each has the section's ``name`` (its heading path, made unique),
+    ``title``, ``level``, ``fingerprint`` and ``blocks``: a list of
+    ``('paragraph', digest, text)``, ``('code', digest, text)`` or
+    ``('table', digest, rows)`` tuples.
+    """
+    sections, path_titles, seen = [], [], Counter()
+
+    def start(title, level):
+        # The document title (level 0) heads its own section, not every path
+        del path_titles[max(level - 1, 0):]
+        if level:
+            path_titles.extend([''] * (level - 1 - len(path_titles)))
+            path_titles.append(title)
+        name = ' > '.join(t for t in path_titles if t) or title
+        seen[name] += 1
+        if seen[name] > 1:
+            name = f'{name} ({seen[name]})'
+        sections.append({'name': name, 'title': title, 'level': level, 'blocks': []})
+
+    for block in iter_blocks(path):
+        if block[0] == 'tbl':
+            rows = block[1]
+            entry = ('table', _digest(*(_digest(*row) for row in rows)), rows)
+        else:
+            _, style, text, images = block
+            level = heading_level(style)
+            if level is not None and text.strip():
+                start(text.strip(), level)
+                continue
+            if not text and not images:
+                continue
+            kind = 'code' if style == report.CODE_BLOCK_STYLE else 'paragraph'
+            entry = (kind, _digest(style, text, *images), text)
+        if not sections:
+            sections.append({'name': FRONT_MATTER, 'title': FRONT_MATTER, 'level': 0, 'blocks': []})
+        sections[-1]['blocks'].append(entry)
+    for section in sections:
+        section['fingerprint'] = _digest(*(block[1] for block in section['blocks']))
+    return sections
+
+
+def diff_rows(old, new):
+    """Return ``(added, removed, changed)`` rows, matching rows by their first cell when it is unique"""
+    old_keys = [row[0] if row else '' for row in old]
+    new_keys = [row[0] if row else '' for row in new]
+    if len(set(old_keys)) == len(old_keys) and len(set(new_keys)) == len(new_keys):
+        old_by_key = dict(zip(old_keys, old))
+        new_by_key = dict(zip(new_keys, new))
+        added = [row for key, row in zip(new_keys, new) if key not in old_by_key]
+        removed = [row for key, row in zip(old_keys, old) if key not in new_by_key]
+        changed = [(old_by_key[key], row) for key, row in zip(new_keys, new)
+                   if key in old_by_key and old_by_key[key] != row]
+        return added, removed, changed
+    old_count, new_count = Counter(old), Counter(new)
+    return list((new_count - old_count).elements()), list((old_count - new_count).elements()), []
+
+
+def _first_difference(old, new):
+    old_lines, new_lines = old.split('\n'), new.split('\n')
+    for number, (a, b) in enumerate(zip(old_lines, new_lines), 1):
+        if a != b:
+            return number
+    return min(len(old_lines), len(new_lines)) + 1
+
+
+def diff_section(old, new):
+    """Describe how the blocks of two versions of a section differ"""
+    changes = {'name': new['name'], 'tables': [], 'code': [], 'paragraphs': {}}
+
+    old_tables = [block for block in old['blocks'] if block[0] == 'table']
+    new_tables = [block for block in new['blocks'] if block[0] == 'table']
+    for number, (a, b) in enumerate(zip(old_tables, new_tables), 1):
+        if a[1] != b[1]:
+            added, removed, changed = diff_rows(a[2], b[2])
+            changes['tables'].append({'table': number, 'added': added, 'removed': removed, 'changed': changed})
+    for number, table in enumerate(new_tables[len(old_tables):], len(old_tables) + 1):
+        changes['tables'].append({'table': number, 'added': table[2], 'removed': [], 'changed': [], 'new': True})
+    for number, table in enumerate(old_tables[len(new_tables):], len(new_tables) + 1):
+        changes['tables'].append({'table': number, 'added': [], 'removed': table[2], 'changed': [], 'gone': True})
+
+    old_code = [block for block in old['blocks'] if block[0] == 'code']
+    new_code = [block for block in new['blocks'] if block[0] == 'code']
+    common = Counter(block[1] for block in old_code) & Counter(block[1] for block in new_code)
+
+    def unmatched(blocks):
+        left, result = Counter(common), []
+        for number, block in enumerate(blocks, 1):
+            if left[block[1]]:
+                left[block[1]] -= 1
+            else:
+                result.append((number, block[2]))
+        return result
+
+    gone, came = unmatched(old_code), unmatched(new_code)
+    for (_, a), (number, b) in zip(gone, came):
+        changes['code'].append({'block': number, 'change': 'changed', 'line': _first_difference(a, b)})
+    for number, _ in came[len(gone):]:
+        changes['code'].append({'block': number, 'change': 'added'})
+    for number, _ in gone[len(came):]:
+        changes['code'].append({'block': number, 'change': 'removed'})
+
+    old_paragraphs = Counter(block[1] for block in old['blocks'] if block[0] == 'paragraph')
+    new_paragraphs = Counter(block[1] for block in new['blocks'] if block[0] == 'paragraph')
+    added = sum((new_paragraphs - old_paragraphs).values())
+    removed = sum((old_paragraphs - new_paragraphs).values())
+    if added or removed:
+        changes['paragraphs'] = {'added': added, 'removed': removed}
+    return changes
+
+
+def diff_reports(old_path, new_path):
+    """Return the structural differences between two .docx reports as a dict"""
+    old, new = outline(old_path), outline(new_path)
+    old_by_name = {section['name']: section for section in old}
+    new_names = {section['name'] for section in new}
+    result = {'old': old_path, 'new': new_path, 'added': [], 'removed': [], 'changed': [], 'unchanged': 0}
+    for section in new:
+        before = old_by_name.get(section['name'])
+        if before is None:
+            result['added'].append(section['name'])
+        elif before['fingerprint'] == section['fingerprint']:
+            result['unchanged'] += 1
+        else:
+            result['changed'].append(diff_section(before, section))
+    result['removed'] = [section['name'] for section in old if section['name'] not in new_names]
+    return result
+
+
+def _row(row):
+    return ' | '.join(cell.replace('\n', ' ') for cell in row)
+
+
+def format_diff(result, max_rows=DEFAULT_MAX_ROWS):
+    """Return a plain-text summary of ``diff_reports()``"""
+    lines = [f'--- {result["old"]}', f'+++ {result["new"]}',
+             f'sections: {len(result["changed"])} changed, {len(result["added"])} added, '
+             f'{len(result["removed"])} removed, {result["unchanged"]} unchanged']
+    lines += [f'+ {name}' for name in result['added']]
+    lines += [f'- {name}' for name in result['removed']]
+    for section in result['changed']:
+        lines.append(f'~ {section["name"]}')
+        for table in section['tables']:
+            state = ' (new)' if table.get('new') else ' (gone)' if table.get('gone') else ''
+            lines.append(f'    table {table["table"]}{state}: {len(table["changed"])} rows changed, '
+                         f'{len(table["added"])} added, {len(table["removed"])} removed')
+            details = ([f'      ~ {_row(a)}  ->  {_row(b)}' for a, b in table['changed']]
+                       + [f'      + {_row(row)}' for row in table['added']]
+                       + [f'      - {_row(row)}' for row in table['removed']])
+            lines += details[:max_rows]
+            if len(details) > max_rows:
+                lines.append(f'      ... {len(details) - max_rows} more rows')
+        for code in section['code']:
+            where = f' from line {code["line"]}' if code['change'] == 'changed' else ''
+            lines.append(f'    code block {code["block"]} {code["change"]}{where}')
+        if section['paragraphs']:
+            lines.append(f'    paragraphs: {section["paragraphs"]["added"]} added, '
+                         f'{section["paragraphs"]["removed"]} removed')
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two generated PetPal reports section by section.')
+    parser.add_argument('old', help='the earlier .docx')
+    parser.add_argument('new', help='the later .docx')
+    parser.add_argument('--json', action='store_true', help='print the differences as JSON')
+    parser.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS,
+                        help=f'table rows listed per changed table (default: {DEFAULT_MAX_ROWS})')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from lxml.etree import XMLSyntaxError
+
+    args = parse_args(argv)
+    try:
+        result = diff_reports(args.old, args.new)
+    except (OSError, KeyError, zipfile.BadZipFile, XMLSyntaxError) as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 2
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(format_diff(result, args.max_rows))
+    return 1 if result['added'] or result['removed'] or result['changed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
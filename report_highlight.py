@@ -0,0 +1,121 @@
+"""Syntax highlighting for the report's code blocks.
+
+Snippets are split into tokens with a small regex lexer per language and
+rendered straight to WordprocessingML run XML. The rendered XML is cached by
+a hash of the snippet and its language, in memory and in the report cache,
+so a snippet that appears in many reports is only tokenised once.
+
+Supported languages are ``dart``, ``yaml`` and ``rules`` (Firestore security
+rules); anything else is rendered as a single plain run by the caller.
+"""
+import functools
+import re
+
+import export_report_to_word as report
+
+# Bump whenever the lexers, colours or run formatting change
+HIGHLIGHT_VERSION = 2
+
+DEFAULT_COLOR = '000000'
+
+COLORS = {
+    'comment': '008000',
+    'string': 'A31515',
+    'keyword': '0000FF',
+    'type': '267F99',
+    'number': '098658',
+    'annotation': '795E26',
+    'key': '0451A5',
+    'variable': '001080',
+}
+
+_STRING = r'''"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*\''''
+_NUMBER = r'\b\d+(?:\.\d+)?\b'
+
+# Token patterns per language, tried in order at each position
+GRAMMARS = {
+    'dart': [
+        ('comment', r'//[^\n]*|/\*[\s\S]*?\*/'),
+        ('string', _STRING),
+        ('annotation', r'@\w+'),
+        ('keyword', r'\b(?:abstract|as|async|await|break|case|catch|class|const|continue|default|do'
+                    r'|dynamic|else|enum|extends|factory|false|final|finally|for|get|if|implements'
+                    r'|import|in|is|late|new|null|on|override|required|return|set|static|super'
+                    r'|switch|this|throw|true|try|var|void|while|with|yield)\b'),
+        ('type', r'\b[A-Z]\w*\b'),
+        ('number', _NUMBER),
+    ],
+    'yaml': [
+        ('comment', r'(?:(?<=\s)|^)(?:#|//)[^\n]*'),
+        ('string', _STRING),
+        ('key', r'[\w./-]+(?=:(?:\s|$))'),
+        ('number', r'[\^~]?\d+(?:\.\d+)*(?:[-+][\w.]+)?\b'),
+        ('keyword', r'\b(?:true|false|null|yes|no|any)\b'),
+    ],
+    'rules': [
+        ('comment', r'//[^\n]*'),
+        ('string', _STRING),
+        ('keyword', r'\b(?:rules_version|service|match|allow|if|function|return|let|true|false|null|in|is)\b'),
+        ('type', r'\b(?:read|write|get|list|create|update|delete)\b'),
+        ('variable', r'\{[\w=*]+\}'),
+        ('number', _NUMBER),
+    ],
+}
+
+_PATTERNS = {
+    language: re.compile('|'.join(f'(?P<{kind}>{pattern})' for kind, pattern in grammar), re.M)
+    for language, grammar in GRAMMARS.items()
+}
+
+
+def code_rpr(color=DEFAULT_COLOR, italic=False):
+    """Return the run properties a token adds to the Code Block style (Courier New 9pt black)"""
+    italic = '<w:i/>' if italic else ''
+    color = f'<w:color w:val="{color}"/>' if color != DEFAULT_COLOR else ''
+    return f'{italic}{color}'
+
+
+def tokenize(code, language):
+    """Yield ``(kind, text)`` pairs covering the snippet; kind is None for plain text"""
+    pos = 0
+    for match in _PATTERNS[language].finditer(code):
+        if match.start() > pos:
+            yield None, code[pos:match.start()]
+        yield match.lastgroup, match.group()
+        pos = match.end()
+    if pos < len(code):
+        yield None, code[pos:]
+
+
+def render_runs(code, language):
+    """Render a snippet to run XML, merging neighbouring tokens of the same colour"""
+    runs = []
+    current_kind, current_text = None, []
+    for kind, text in tokenize(code, language):
+        # Whitespace looks the same in any colour, so keep it in the current run
+        if kind != current_kind and (kind is not None or text.strip()):
+            if current_text:
+                runs.append((current_kind, ''.join(current_text)))
+            current_kind, current_text = kind, []
+        current_text.append(text)
+    if current_text:
+        runs.append((current_kind, ''.join(current_text)))
+    return ''.join(
+        report.text_runs(text, code_rpr(COLORS.get(kind, DEFAULT_COLOR), kind == 'comment'))
+        for kind, text in runs
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def highlighted_runs(code, language):
+    """Return cached run XML for a snippet, or None if the language is not supported"""
+    language = (language or '').lower()
+    if language not in GRAMMARS:
+        return None
+    key = report.content_hash(str(HIGHLIGHT_VERSION), language, code)
+    cached = report.read_cache('snippets', key, '.xml')
+    if cached is not None:
+        return cached.decode('utf-8')
+    runs = render_runs(code, language)
+    report.write_cache('snippets', key, runs.encode('utf-8'), '.xml')
+    return runs
@@ -0,0 +1,185 @@
+"""Prepare photos for the report: resolve, downscale, recompress and dedupe.
+
+Pet photos (``Pet.imageUrl``) and provider pictures
+(``AppUser.profileImageUrl``) are stored as Firebase Storage download URLs,
+or as local file paths on devices that cached them. Either is looked up by
+its Storage object path or local path (then by file name) under an
+``images_dir`` that mirrors the bucket. References come from data exports, so
+they are never read from anywhere else: a reference that resolves outside
+``images_dir`` (through ``..`` or a symlink) is treated as missing.
+
+Each source file is read once and hashed; sources with identical bytes
+share one prepared copy. Preparing an image scales it down so it is no larger than its
+printed width at the target DPI and recompresses it (JPEG, or PNG when it
+has transparency), so a 12-megapixel phone photo shown two inches wide costs
+tens of kilobytes instead of several megabytes. The prepared bytes are cached
+in memory and on disk under the hash of the source and the print settings,
+and are byte-identical for identical sources, which python-docx stores as a
+single media part however many times the picture is placed.
+
+Images are prepared on a thread pool (Pillow releases the GIL while decoding
+and resampling). Downscaling needs Pillow; without it images are embedded
+unchanged, still deduplicated.
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+import export_report_to_word as report
+
+# Bump whenever prepare_image() changes what it produces
+IMAGE_VERSION = 1
+
+DEFAULT_DPI = 150
+JPEG_QUALITY = 82
+
+MAX_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# Formats python-docx can embed when Pillow is not there to convert them
+EMBEDDABLE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a', b'BM')
+
+_prepared = {}
+
+
+def available():
+    """True if Pillow can be imported, so images can be downscaled"""
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def storage_path(url):
+    """Return the Storage object path for a download or ``gs://`` URL
+
+    ``https://firebasestorage.googleapis.com/v0/b/<bucket>/o/pets%2Fa.jpg?...``
+    and ``gs://<bucket>/pets/a.jpg`` both give ``pets/a.jpg``; other values
+    are returned unchanged.
+    """
+    parts = urlsplit(url)
+    if parts.scheme == 'gs':
+        return parts.path.lstrip('/')
+    if parts.scheme in ('http', 'https'):
+        path = parts.path
+        if '/o/' in path:
+            path = path.split('/o/', 1)[1]
+        return unquote(path).lstrip('/')
+    return url
+
+
+def resolve_source(ref, images_dir=None):
+    """Return the local file under ``images_dir`` for an image reference, or None if there is none"""
+    if not ref or not images_dir:
+        return None
+    root = os.path.realpath(images_dir)
+    path = storage_path(ref)
+    for candidate in (path, os.path.basename(path)):
+        if not candidate:
+            continue
+        candidate = os.path.realpath(os.path.join(root, *candidate.split('/')))
+        if os.path.commonpath((root, candidate)) == root and os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def prepare_image(data, width, dpi=DEFAULT_DPI, quality=JPEG_QUALITY):
+    """Return ``data`` scaled to at most ``width`` inches at ``dpi`` and recompressed
+
+    Images already small enough are only recompressed, and kept as they are
+    if that would not make them smaller. Raises ValueError for data that is
+    not an image.
+    """
+    if not available():
+        if not data.startswith(EMBEDDABLE_SIGNATURES):
+            raise ValueError('unsupported image format (install Pillow to convert it)')
+        return data
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    max_pixels = max(1, round(width * dpi))
+    try:
+        image = Image.open(io.BytesIO(data))
+        source_size = image.size
+        if image.format == 'JPEG':
+            # Let the decoder skip detail that would be thrown away; the
+            # square bound holds whichever way EXIF says to rotate
+            image.draft('RGB', (max_pixels, max_pixels))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f'unreadable image: {e}') from None
+
+    original_format = image.format
+    # Phone cameras store the orientation in EXIF rather than the pixels
+    image = ImageOps.exif_transpose(image)
+    resized = image.size not in (source_size, source_size[::-1])
+    if image.width > max_pixels:
+        resized = True
+        image.thumbnail((max_pixels, image.height), Image.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+    out = io.BytesIO()
+    if has_alpha:
+        image.save(out, format='PNG', optimize=True)
+    else:
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(out, format='JPEG', quality=quality, optimize=True, progressive=True)
+    prepared = out.getvalue()
+    if not resized and len(prepared) >= len(data) and original_format in ('JPEG', 'PNG'):
+        return data
+    return prepared
+
+
+def _load(path, width, dpi):
+    """Read and prepare one file; returns ``(bytes, None)`` or ``(None, error)``"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        return None, str(e)
+    key = report.content_hash(str(IMAGE_VERSION), report.content_hash(data), repr(float(width)), str(dpi))
+    if key in _prepared:
+        return _prepared[key], None
+    cached = report.read_cache('images', key)
+    if cached is None:
+        try:
+            cached = prepare_image(data, width, dpi)
+        except ValueError as e:
+            return None, str(e)
+        report.write_cache('images', key, cached)
+    # Identical sources share one bytes object, so they are embedded once
+    cached = _prepared.setdefault(key, cached)
+    return cached, None
+
+
+def prepare_images(refs, width, dpi=DEFAULT_DPI, images_dir=None, workers=MAX_WORKERS):
+    """Prepare the images for many references on a thread pool
+
+    Returns ``(images, missing)``: ``images`` maps each reference that could
+    be resolved and read to its prepared bytes, and ``missing`` maps the rest
+    to the reason.
+    """
+    sources, missing = {}, {}
+    for ref in dict.fromkeys(refs):
+        path = resolve_source(ref, images_dir)
+        if path is None:
+            missing[ref] = 'not found'
+        else:
+            sources[ref] = os.path.realpath(path)
+
+    paths = sorted(set(sources.values()))
+    if workers and len(paths) > 1:
+        with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            results = dict(zip(paths, pool.map(lambda path: _load(path, width, dpi), paths)))
+    else:
+        results = {path: _load(path, width, dpi) for path in paths}
+
+    images = {}
+    for ref, path in sources.items():
+        data, error = results[path]
+        if data is None:
+            missing[ref] = error
+        else:
+            images[ref] = data
+    return images, missing
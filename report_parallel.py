@@ -0,0 +1,271 @@
+"""Render one report's sections in worker processes and merge them as XML.
+
+For a single large report (dozens of statistics and photo appendices), the
+serial build keeps one core busy. With ``--parallel`` every section is
+instead rendered by a worker process into a standalone fragment, on a
+fresh copy of the base template::
+
+    python export_report_to_word.py --parallel --jobs 8 -o annual.docx
+
+A fragment carries the section's body XML, its headings, and whatever it
+added beyond the template: image and hyperlink relationships (with the
+image bytes), styles and numbering definitions. The main process builds the
+cover page meanwhile, then merges the fragments in section order, as each
+one arrives, remapping
+
+    relationship IDs  images are added to the report (identical images are
+                      stored once) and ``r:`` references rewritten
+    numbering IDs     new ``w:abstractNum``/``w:num`` entries get the next
+                      free IDs, and ``w:numId`` references follow
+    style IDs         styles the template lacks are copied across once; all
+                      fragments start from the same template, so the rest
+                      already match
+    bookmarks         heading bookmarks are renamed as the serial build
+                      would have named them, so the TOC and the document
+                      XML come out the same
+    drawing IDs       ``wp:docPr`` IDs, and the "Picture N" names python-docx
+                      derives from them, are renumbered to stay unique
+
+The TOC (which needs the finished heading list) and any section whose
+fragment has another kind of relationship are rendered by the main process
+as usual. Merging is linear in the size of each fragment, so wall time is
+bounded by the slowest section rather than the sum of them all.
+"""
+import functools
+import io
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import export_report_to_word as report
+from report_batch import init_worker
+from report_trace import annotate, span
+
+# Sections rendered by the main process: they hold live references into the
+# final document
+MAIN_SECTIONS = report.UNCACHED_SECTIONS
+
+_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PICTURE_NAME = re.compile(r'Picture \d+')
+
+
+def _ids(parent, tag, attribute):
+    from docx.oxml.ns import qn
+
+    return {element.get(qn(attribute)) for element in parent.iterchildren(qn(tag))}
+
+
+@functools.lru_cache(maxsize=None)
+def _template_ids():
+    """IDs the base template defines: ``(rIds, style IDs, numIds, abstractNumIds)``"""
+    from docx import Document
+
+    doc = Document(io.BytesIO(report.base_template()))
+    numbering = doc.part.numbering_part.element
+    return (frozenset(doc.part.rels), frozenset(_ids(doc.styles.element, 'w:style', 'w:styleId')),
+            frozenset(_ids(numbering, 'w:num', 'w:numId')),
+            frozenset(_ids(numbering, 'w:abstractNum', 'w:abstractNumId')))
+
+
+def render_fragment(config, name, incremental=False):
+    """Render one section on its own and return it as a fragment dict
+
+    Returns None if the section added a relationship the merge cannot carry
+    across, so the main process renders it instead.
+    """
+    from docx import Document
+    from docx.opc.constants import RELATIONSHIP_TYPE as RT
+    from docx.oxml.ns import qn
+    from lxml import etree
+
+    started = time.perf_counter()
+    add_section = dict(report.report_sections(config))[name]
+    doc = Document(io.BytesIO(report.base_template()))
+    index = report.HeadingIndex.attach(doc)
+    report.add_report_section(doc, name, add_section, config, incremental)
+
+    rel_ids, style_ids, num_ids, abstract_ids = _template_ids()
+    rels = []
+    for rId, rel in doc.part.rels.items():
+        if rId in rel_ids:
+            continue
+        if rel.is_external:
+            rels.append((rId, rel.reltype, rel.target_ref, None))
+        elif rel.reltype == RT.IMAGE:
+            rels.append((rId, rel.reltype, None, rel.target_part.blob))
+        else:
+            return None
+
+    def new(parent, tag, attribute, known):
+        return [etree.tostring(element, encoding='unicode') for element in parent.iterchildren(qn(tag))
+                if element.get(qn(attribute)) not in known]
+
+    body = doc.element.body
+    end = len(body) - (body.sectPr is not None)
+    numbering = doc.part.numbering_part.element
+    return {
+        'xml': ''.join(etree.tostring(element, encoding='unicode') for element in body[:end]),
+        'headings': index.entries,
+        'rels': rels,
+        'styles': new(doc.styles.element, 'w:style', 'w:styleId', style_ids),
+        'abstract_nums': new(numbering, 'w:abstractNum', 'w:abstractNumId', abstract_ids),
+        'nums': new(numbering, 'w:num', 'w:numId', num_ids),
+        'seconds': round(time.perf_counter() - started, 4),
+        'pid': os.getpid(),
+    }
+
+
+class FragmentMerger:
+    """Append fragments to a document, remapping their IDs into it"""
+
+    def __init__(self, doc, index):
+        from docx.oxml.ns import qn
+
+        self.doc = doc
+        self.index = index
+        self.styles = doc.styles.element
+        self.style_ids = _ids(self.styles, 'w:style', 'w:styleId')
+        self.numbering = doc.part.numbering_part.element
+        self.num_max = max((int(i) for i in _ids(self.numbering, 'w:num', 'w:numId')), default=0)
+        self.abstract_max = max((int(i) for i in _ids(self.numbering, 'w:abstractNum', 'w:abstractNumId')),
+                                default=-1)
+        self._next_drawing_id = None
+        self._tags = {tag: qn(tag) for tag in ('w:numId', 'w:bookmarkStart', 'w:bookmarkEnd', 'wp:docPr')}
+        self._id, self._name, self._val = qn('w:id'), qn('w:name'), qn('w:val')
+
+    def document_changed(self):
+        """Note that the main process added content, which may hold drawings"""
+        self._next_drawing_id = None
+
+    def _merge_styles(self, styles):
+        from docx.oxml import parse_xml
+        from docx.oxml.ns import qn
+
+        for xml in styles:
+            style = parse_xml(xml)
+            style_id = style.get(qn('w:styleId'))
+            if style_id not in self.style_ids:
+                self.styles.append(style)
+                self.style_ids.add(style_id)
+
+    def _merge_numbering(self, abstract_nums, nums):
+        from docx.oxml import parse_xml
+        from docx.oxml.ns import qn
+
+        abstract_map, num_map = {}, {}
+        nums_present = list(self.numbering.iterchildren(qn('w:num')))
+        for xml in abstract_nums:
+            abstract = parse_xml(xml)
+            self.abstract_max += 1
+            abstract_map[abstract.get(qn('w:abstractNumId'))] = str(self.abstract_max)
+            abstract.set(qn('w:abstractNumId'), str(self.abstract_max))
+            # Every w:abstractNum precedes the first w:num
+            if nums_present:
+                nums_present[0].addprevious(abstract)
+            else:
+                self.numbering.append(abstract)
+        last = nums_present[-1] if nums_present else None
+        for xml in nums:
+            num = parse_xml(xml)
+            self.num_max += 1
+            num_map[num.get(qn('w:numId'))] = str(self.num_max)
+            num.set(qn('w:numId'), str(self.num_max))
+            reference = num.find(qn('w:abstractNumId'))
+            if reference is not None:
+                reference.set(qn('w:val'), abstract_map.get(reference.get(qn('w:val')), reference.get(qn('w:val'))))
+            if last is not None:
+                last.addnext(num)
+            else:
+                self.numbering.append(num)
+            last = num
+        return num_map
+
+    def _merge_rels(self, rels):
+        part = self.doc.part
+        rel_map = {}
+        for rId, reltype, target, blob in rels:
+            if blob is not None:
+                rel_map[rId] = part.get_or_add_image(io.BytesIO(blob))[0]
+            else:
+                rel_map[rId] = part.relate_to(target, reltype, is_external=True)
+        return rel_map
+
+    def merge(self, fragment):
+        """Append a fragment from ``render_fragment()`` to the document"""
+        tags = self._tags
+        self._merge_styles(fragment['styles'])
+        num_map = self._merge_numbering(fragment['abstract_nums'], fragment['nums'])
+        rel_map = self._merge_rels(fragment['rels'])
+
+        entries = self.index.entries
+        bookmark_names = {}
+        for level, text, name in fragment['headings']:
+            new_name, new_id = report.HeadingIndex.bookmark_ids(level, text, len(entries))
+            bookmark_names[name] = (new_name, new_id)
+            entries.append((level, text, new_name))
+        bookmark_ids = {}
+
+        wrapper = report.section_wrapper(fragment['xml'])
+        for element in wrapper.iter():
+            tag = element.tag
+            if tag == tags['w:bookmarkStart']:
+                renamed = bookmark_names.get(element.get(self._name))
+                if renamed is not None:
+                    bookmark_ids[element.get(self._id)] = renamed[1]
+                    element.set(self._name, renamed[0])
+                    element.set(self._id, renamed[1])
+            elif tag == tags['w:bookmarkEnd']:
+                new_id = bookmark_ids.get(element.get(self._id))
+                if new_id is not None:
+                    element.set(self._id, new_id)
+            elif tag == tags['w:numId'] and num_map:
+                value = element.get(self._val)
+                element.set(self._val, num_map.get(value, value))
+            elif tag == tags['wp:docPr']:
+                if self._next_drawing_id is None:
+                    self._next_drawing_id = self.doc.part.next_id
+                element.set('id', str(self._next_drawing_id))
+                # python-docx names pictures after their ID
+                if _PICTURE_NAME.fullmatch(element.get('name', '')):
+                    element.set('name', f'Picture {self._next_drawing_id}')
+                self._next_drawing_id += 1
+            if rel_map:
+                for attribute, value in element.attrib.items():
+                    if attribute.startswith(_RELATIONSHIP_NS) and value in rel_map:
+                        element.set(attribute, rel_map[value])
+        report._append_section_xml(self.doc, wrapper)
+
+
+def build_report(config=None, workers=None, incremental=False):
+    """Build the report with its sections rendered by ``workers`` processes; returns the ``Document``"""
+    config = report.resolve_config(config)
+    with span('spec', 'template'):
+        config = report.variant_config(config)
+        sections = report.report_sections(config)
+    pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=init_worker)
+    try:
+        futures = {name: pool.submit(render_fragment, config, name, incremental)
+                   for name, add_section in sections if add_section not in MAIN_SECTIONS}
+        with span('template', 'template'):
+            doc = report.template_document(config)
+        index = report.HeadingIndex.attach(doc)
+        merger = FragmentMerger(doc, index)
+        for name, add_section in sections:
+            fragment = None
+            if name in futures:
+                with span(f'wait:{name}', 'wait'):
+                    fragment = futures[name].result()
+            if fragment is None:
+                report.add_report_section(doc, name, add_section, config, incremental)
+                merger.document_changed()
+                continue
+            with span(name, 'section', doc):
+                merger.merge(fragment)
+                annotate(worker=fragment['pid'], worker_seconds=fragment['seconds'])
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    with span('write_toc', 'section', doc):
+        index.write_toc()
+    report.set_core_properties(doc, config)
+    return doc
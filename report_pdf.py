@@ -0,0 +1,953 @@
+"""Render the report straight to PDF from the same section functions as the .docx.
+
+``PdfDocument`` stands in for a python-docx ``Document``. Sections call
+``add_heading``, ``add_paragraph`` (``List Bullet`` and ``Caption`` styles
+included), ``add_page_break`` and ``add_picture`` on it exactly as they do
+for Word; the shared helpers (``add_code_block``, ``add_bulk_table``,
+``add_photo_grid`` and the table of contents) hand it their content through
+methods of the same name instead of building WordprocessingML.
+
+Blocks are laid out as they arrive and every page is compressed and written
+to the output as soon as it is full, so memory stays at about one page (plus
+one outline entry per heading) however long the report is. Two things are
+only known at the end: the table of contents and the page numbers after it,
+since the contents can run to several pages. The contents page is the one
+page held back until then, and each footer is a tiny form XObject that is
+written at the end.
+
+Only the PDF standard fonts (Helvetica and Courier) are used. They need no
+embedding but cover WinAnsi (Latin-1 and typographic punctuation) only, so
+box-drawing characters are drawn as ASCII and anything else as '?'. JPEGs
+are embedded as they are; other images (the PNG charts) need Pillow and are
+replaced by a note without it.
+"""
+import hashlib
+import io
+import os
+import re
+import zlib
+
+import export_report_to_word as report
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792  # US Letter, like the Word template
+MARGIN = 72
+TEXT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+FOOTER_Y = 36
+
+EMU_PER_POINT = 12700
+
+# Helvetica advance widths for ' ' to '~' (1/1000 em), from the Adobe AFMs
+_HELVETICA = (
+    '278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 '
+    '556 556 278 278 584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 '
+    '667 778 722 667 611 722 667 944 667 667 611 278 278 278 469 556 333 556 556 500 556 556 278 556 '
+    '556 222 222 500 222 833 556 556 556 556 333 500 278 556 500 722 500 500 500 334 260 334 584'
+)
+_HELVETICA_BOLD = (
+    '278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 '
+    '556 556 333 333 584 584 584 611 975 722 722 722 722 667 611 778 722 278 556 722 611 833 722 778 '
+    '667 778 722 667 611 722 667 944 667 667 611 333 278 333 584 556 333 556 611 556 611 556 333 611 '
+    '611 278 278 556 278 889 611 611 611 611 389 556 333 611 556 778 556 556 500 389 280 389 584'
+)
+# Punctuation outside ASCII that the report uses; other Latin-1 letters are
+# close enough to the average width
+_EXTRA_WIDTHS = {'•': 350, '·': 278, '–': 556, '—': 1000, '‘': 222,
+                 '’': 222, '“': 333, '”': 333, '…': 1000, '©': 737}
+_DEFAULT_WIDTH = 556
+
+
+def _width_table(widths):
+    table = {chr(32 + i): int(w) for i, w in enumerate(widths.split())}
+    table.update(_EXTRA_WIDTHS)
+    return table
+
+
+_WIDTHS = {False: _width_table(_HELVETICA), True: _width_table(_HELVETICA_BOLD)}
+
+# (monospaced, bold, italic) -> (resource name, standard font)
+FONTS = {
+    (False, False, False): ('F1', 'Helvetica'),
+    (False, True, False): ('F2', 'Helvetica-Bold'),
+    (False, False, True): ('F3', 'Helvetica-Oblique'),
+    (False, True, True): ('F4', 'Helvetica-BoldOblique'),
+    (True, False, False): ('F5', 'Courier'),
+    (True, True, False): ('F6', 'Courier-Bold'),
+    (True, False, True): ('F7', 'Courier-Oblique'),
+    (True, True, True): ('F8', 'Courier-BoldOblique'),
+}
+
+BLACK = (0, 0, 0)
+
+# Paragraph styles, modelled on the python-docx default template
+STYLES = {
+    'Normal': {'size': 11, 'after': 6},
+    'Title': {'size': 26, 'color': (23, 54, 93), 'after': 12},
+    'Heading 1': {'size': 14, 'bold': True, 'color': (54, 95, 145), 'before': 18, 'after': 6, 'keep': True},
+    'Heading 2': {'size': 13, 'bold': True, 'color': (79, 129, 189), 'before': 10, 'after': 4, 'keep': True},
+    'Heading 3': {'size': 11, 'bold': True, 'color': (79, 129, 189), 'before': 10, 'after': 4, 'keep': True},
+    'List Bullet': {'size': 11, 'indent': 18, 'bullet': '•', 'after': 3},
+    'Caption': {'size': 9, 'bold': True, 'color': (79, 129, 189), 'after': 10},
+}
+
+LEADING = 1.2
+CODE_SIZE = 9
+CODE_INDENT = 36
+CODE_PADDING = 4
+CODE_FILL = (245, 245, 245)
+TABLE_SIZE = 10
+TABLE_PADDING = 4
+TABLE_RULE = (79, 129, 189)
+# Room a heading needs below it so it is not stranded at the foot of a page
+KEEP_WITH_NEXT = 40
+
+# Characters outside WinAnsi that the report uses, drawn as ASCII
+_FALLBACK = str.maketrans({
+    '├': '+', '└': '+', '┌': '+', '┐': '+', '┘': '+', '┤': '+',
+    '┬': '+', '┴': '+', '┼': '+', '│': '|', '─': '-', '→': '->',
+    '←': '<-', '✓': 'v', '\u00a0': ' ', '\t': '    ', '\r': '',
+})
+
+_TOKEN = re.compile(r'\n|[^\S\n]+|[^\s]+')
+_ALIGNMENTS = {1: 'center', 2: 'right'}
+
+
+def _clean(text):
+    """Return text that encodes to WinAnsi, with the fallbacks above applied"""
+    text = str(text).translate(_FALLBACK)
+    try:
+        text.encode('cp1252')
+    except UnicodeEncodeError:
+        text = text.encode('cp1252', 'replace').decode('cp1252')
+    return text
+
+
+def _literal(text):
+    """Return a PDF literal string for cleaned text"""
+    data = text.encode('cp1252')
+    return b'(' + data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _text_string(text):
+    """Return a PDF text string (UTF-16) for outline titles and metadata"""
+    return b'<' + ('\ufeff' + str(text)).encode('utf-16-be').hex().upper().encode('ascii') + b'>'
+
+
+def text_width(text, size, mono=False, bold=False):
+    """Width of cleaned text in points"""
+    if mono:
+        return len(text) * 0.6 * size
+    widths = _WIDTHS[bold]
+    return sum(widths.get(c, _DEFAULT_WIDTH) for c in text) * size / 1000
+
+
+def _points(length):
+    """Convert a python-docx length (EMU) to points"""
+    return None if length is None else length / EMU_PER_POINT
+
+
+def _rgb(color):
+    return ' '.join(f'{c / 255:.3g}' for c in color)
+
+
+# ===== DOCUMENT MODEL =====
+# Just enough of python-docx's paragraph API for the sections and cover page
+
+class _Color:
+    def __init__(self):
+        self.rgb = None
+
+
+class _Font:
+    def __init__(self):
+        self.name = None
+        self.size = None
+        self.bold = None
+        self.italic = None
+        self.color = _Color()
+
+
+class Run:
+    def __init__(self, text=''):
+        self.text = text
+        self.font = _Font()
+
+    @property
+    def bold(self):
+        return self.font.bold
+
+    @bold.setter
+    def bold(self, value):
+        self.font.bold = value
+
+    @property
+    def italic(self):
+        return self.font.italic
+
+    @italic.setter
+    def italic(self, value):
+        self.font.italic = value
+
+
+class _ParagraphFormat:
+    def __init__(self):
+        self.left_indent = None
+        self.space_before = None
+        self.space_after = None
+
+
+class Paragraph:
+    def __init__(self, text='', style=None):
+        self.style = style or 'Normal'
+        self.alignment = None
+        self.runs = []
+        self.paragraph_format = _ParagraphFormat()
+        self.level = None
+        self.toc = False
+        if text:
+            self.add_run(text)
+
+    def add_run(self, text='', style=None):
+        run = Run(text)
+        self.runs.append(run)
+        return run
+
+    @property
+    def text(self):
+        return ''.join(run.text for run in self.runs)
+
+
+# ===== WRITER =====
+
+class _Writer:
+    """Write numbered objects to a binary stream and keep their offsets for the xref"""
+
+    def __init__(self, out, compression_level=6):
+        self.out = out
+        self.compression_level = compression_level
+        self.pos = 0
+        self.offsets = {}
+        self.next_id = 1
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.out.write(data)
+        self.pos += len(data)
+
+    def alloc(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def write(self, obj_id, body, stream=None, compress=True):
+        """Write an object; ``body`` is the dict source, without the stream's /Length"""
+        self.offsets[obj_id] = self.pos
+        if stream is None:
+            self._write(b'%d 0 obj\n%s\nendobj\n' % (obj_id, body))
+            return
+        if compress and self.compression_level:
+            stream = zlib.compress(stream, self.compression_level)
+            body = body[:-2] + b' /Filter /FlateDecode >>'
+        body = body[:-2] + b' /Length %d >>' % len(stream)
+        self._write(b'%d 0 obj\n%s\nstream\n' % (obj_id, body))
+        self._write(stream)
+        self._write(b'\nendstream\nendobj\n')
+
+    def finish(self, root_id, info_id):
+        xref = self.pos
+        lines = [b'xref\n0 %d\n' % self.next_id, b'0000000000 65535 f \n']
+        for obj_id in range(1, self.next_id):
+            offset = self.offsets.get(obj_id)
+            lines.append(b'%010d 00000 n \n' % offset if offset is not None else b'0000000000 00000 f \n')
+        self._write(b''.join(lines))
+        self._write(b'trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                    % (self.next_id, root_id, info_id, xref))
+
+
+class _Page:
+    def __init__(self, obj_id, footer_id):
+        self.id = obj_id
+        self.footer_id = footer_id
+        # Content operators; contents entries are ('toc', ...) tuples until numbered
+        self.ops = []
+        self.images = {}
+        self.links = []
+
+
+def _jpeg_size(data):
+    """Return ``(width, height, components)`` from a JPEG's frame header"""
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            break
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return width, height, data[i + 9]
+        i += 2 + int.from_bytes(data[i + 2:i + 4], 'big')
+    raise ValueError('JPEG has no frame header')
+
+
+def _image_object(data):
+    """Return ``(width, height, dict source, stream, compress)`` for an image XObject"""
+    if data[:3] == b'\xff\xd8\xff':
+        width, height, components = _jpeg_size(data)
+        space = {1: b'/DeviceGray', 3: b'/DeviceRGB', 4: b'/DeviceCMYK'}.get(components)
+        if space is None:
+            raise ValueError(f'JPEG with {components} components')
+        body = (b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s '
+                b'/BitsPerComponent 8 /Filter /DCTDecode >>' % (width, height, space))
+        return width, height, body, data, False
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ValueError('Pillow is needed to embed images other than JPEG') from None
+    image = Image.open(io.BytesIO(data))
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        # Flatten onto the white page rather than carrying a soft mask
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    space = b'/DeviceGray' if image.mode == 'L' else b'/DeviceRGB'
+    body = (b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s '
+            b'/BitsPerComponent 8 >>' % (image.width, image.height, space))
+    return image.width, image.height, body, image.tobytes(), True
+
+
+class PdfDocument:
+    """A python-docx look-alike that lays the report out as PDF pages and streams them
+
+    ``out`` is a path or a writable binary stream. Call ``close()`` once
+    every section has been added; it writes the contents, page numbers,
+    outline and cross-reference table. Used as a context manager it calls
+    ``discard()`` instead if the block raises.
+    ``compression_level`` (0-9) is the zlib level for content streams; 0
+    leaves them uncompressed.
+    """
+
+    backend = 'pdf'
+
+    def __init__(self, out, title='', author='', subject='', compression_level=6):
+        if isinstance(out, str):
+            self._path = out
+            self._file = open(out, 'wb')
+            out = self._file
+        else:
+            self._path = self._file = None
+        self._writer = _Writer(out, compression_level)
+        self._info = {'Title': title, 'Author': author, 'Subject': subject}
+        self._catalog_id = self._writer.alloc()
+        self._pages_id = self._writer.alloc()
+        self._fonts_id = self._writer.alloc()
+        self._write_fonts()
+
+        self.heading_index = self
+        self._pending = None
+        self._page = None
+        self._y = 0
+        self._kids = []
+        self._footers = {}
+        self._images = {}
+        self._image_ids = {}
+        self._headings = []
+        self._outline = False
+        self._toc = None
+        self._closed = False
+
+    def _write_fonts(self):
+        entries = []
+        for name, base in FONTS.values():
+            font_id = self._writer.alloc()
+            self._writer.write(font_id, b'<< /Type /Font /Subtype /Type1 /BaseFont /%s '
+                                        b'/Encoding /WinAnsiEncoding >>' % base.encode('ascii'))
+            entries.append(b'/%s %d 0 R' % (name.encode('ascii'), font_id))
+        self._writer.write(self._fonts_id, b'<< ' + b' '.join(entries) + b' >>')
+
+    # ----- python-docx API -----
+
+    def add_heading(self, text='', level=1):
+        self._flush()
+        style = 'Title' if level == 0 else f'Heading {min(level, 3)}'
+        paragraph = Paragraph(text, style)
+        paragraph.level = level
+        self._pending = paragraph
+        return paragraph
+
+    def add_paragraph(self, text='', style=None):
+        self._flush()
+        self._pending = Paragraph(text, style)
+        return self._pending
+
+    def add_page_break(self):
+        self._flush()
+        self._finish_page()
+
+    def add_picture(self, image_descriptor, width=None, height=None):
+        """Add an image on its own line; ``width``/``height`` are python-docx lengths"""
+        self._flush()
+        try:
+            name, px_width, px_height = self._image(image_descriptor)
+        except (OSError, ValueError) as e:
+            self._layout(Paragraph(f'[image omitted: {e}]', 'Caption'))
+            return
+        w, h = self._picture_size(px_width, px_height, _points(width), _points(height))
+        self._need(h)
+        self._page.ops.append(f'q {w:.2f} 0 0 {h:.2f} {MARGIN} {self._y - h:.2f} cm /{name} Do Q')
+        self._page.images[name] = self._image_ids[name]
+        self._y -= h + 6
+
+    # ----- shared helpers -----
+
+    def set_placeholder(self, paragraph):
+        """Mark where the table of contents goes (see ``HeadingIndex.set_placeholder``)"""
+        paragraph.toc = True
+
+    def start_outline(self):
+        """List headings added from here on in the outline and table of contents"""
+        self._flush()
+        self._outline = True
+
+    def add_code_block(self, code, language=''):
+        """Add a shaded, monospaced code block, coloured like the Word version"""
+        from report_highlight import COLORS, DEFAULT_COLOR, GRAMMARS, tokenize
+
+        self._flush()
+        language = (language or '').lower()
+        tokens = tokenize(code, language) if language in GRAMMARS else [(None, code)]
+        segments = []
+        for kind, text in tokens:
+            color = COLORS.get(kind, DEFAULT_COLOR)
+            color = tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+            segments.append((text, (True, False, kind == 'comment'), CODE_SIZE, color))
+
+        left = MARGIN + CODE_INDENT
+        lines = self._wrap(segments, TEXT_WIDTH - CODE_INDENT - 2 * CODE_PADDING, keep_space=True)
+        height = CODE_SIZE * LEADING
+        self._skip(6)
+        self._need(height + 2 * CODE_PADDING)
+        top, mark = self._y, len(self._page.ops)
+        self._y -= CODE_PADDING
+        for line in lines:
+            if self._y - height < MARGIN:
+                # Continue the block, and its shading, on the next page
+                self._shade(mark, left, top, max(self._y - CODE_PADDING, MARGIN))
+                self._finish_page()
+                self._new_page()
+                top, mark = self._y, len(self._page.ops)
+                self._y -= CODE_PADDING
+            self._draw_line(line, left + CODE_PADDING, height, CODE_SIZE)
+        self._y -= CODE_PADDING
+        self._shade(mark, left, top, self._y)
+        self._y -= 6
+
+    def add_bulk_table(self, rows, header=None, cols=None, column_styles=None, style=None, chunk_rows=None):
+        """Add a ruled table, repeating the header row at the top of every page
+
+        Takes the same ``column_styles`` as ``report.add_bulk_table``; rows
+        are consumed lazily and drawn as they come. The Word table ``style``
+        and ``chunk_rows`` do not apply: the PDF draws one ruled table.
+        """
+        self._flush()
+        rows = iter(rows)
+        if cols is None:
+            if header is not None:
+                cols = len(header)
+            else:
+                first = next(rows, None)
+                cols = len(first) if first is not None else 1
+                if first is not None:
+                    rows = _prepend(first, rows)
+        columns = self._table_columns(cols, column_styles)
+        header = self._table_cells(header, columns, cols, header=True) if header is not None else None
+
+        self._skip(4)
+        self._need(2 * (TABLE_SIZE * LEADING + 2 * TABLE_PADDING))
+        if header is not None:
+            self._draw_row(*header, columns, header=True)
+        for values in rows:
+            cells, height = self._table_cells(values, columns, cols)
+            if self._y - height < MARGIN:
+                self._finish_page()
+                self._new_page()
+                if header is not None:
+                    self._draw_row(*header, columns, header=True)
+            self._draw_row(cells, height, columns)
+        self._y -= 8
+
+    def add_image_grid(self, entries, width, columns):
+        """Add ``(caption, image bytes)`` pairs in rows of ``columns`` captioned images"""
+        self._flush()
+        cell_width = TEXT_WIDTH / columns
+        caption_style = STYLES['Caption']
+        size = caption_style['size']
+        line_height = size * LEADING
+        for start in range(0, len(entries), columns):
+            cells = []
+            for caption, data in entries[start:start + columns]:
+                try:
+                    name, px_width, px_height = self._image(io.BytesIO(data))
+                except (OSError, ValueError):
+                    name, px_width, px_height = None, 1, 1
+                w, h = self._picture_size(px_width, px_height, min(_points(width), cell_width - 8), None)
+                segments = [(caption, (False, True, False), size, caption_style['color'])]
+                lines = self._wrap(segments, cell_width - 8)
+                cells.append((name, w, h if name else 0, lines))
+            row_height = max(h + 4 + len(lines) * line_height for _, _, h, lines in cells) + 10
+            self._need(row_height)
+            top = self._y
+            for i, (name, w, h, lines) in enumerate(cells):
+                x = MARGIN + i * cell_width
+                if name:
+                    self._page.ops.append(
+                        f'q {w:.2f} 0 0 {h:.2f} {x + (cell_width - w) / 2:.2f} {top - h:.2f} cm /{name} Do Q')
+                    self._page.images[name] = self._image_ids[name]
+                self._y = top - h - 4
+                for line in lines:
+                    self._draw_line(line, x + 4, line_height, size, align='center', width=cell_width - 8)
+            self._y = top - row_height
+
+    def close(self):
+        """Finish the last page and write the contents, page numbers, outline and trailer"""
+        if self._closed:
+            return
+        self._flush()
+        self._finish_page()
+        if self._toc is not None:
+            self._write_toc()
+        self._write_footers()
+        writer = self._writer
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self._kids)
+        writer.write(self._pages_id, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self._kids)))
+        outline_id = self._write_outline()
+        outline = b' /Outlines %d 0 R /PageMode /UseOutlines' % outline_id if outline_id else b''
+        writer.write(self._catalog_id, b'<< /Type /Catalog /Pages %d 0 R%s >>' % (self._pages_id, outline))
+        info_id = writer.alloc()
+        info = b' '.join(b'/%s %s' % (key.encode('ascii'), _text_string(value))
+                         for key, value in self._info.items() if value)
+        writer.write(info_id, b'<< %s /Producer %s >>' % (info, _text_string('export_report_to_word.py')))
+        writer.finish(self._catalog_id, info_id)
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """Abandon a failed layout: close and delete ``out`` if it is a path
+
+        A stream is left holding the objects written so far, with no
+        cross-reference table.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    # ----- pages -----
+
+    def _new_page(self):
+        self._page = _Page(self._writer.alloc(), self._writer.alloc())
+        self._footers[self._page.id] = self._page.footer_id
+        self._y = PAGE_HEIGHT - MARGIN
+
+    def _finish_page(self):
+        page = self._page
+        if page is None:
+            return
+        self._page = None
+        self._kids.append(page.id)
+        if self._toc is not None and self._toc['page'] is page:
+            # Held back until the headings are known
+            return
+        self._write_page(page)
+
+    def _write_page(self, page):
+        writer = self._writer
+        ops = page.ops + [f'q /Pn{page.footer_id} Do Q']
+        content_id = writer.alloc()
+        writer.write(content_id, b'<< >>', '\n'.join(ops).encode('cp1252'))
+        xobjects = b''.join(b'/%s %d 0 R ' % (name.encode('ascii'), obj_id) for name, obj_id in page.images.items())
+        xobjects += b'/Pn%d %d 0 R' % (page.footer_id, page.footer_id)
+        annots = b''
+        if page.links:
+            annots = b' /Annots [%s]' % b' '.join(
+                b'<< /Type /Annot /Subtype /Link /Rect [%.2f %.2f %.2f %.2f] /Border [0 0 0] '
+                b'/Dest [%d 0 R /XYZ 0 %.2f null] >>' % (x1, y1, x2, y2, target, dest_y)
+                for (x1, y1, x2, y2), target, dest_y in page.links
+            )
+        writer.write(page.id, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] '
+                              b'/Resources << /Font %d 0 R /XObject << %s >> >> /Contents %d 0 R%s >>'
+                     % (self._pages_id, PAGE_WIDTH, PAGE_HEIGHT, self._fonts_id, xobjects, content_id, annots))
+
+    def _need(self, height):
+        """Start a page if there is none, or if ``height`` does not fit on this one"""
+        if self._page is not None and self._y - height < MARGIN and self._y < PAGE_HEIGHT - MARGIN:
+            self._finish_page()
+        if self._page is None:
+            self._new_page()
+
+    def _skip(self, space):
+        """Leave vertical space, except at the top of a page"""
+        if self._page is not None and self._y < PAGE_HEIGHT - MARGIN:
+            self._y -= space
+
+    def _write_footers(self):
+        for n, page_id in enumerate(self._kids, 1):
+            ops = ''
+            if n > 1:
+                label = f'Page {n}'
+                x = (PAGE_WIDTH - text_width(label, 9)) / 2
+                ops = f'BT /F1 9 Tf 0.4 0.4 0.4 rg {x:.2f} {FOOTER_Y} Td {_literal(label).decode("cp1252")} Tj ET'
+            self._writer.write(self._footers[page_id], b'<< /Type /XObject /Subtype /Form /BBox [0 0 %d %d] '
+                                            b'/Resources << /Font %d 0 R >> >>'
+                               % (PAGE_WIDTH, PAGE_HEIGHT, self._fonts_id), ops.encode('cp1252'))
+
+    # ----- images -----
+
+    def _image(self, image_descriptor):
+        """Return ``(resource name, width, height)``, writing each distinct image once"""
+        if isinstance(image_descriptor, str):
+            with open(image_descriptor, 'rb') as f:
+                data = f.read()
+        else:
+            data = image_descriptor.read()
+        key = hashlib.sha1(data).hexdigest()
+        if key not in self._images:
+            width, height, body, stream, compress = _image_object(data)
+            obj_id = self._writer.alloc()
+            self._writer.write(obj_id, body, stream, compress)
+            name = f'Im{len(self._images) + 1}'
+            self._images[key] = (name, width, height)
+            self._image_ids[name] = obj_id
+        return self._images[key]
+
+    @staticmethod
+    def _picture_size(px_width, px_height, width, height):
+        """Return the drawn size in points, defaulting to 96 DPI and fitting the text area"""
+        if width is None and height is None:
+            width = px_width * 72 / 96
+        if width is None:
+            width = height * px_width / px_height
+        if height is None:
+            height = width * px_height / px_width
+        scale = min(1, TEXT_WIDTH / width, (PAGE_HEIGHT - 2 * MARGIN) / height)
+        return width * scale, height * scale
+
+    # ----- text -----
+
+    def _flush(self):
+        paragraph, self._pending = self._pending, None
+        if paragraph is not None:
+            self._layout(paragraph)
+
+    def _layout(self, paragraph):
+        style = STYLES.get(paragraph.style, STYLES['Normal'])
+        fmt = paragraph.paragraph_format
+        before = _points(fmt.space_before) if fmt.space_before is not None else style.get('before', 0)
+        after = _points(fmt.space_after) if fmt.space_after is not None else style.get('after', 0)
+        indent = _points(fmt.left_indent) if fmt.left_indent is not None else style.get('indent', 0)
+        align = _ALIGNMENTS.get(paragraph.alignment and int(paragraph.alignment), 'left')
+
+        segments = []
+        for run in paragraph.runs:
+            font = run.font
+            size = _points(font.size) or style['size']
+            bold = font.bold if font.bold is not None else style.get('bold', False)
+            italic = bool(font.italic)
+            mono = bool(font.name and 'courier' in font.name.lower())
+            color = tuple(font.color.rgb) if font.color.rgb is not None else style.get('color', BLACK)
+            segments.append((run.text, (mono, bool(bold), italic), size, color))
+        lines = self._wrap(segments, TEXT_WIDTH - indent)
+        if not lines:
+            lines = [([], 0, style['size'])]
+
+        self._skip(before)
+        first_height = lines[0][2] * LEADING
+        self._need(first_height + (KEEP_WITH_NEXT if style.get('keep') else 0))
+        if paragraph.level and self._outline:
+            self._headings.append((paragraph.level, paragraph.text, self._page.id, self._y))
+        bullet = style.get('bullet')
+        for i, line in enumerate(lines):
+            height = line[2] * LEADING
+            self._need(height)
+            if i == 0 and bullet:
+                self._draw_line(([(bullet, (False, False, False), style['size'], BLACK, 0)], 0, style['size']),
+                                MARGIN + indent - 12, height, style['size'], advance=False)
+            self._draw_line(line, MARGIN + indent, height, line[2], align=align, width=TEXT_WIDTH - indent)
+        if paragraph.toc:
+            self._toc = {'page': self._page, 'y': self._y, 'start': len(self._headings)}
+        self._y -= after
+
+    def _wrap(self, segments, width, keep_space=False):
+        """Split styled ``(text, font, size, color)`` segments into lines that fit ``width``
+
+        Returns ``(pieces, line width, largest size)`` per line, each piece
+        being ``(text, font, size, color, width)``. Spaces at a soft line
+        break are dropped unless ``keep_space`` (for code) is set.
+        """
+        lines = []
+        pieces, used, largest = [], 0.0, 0
+
+        def finish():
+            nonlocal pieces, used, largest
+            while pieces and not keep_space and pieces[-1][0].isspace():
+                used -= pieces.pop()[4]
+            lines.append((pieces, used, largest or size))
+            pieces, used, largest = [], 0.0, 0
+
+        size = STYLES['Normal']['size']
+        soft = False
+        for text, font, size, color in segments:
+            text = _clean(text)
+            mono, bold, _ = font
+            for token in _TOKEN.findall(text):
+                if token == '\n':
+                    finish()
+                    soft = False
+                    continue
+                if token.isspace() and not pieces and soft and not keep_space:
+                    continue
+                w = text_width(token, size, mono, bold)
+                if used + w > width and pieces and not token.isspace():
+                    finish()
+                    soft = True
+                while w > width and token:
+                    # A single word wider than the line: break it where it overflows
+                    cut = max(1, _fit(token, width - used, size, mono, bold))
+                    part = token[:cut]
+                    pieces.append((part, font, size, color, text_width(part, size, mono, bold)))
+                    largest = max(largest, size)
+                    finish()
+                    soft = True
+                    token = token[cut:]
+                    w = text_width(token, size, mono, bold)
+                if token:
+                    pieces.append((token, font, size, color, w))
+                    used += w
+                    largest = max(largest, size)
+        if pieces or lines:
+            finish()
+        elif segments:
+            lines.append(([], 0, size))
+        return lines
+
+    def _draw_line(self, line, x, height, size, align='left', width=TEXT_WIDTH, advance=True):
+        pieces, used, _ = line
+        if align == 'center':
+            x += (width - used) / 2
+        elif align == 'right':
+            x += width - used
+        baseline = self._y - height + (height - size) / 2 + 0.22 * size
+        ops = []
+        current = None
+        for text, font, piece_size, color, w in _merge(pieces):
+            key = (font, piece_size, color)
+            if key != current:
+                ops.append(f'/{FONTS[font][0]} {piece_size:g} Tf {_rgb(color)} rg')
+                current = key
+            ops.append(f'1 0 0 1 {x:.2f} {baseline:.2f} Tm {_literal(text).decode("cp1252")} Tj')
+            x += w
+        if ops:
+            self._page.ops.append('BT ' + ' '.join(ops) + ' ET')
+        if advance:
+            self._y -= height
+
+    def _shade(self, mark, left, top, bottom):
+        """Paint a code block's background under the lines drawn since ``mark``"""
+        self._page.ops.insert(mark, f'{_rgb(CODE_FILL)} rg {left} {bottom:.2f} '
+                                    f'{PAGE_WIDTH - MARGIN - left} {top - bottom:.2f} re f')
+
+    # ----- tables -----
+
+    @staticmethod
+    def _table_columns(cols, column_styles):
+        """Return ``(x, width, align, mono, bold, fill)`` per column"""
+        column_styles = list(column_styles or [])
+        if len(column_styles) > cols:
+            raise ValueError(f'{len(column_styles)} column styles given for {cols} columns')
+        column_styles += [{}] * (cols - len(column_styles))
+        for style in column_styles:
+            unknown = sorted(set(style) - set(report.COLUMN_STYLE_KEYS))
+            if unknown:
+                raise ValueError(f'Unknown column style keys: {", ".join(unknown)}')
+            if style.get('align') not in (None, 'left', 'center', 'right'):
+                raise ValueError(f'column align must be left, center or right, got {style["align"]!r}')
+        # Widths are twips, as in the Word table
+        fixed = sum((style.get('width') or 0) / 20 for style in column_styles)
+        flexible = sum(1 for style in column_styles if not style.get('width'))
+        default = max(TEXT_WIDTH - fixed, 0) / flexible if flexible else 0
+        columns, x = [], MARGIN
+        for style in column_styles:
+            width = (style.get('width') or 0) / 20 or default
+            fill = style.get('fill')
+            fill = tuple(int(fill[i:i + 2], 16) for i in (0, 2, 4)) if fill else None
+            columns.append((x, width, style.get('align') or 'left', bool(style.get('mono')),
+                            bool(style.get('bold')), fill))
+            x += width
+        return columns
+
+    def _table_cells(self, values, columns, cols, header=False):
+        """Return the wrapped lines of each cell in a row, and the row's height"""
+        values = tuple(values)
+        if len(values) != cols:
+            raise ValueError(f'table row has {len(values)} cells, expected {cols}')
+        cells = []
+        for value, (_, width, _, mono, bold, _) in zip(values, columns):
+            if value is None:
+                cells.append([])
+                continue
+            font = (mono and not header, bold or header, False)
+            cells.append(self._wrap([(str(value), font, TABLE_SIZE, BLACK)], width - 2 * TABLE_PADDING))
+        most = max(1, max(len(lines) for lines in cells))
+        # A row taller than a page is cut off at the page foot
+        return cells, min(most * TABLE_SIZE * LEADING + 2 * TABLE_PADDING, PAGE_HEIGHT - 2 * MARGIN)
+
+    def _draw_row(self, cells, height, columns, header=False):
+        line_height = TABLE_SIZE * LEADING
+        top, bottom = self._y, self._y - height
+        ops = self._page.ops
+        for (x, width, align, _, _, fill), lines in zip(columns, cells):
+            if fill:
+                ops.append(f'{_rgb(fill)} rg {x:.2f} {bottom:.2f} {width:.2f} {height:.2f} re f')
+            self._y = top - TABLE_PADDING
+            for line in lines:
+                if self._y - line_height < bottom:
+                    break
+                self._draw_line(line, x + TABLE_PADDING, line_height, TABLE_SIZE, align=align,
+                                width=width - 2 * TABLE_PADDING)
+        left, right = columns[0][0], columns[-1][0] + columns[-1][1]
+        rules = [f'{x:.2f} {top:.2f} m {x:.2f} {bottom:.2f} l' for x in [c[0] for c in columns] + [right]]
+        rules.append(f'{left:.2f} {top:.2f} m {right:.2f} {top:.2f} l')
+        # The header is set off by a heavier rule, as in Word's grid styles
+        ops.append(f'{_rgb(TABLE_RULE)} RG 0.5 w {" ".join(rules)} S '
+                   f'{1.5 if header else 0.5} w {left:.2f} {bottom:.2f} m {right:.2f} {bottom:.2f} l S')
+        self._y = bottom
+
+    # ----- contents and outline -----
+
+    def _write_toc(self):
+        """Lay out the held contents page, and any it overflows into, now every heading is known"""
+        toc = self._toc
+        entries = [h for h in self._headings[toc['start']:] if 1 <= h[0] <= 2]
+        self._page, self._y = toc['page'], toc['y']
+        insert_at = self._kids.index(self._page.id) + 1
+        pages = [self._page]
+        size = STYLES['Normal']['size']
+        height = size * LEADING
+        for level, text, page_id, dest_y in entries:
+            if self._y - height - 3 < MARGIN:
+                self._new_page()
+                self._kids.insert(insert_at, self._page.id)
+                insert_at += 1
+                pages.append(self._page)
+            self._y -= 3
+            left = MARGIN + (level - 1) * 18
+            bold = level == 1
+            label = _clean(text)
+            while label and text_width(label, size, bold=bold) > PAGE_WIDTH - MARGIN - left - 30:
+                label = label[:-1]
+            piece = (label, (False, bold, False), size, BLACK, text_width(label, size, bold=bold))
+            self._draw_line(([piece], piece[4], size), left, height, size, advance=False)
+            # The page number is filled in once the contents' own length is known
+            self._page.ops.append(('toc', page_id, self._y - height, size))
+            self._page.links.append(((left, self._y - height, PAGE_WIDTH - MARGIN, self._y), page_id, dest_y))
+            self._y -= height
+        self._page = None
+
+        numbers = {page_id: n for n, page_id in enumerate(self._kids, 1)}
+        for page in pages:
+            page.ops = [self._toc_number(op, numbers) if isinstance(op, tuple) else op for op in page.ops]
+            self._write_page(page)
+
+    @staticmethod
+    def _toc_number(op, numbers):
+        _, page_id, y, size = op
+        label = str(numbers[page_id])
+        x = PAGE_WIDTH - MARGIN - text_width(label, size)
+        baseline = y + (size * LEADING - size) / 2 + 0.22 * size
+        return f'BT /F1 {size:g} Tf 0 0 0 rg 1 0 0 1 {x:.2f} {baseline:.2f} Tm ({label}) Tj ET'
+
+    def _write_outline(self):
+        """Write the bookmarks panel from the recorded headings; returns its id or None"""
+        entries = [h for h in self._headings if h[0] >= 1]
+        if not entries:
+            return None
+        writer = self._writer
+        root = {'id': writer.alloc(), 'children': [], 'level': 0}
+        stack = [root]
+        for level, text, page_id, y in entries:
+            while stack[-1]['level'] >= level:
+                stack.pop()
+            node = {'id': writer.alloc(), 'children': [], 'level': level, 'title': text,
+                    'dest': (page_id, y), 'parent': stack[-1]}
+            stack[-1]['children'].append(node)
+            stack.append(node)
+
+        def write(node):
+            children = node['children']
+            parts = []
+            if node is root:
+                parts.append(b'/Type /Outlines')
+            else:
+                page_id, y = node['dest']
+                parts.append(b'/Title %s /Parent %d 0 R /Dest [%d 0 R /XYZ 0 %.2f null]'
+                             % (_text_string(node['title']), node['parent']['id'], page_id, y))
+                siblings = node['parent']['children']
+                i = siblings.index(node)
+                if i:
+                    parts.append(b'/Prev %d 0 R' % siblings[i - 1]['id'])
+                if i + 1 < len(siblings):
+                    parts.append(b'/Next %d 0 R' % siblings[i + 1]['id'])
+            if children:
+                parts.append(b'/First %d 0 R /Last %d 0 R /Count %d'
+                             % (children[0]['id'], children[-1]['id'], len(children)))
+            writer.write(node['id'], b'<< ' + b' '.join(parts) + b' >>')
+            for child in children:
+                write(child)
+
+        write(root)
+        return root['id']
+
+
+def _prepend(first, rows):
+    yield first
+    yield from rows
+
+
+def _fit(token, width, size, mono, bold):
+    """Number of leading characters of ``token`` that fit in ``width``"""
+    used = 0.0
+    for i, c in enumerate(token):
+        used += text_width(c, size, mono, bold)
+        if used > width:
+            return i
+    return len(token)
+
+
+def _merge(pieces):
+    """Join neighbouring pieces drawn in the same font, size and colour"""
+    merged = []
+    for piece in pieces:
+        if merged and merged[-1][1:4] == piece[1:4]:
+            text, font, size, color, width = merged[-1]
+            merged[-1] = (text + piece[0], font, size, color, width + piece[4])
+        else:
+            merged.append(piece)
+    return merged
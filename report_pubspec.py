@@ -0,0 +1,117 @@
+"""Read the PetPal app's dependencies from ``pubspec.yaml`` and ``pubspec.lock``.
+
+Both files are written by pub in a fixed, block-indented layout, so they are
+read with a small line scanner rather than a YAML parser. The lockfile is
+reduced to a compact index (package -> dependency kind, source, version) that
+is cached by content hash, so batch jobs reuse it instead of re-parsing
+thousands of lines.
+"""
+import os
+
+import export_report_to_word as report
+from report_sources import APP_ROOT
+
+# Bump whenever the scanners or the index layout change
+PUBSPEC_VERSION = 2
+
+PUBSPEC_FILE = 'pubspec.yaml'
+LOCK_FILE = 'pubspec.lock'
+
+DEPENDENCY_SECTIONS = ('dependencies', 'dev_dependencies')
+
+
+def _unquote(value):
+    value = value.split(' #', 1)[0].strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '\'"':
+        return value[1:-1]
+    return value
+
+
+def _blocks(text):
+    """Yield ``(indent, key, value)`` for every ``key: value`` line, skipping comments"""
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#') or ':' not in stripped:
+            continue
+        key, _, value = stripped.partition(':')
+        yield len(line) - len(line.lstrip(' ')), _unquote(key), _unquote(value)
+
+
+def parse_pubspec(text):
+    """Return the package name, version, SDK constraint and declared dependencies
+
+    Dependencies map to their version constraint, or to ``sdk: <name>`` /
+    ``path: <dir>`` / ``git: <url>`` for non-hosted packages.
+    """
+    result = {'name': None, 'version': None, 'sdk': None,
+              'dependencies': {}, 'dev_dependencies': {}}
+    section = package = None
+    for indent, key, value in _blocks(text):
+        if indent == 0:
+            section = key
+            package = None
+            if key in ('name', 'version'):
+                result[key] = value
+        elif section == 'environment' and indent == 2 and key == 'sdk':
+            result['sdk'] = value
+        elif section in DEPENDENCY_SECTIONS:
+            if indent == 2:
+                package = key
+                result[section][key] = value or None
+            elif package and result[section][package] is None and key in ('sdk', 'path', 'git', 'url'):
+                result[section][package] = f'{key}: {value}'
+    return result
+
+
+def parse_lockfile(text):
+    """Return ``{'packages': {name: [dependency, source, version]}, 'sdks': {...}}``"""
+    packages, sdks = {}, {}
+    section = package = None
+    for indent, key, value in _blocks(text):
+        if indent == 0:
+            section = key
+        elif section == 'sdks' and indent == 2:
+            sdks[key] = value
+        elif section == 'packages':
+            if indent == 2:
+                package = key
+                packages[package] = ['', '', '']
+            elif indent == 4 and package and key in ('dependency', 'source', 'version'):
+                packages[package][('dependency', 'source', 'version').index(key)] = value
+    return {'packages': packages, 'sdks': sdks}
+
+
+def load_dependencies(root=APP_ROOT):
+    """Join the declared dependencies with the versions pub resolved for them
+
+    Returns the pubspec metadata, the SDK constraints from the lockfile, a
+    ``direct`` list of ``{'name', 'dev', 'constraint', 'resolved', 'source'}``
+    in pubspec order and the ``transitive`` packages as ``{name: version}``.
+    """
+    pubspec = report.parse_file_cached('pubspec', PUBSPEC_VERSION, os.path.join(root, PUBSPEC_FILE), parse_pubspec)
+    lock = report.parse_file_cached('pubspec', PUBSPEC_VERSION, os.path.join(root, LOCK_FILE), parse_lockfile)
+    packages = lock['packages']
+
+    direct = []
+    for section in DEPENDENCY_SECTIONS:
+        for name, constraint in pubspec[section].items():
+            _, source, version = packages.get(name, ('', '', ''))
+            direct.append({
+                'name': name,
+                'dev': section == 'dev_dependencies',
+                'constraint': constraint or 'any',
+                'resolved': version if source != 'sdk' else None,
+                'source': source or 'unresolved',
+            })
+    transitive = {
+        name: version for name, (dependency, _, version) in sorted(packages.items())
+        if dependency == 'transitive'
+    }
+    return {
+        'name': pubspec['name'],
+        'version': pubspec['version'],
+        'sdk': pubspec['sdk'],
+        'sdks': lock['sdks'],
+        'direct': direct,
+        'transitive': transitive,
+    }
@@ -0,0 +1,260 @@
+"""Derive the Firestore schema sections from the Flutter sources.
+
+Three kinds of file are parsed:
+
+* ``lib/models/*.dart``: each model's ``toMap()`` keys, typed from the
+  model's ``final`` fields, plus the enums stored by name;
+* ``lib/repositories`` and ``lib/services``: which collections each model is
+  read from, via ``Model.fromMap`` and ``collection('...')`` / ``xRef()``;
+* ``firestore.rules``: every ``match`` path with its ``allow`` statements.
+
+Each file's parse result is cached in memory and in the report cache under
+the hash of its content, so regenerating a report only re-parses files that
+changed. Files read are recorded as section dependencies for incremental
+builds.
+"""
+import os
+import re
+
+import export_report_to_word as report
+from report_sources import APP_ROOT, mask_source, match_braces, scan_symbols
+
+# Bump whenever the parsers or their output format change
+SCHEMA_VERSION = 2
+
+MODELS_DIR = 'lib/models'
+DATA_ACCESS_DIRS = ('lib/repositories', 'lib/services')
+RULES_FILE = 'firestore.rules'
+
+# Dart field types as Firestore value types
+FIRESTORE_TYPES = {
+    'String': 'string',
+    'int': 'number',
+    'double': 'number',
+    'num': 'number',
+    'bool': 'boolean',
+    'DateTime': 'timestamp',
+    'Timestamp': 'timestamp',
+    'GeoPoint': 'geopoint',
+}
+
+_FIELD = re.compile(r'^[ \t]+final[ \t]+([\w<>?, ]+?)[ \t]+(\w+)[ \t]*;', re.M)
+_ENUM = re.compile(r'\benum\s+(\w+)\s*\{([^}]*)\}')
+_MAP_ENTRY = re.compile(r"'(\w+)'\s*:\s*([^,\n}]+)")
+_ADD_ALL = re.compile(r'\baddAll\(\s*\{(.*?)\}\s*\)', re.S)
+_BRANCH = re.compile(r'\bif\s*\((.*?)\)\s*\{|\belse\b')
+_FROM_MAP = re.compile(r'\b([A-Z]\w*)\.fromMap\b')
+_REF_METHOD = re.compile(r"\b(\w+)\(\)\s*=>\s*[\w.]*collection\(\s*'([\w-]+)'\s*\)")
+_COLLECTION_CALL = re.compile(r"\bcollection\(\s*'([\w-]+)'\s*\)")
+_REF_CALL = re.compile(r'\b(\w+Ref)\(\)')
+_MATCH = re.compile(r'\bmatch\s+(\S+)\s*\{')
+_ALLOW = re.compile(r'\ballow\s+([\w,\s]+?)\s*:\s*if\s+(.+?);', re.S)
+_FUNCTION = re.compile(r'\bfunction\s+(\w+)\s*\(')
+
+
+def _dart_files(root, directory):
+    directory = os.path.join(root, directory)
+    # New or deleted files change the schema as much as edited ones
+    report.record_dependency(directory, report.directory_digest(directory))
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(directory)
+        for name in names
+        if name.endswith('.dart')
+    )
+
+
+def firestore_type(dart_type, enums):
+    """Map a Dart type annotation to a Firestore value type"""
+    dart_type = dart_type.rstrip('?').strip()
+    base = dart_type.split('<', 1)[0]
+    if base in FIRESTORE_TYPES:
+        return FIRESTORE_TYPES[base]
+    if base in ('List', 'Set', 'Iterable'):
+        return 'array'
+    if base == 'Map':
+        return 'map'
+    if base in enums:
+        return f'string ({"/".join(enums[base])})'
+    return base
+
+
+def parse_model_source(source):
+    """Return ``{'enums': {...}, 'models': {Class: [field, ...]}}`` for a model file
+
+    Each field is ``{'name', 'type', 'condition'}``; ``condition`` is the
+    ``if`` guarding keys added with ``map.addAll({...})``, if any.
+    """
+    lines = source.splitlines()
+    enums = {
+        name: [v.strip() for v in values.split(',') if v.strip()]
+        for name, values in _ENUM.findall(mask_source(source))
+    }
+    symbols = scan_symbols(source)
+    models = {}
+    for symbol, (first, last) in symbols.items():
+        if not symbol.endswith('.toMap'):
+            continue
+        class_name = symbol.split('.')[0]
+        class_first, class_last = symbols[class_name]
+        class_text = '\n'.join(lines[class_first - 1:class_last])
+        field_types = {name: dart_type for dart_type, name in _FIELD.findall(class_text)}
+        body = '\n'.join(lines[first - 1:last])
+
+        conditional = {}
+        for block in _ADD_ALL.finditer(body):
+            branches = list(_BRANCH.finditer(body, 0, block.start()))
+            if branches:
+                last_branch = branches[-1]
+                condition = last_branch.group(1) or 'otherwise'
+            else:
+                condition = None
+            for key, _ in _MAP_ENTRY.findall(block.group(1)):
+                conditional[key] = condition
+
+        fields, seen = [], set()
+        for key, expression in _MAP_ENTRY.findall(body):
+            if key in seen:
+                continue
+            seen.add(key)
+            if 'Timestamp' in expression:
+                value_type = 'timestamp'
+            else:
+                value_type = next(
+                    (firestore_type(field_types[name], enums)
+                     for name in re.findall(r'[A-Za-z_]\w*', expression) if name in field_types),
+                    'unknown',
+                )
+            fields.append({'name': key, 'type': value_type, 'condition': conditional.get(key)})
+        models[class_name] = fields
+    return {'enums': enums, 'models': models}
+
+
+def parse_data_access_source(source):
+    """Return the collection reference helpers, collections and models used by a file"""
+    masked = mask_source(source)
+    return {
+        'ref_methods': dict(_REF_METHOD.findall(source)),
+        'collections': sorted(set(_COLLECTION_CALL.findall(source))),
+        'ref_calls': sorted(set(_REF_CALL.findall(masked))),
+        'models': sorted(set(_FROM_MAP.findall(masked))),
+    }
+
+
+def parse_rules_source(source):
+    """Return the helper functions and every ``match`` path with its ``allow`` rules"""
+    masked = mask_source(source)
+    pairs = match_braces(masked)
+    blocks = [(m.start(), m.end() - 1, pairs.get(m.end() - 1, len(source)), m.group(1))
+              for m in _MATCH.finditer(masked)]
+
+    matches = []
+    for start, open_brace, close, path in blocks:
+        parents = [b for b in blocks if b[1] < start and close <= b[2]]
+        full_path = ''.join(b[3] for b in parents) + path
+        children = [(b[0], b[2]) for b in blocks if open_brace < b[0] and b[2] <= close]
+        own = list(masked[open_brace + 1:close])
+        for child_start, child_close in children:
+            for i in range(child_start - open_brace - 1, child_close - open_brace):
+                own[i] = ' '
+        own = ''.join(own)
+        rules = []
+        for allow in _ALLOW.finditer(own):
+            offset = open_brace + 1
+            condition = source[offset + allow.start(2):offset + allow.end(2)]
+            rules.append({
+                'operations': [op.strip() for op in allow.group(1).split(',') if op.strip()],
+                'condition': ' '.join(condition.split()),
+            })
+        matches.append({'path': full_path, 'rules': rules})
+    return {'functions': _FUNCTION.findall(masked), 'matches': matches}
+
+
+def load_schema(root=APP_ROOT):
+    """Assemble the Firestore schema from the models, data access code and rules"""
+    enums, models = {}, {}
+    for path in _dart_files(root, MODELS_DIR):
+        parsed = report.parse_file_cached('schema', SCHEMA_VERSION, path, parse_model_source)
+        enums.update(parsed['enums'])
+        models.update(parsed['models'])
+
+    ref_methods, usages = {}, []
+    for directory in DATA_ACCESS_DIRS:
+        for path in _dart_files(root, directory):
+            parsed = report.parse_file_cached('schema', SCHEMA_VERSION, path, parse_data_access_source)
+            ref_methods.update(parsed['ref_methods'])
+            usages.append(parsed)
+
+    model_collections = {}
+    for usage in usages:
+        collections = set(usage['collections'])
+        collections.update(ref_methods[call] for call in usage['ref_calls'] if call in ref_methods)
+        for model in usage['models']:
+            if model in models:
+                model_collections.setdefault(model, set()).update(collections)
+
+    rules_path = os.path.join(root, RULES_FILE)
+    rules = report.parse_file_cached('schema', SCHEMA_VERSION, rules_path, parse_rules_source)
+    with open(rules_path, encoding='utf-8') as f:
+        rules_text = f.read().rstrip()
+
+    collections = []
+    seen = set()
+    for match in rules['matches']:
+        segments = [s for s in match['path'].split('/') if s]
+        # Skip the '/databases/{database}/documents' wrapper
+        if len(segments) < 2 or segments[-1][:1] != '{' or segments[-2].startswith('{'):
+            continue
+        name = segments[-2]
+        seen.add(name)
+        collections.append({
+            'name': name,
+            'doc_id': segments[-1],
+            'models': sorted(m for m, cs in model_collections.items() if name in cs),
+            'rules': match['rules'],
+        })
+    for name in sorted({c for cs in model_collections.values() for c in cs} - seen):
+        collections.append({
+            'name': name,
+            'doc_id': '{id}',
+            'models': sorted(m for m, cs in model_collections.items() if name in cs),
+            'rules': [],
+        })
+
+    return {
+        'collections': collections,
+        'models': models,
+        'model_collections': {m: sorted(cs) for m, cs in model_collections.items()},
+        'enums': enums,
+        'rules_functions': rules['functions'],
+        'rules_text': rules_text,
+    }
+
+
+def schema_tree(schema):
+    """Render the collections and their stored fields as a text tree"""
+    lines = ['firestore']
+    collections = schema['collections']
+    for i, collection in enumerate(collections):
+        last_collection = i == len(collections) - 1
+        branch, trunk = ('└── ', '    ') if last_collection else ('├── ', '│   ')
+        lines.append(f'{branch}{collection["name"]}/')
+        models = ', '.join(collection['models']) or 'no model'
+        lines.append(f'{trunk}└── {collection["doc_id"]}  ({models})')
+        fields = []
+        for model in collection['models']:
+            for field in schema['models'][model]:
+                if field['name'] not in {f['name'] for f in fields}:
+                    fields.append(field)
+        for j, field in enumerate(fields):
+            twig = '└── ' if j == len(fields) - 1 else '├── '
+            if field['condition'] == 'otherwise':
+                note = '  [otherwise]'
+            else:
+                note = f'  [if {field["condition"]}]' if field['condition'] else ''
+            lines.append(f'{trunk}    {twig}{field["name"]}: {field["type"]}{note}')
+        if not last_collection:
+            lines.append('│')
+    return '\n'.join(lines)
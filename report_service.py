@@ -0,0 +1,320 @@
+"""Serve report renders over HTTP from a warm, bounded process pool.
+
+A small asyncio HTTP/1.1 server (standard library only) for backends that
+export reports on demand::
+
+    python export_report_to_word.py --serve 8750 --jobs 4 --max-queue 8
+
+    POST /render   JSON body of report config keys, plus optional "format"
+                   ("docx" or "pdf"); answers with the file's bytes
+    GET  /health   JSON with the pool size and the renders in flight
+
+Workers are started and warmed up (python-docx imported, the base template
+built) before the server accepts connections, and stay up, so the
+template, highlighted snippets, Dart symbol index and other in-memory
+caches are shared by every request a worker serves. At most ``workers``
+renders run at once and ``max_queue`` more wait for a worker; beyond that
+requests are refused straight away with ``429 Too Many Requests`` and a
+``Retry-After`` header rather than piling up. Finished files are written
+back in chunks, waiting for the client to drain each one.
+
+Configs are validated before they are queued (``400`` on an error,
+including a variant the spec does not declare). Config keys naming files
+on the server (``report.PATH_KEYS``: the spec, the exports and the images
+directory) are refused unless the service has a data root (``--data-root``),
+and must then resolve inside it; relative paths are taken from the root.
+The exports' own image references are only ever resolved inside
+``images_dir`` (see report_images.py), so a render reads nothing outside
+the data root. A render that fails answers ``500`` with the error, and if a worker process
+dies the pool is replaced and the request answered ``503``. Each
+connection carries one request. Renders are answered with a strong
+``ETag`` (the file's SHA-256); with ``"reproducible": true`` it is stable,
+so a client sending it back in ``If-None-Match`` gets ``304 Not Modified``
+instead of the file again. The server can be driven from tests with
+any local HTTP client, e.g. ``http.client`` against ``127.0.0.1``.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import export_report_to_word as report
+from report_batch import init_worker
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8750
+
+# Request bodies are small JSON configs
+MAX_BODY = 1 << 20
+HEADER_TIMEOUT = 30
+CHUNK_SIZE = 1 << 16
+RETRY_AFTER = 1
+
+CONTENT_TYPES = {
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'pdf': 'application/pdf',
+}
+
+REASONS = {
+    200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    408: 'Request Timeout', 413: 'Payload Too Large', 429: 'Too Many Requests',
+    500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+# Request keys that choose how to render rather than what goes in the report
+JOB_KEYS = ('format',)
+
+
+class Saturated(Exception):
+    """Every worker is busy and the queue is full"""
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def render_job(config, output_format, incremental):
+    """Render one report in a worker and return its bytes"""
+    return report.render_bytes(config, incremental=incremental, output_format=output_format)
+
+
+def _ready():
+    return os.getpid()
+
+
+class ReportService:
+    """A warm process pool that admits at most ``workers + max_queue`` renders at a time"""
+
+    def __init__(self, workers=None, max_queue=None, incremental=False, data_root=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers if max_queue is None else max_queue
+        self.incremental = incremental
+        self.data_root = data_root
+        self.in_flight = 0
+        self.rendered = 0
+        self.refused = 0
+        self._pool = None
+
+    @property
+    def capacity(self):
+        return self.workers + self.max_queue
+
+    async def start(self):
+        """Start the workers and wait until each one has warmed up"""
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _ready) for _ in range(self.workers)))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def render(self, config, output_format='docx'):
+        """Render a validated config on the pool; raises Saturated when full"""
+        if self.in_flight >= self.capacity:
+            self.refused += 1
+            raise Saturated()
+        self.in_flight += 1
+        pool = self._pool
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(
+                pool, render_job, config, output_format, self.incremental)
+        except BrokenProcessPool:
+            # A worker died; replace the pool once for everyone waiting on it
+            if self._pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker)
+            raise
+        finally:
+            self.in_flight -= 1
+        self.rendered += 1
+        return data
+
+    def health(self):
+        return {
+            'workers': self.workers,
+            'capacity': self.capacity,
+            'in_flight': self.in_flight,
+            'queued': max(0, self.in_flight - self.workers),
+            'rendered': self.rendered,
+            'refused': self.refused,
+        }
+
+
+async def read_request(reader):
+    """Return ``(method, path, headers, body)`` for one HTTP/1.1 request"""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), HEADER_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HttpError(408, 'timed out reading the request') from None
+    except asyncio.LimitOverrunError:
+        raise HttpError(413, 'request headers too large') from None
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, path, _ = lines[0].split(' ', 2)
+    except ValueError:
+        raise HttpError(400, 'malformed request line') from None
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise HttpError(400, 'chunked request bodies are not supported; send Content-Length')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(400, 'invalid Content-Length') from None
+    if length > MAX_BODY:
+        raise HttpError(413, f'request body over {MAX_BODY} bytes')
+    body = await asyncio.wait_for(reader.readexactly(length), HEADER_TIMEOUT) if length else b''
+    return method, path.split('?', 1)[0], headers, body
+
+
+async def send(writer, status, body=b'', content_type='application/json', headers=None):
+    """Write a response, ``body`` in chunks as the client drains them"""
+    lines = [f'HTTP/1.1 {status} {REASONS.get(status, "")}', f'Content-Type: {content_type}',
+             f'Content-Length: {len(body)}', 'Connection: close']
+    lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    view = memoryview(body)
+    for start in range(0, len(view), CHUNK_SIZE):
+        writer.write(view[start:start + CHUNK_SIZE])
+        await writer.drain()
+    await writer.drain()
+
+
+def _json(data):
+    return json.dumps(data).encode('utf-8')
+
+
+def resolve_paths(config, data_root=None):
+    """Resolve a request config's file paths inside ``data_root``; raise HttpError for any outside it"""
+    for key in report.PATH_KEYS:
+        value = config.get(key)
+        if value is None:
+            continue
+        if data_root is None:
+            raise HttpError(400, f'config key "{key}" names a server file; this service reads none')
+        if not isinstance(value, str):
+            raise HttpError(400, f'Report config "{key}" must be a path')
+        root = os.path.realpath(data_root)
+        path = os.path.realpath(os.path.join(root, value))
+        if os.path.commonpath((root, path)) != root:
+            raise HttpError(400, f'config key "{key}" must name a path inside the data root')
+        config[key] = path
+
+
+def parse_job(body, data_root=None):
+    """Return ``(config, output_format)`` from a render request body, validating the config
+
+    File paths in the config are resolved by ``resolve_paths``.
+    """
+    try:
+        job = json.loads(body or b'{}')
+    except ValueError as e:
+        raise HttpError(400, f'invalid JSON: {e}') from None
+    if not isinstance(job, dict):
+        raise HttpError(400, 'request body must be a JSON object')
+    config = {key: value for key, value in job.items() if key not in JOB_KEYS}
+    resolve_paths(config, data_root)
+    try:
+        output_format = report.resolve_output_format(None, job.get('format') or 'docx')
+        resolved = report.resolve_config(config)
+        report.check_variant(resolved, resolved['variant'] or report.DEFAULT_VARIANT)
+    except (ValueError, OSError) as e:
+        raise HttpError(400, str(e)) from None
+    return config, output_format
+
+
+async def handle(service, reader, writer, log=None):
+    """Answer one connection"""
+    started = time.perf_counter()
+    method = path = '-'
+    status, size = 500, 0
+    try:
+        try:
+            method, path, headers, body = await read_request(reader)
+            if path == '/health':
+                if method != 'GET':
+                    raise HttpError(405, 'use GET', {'Allow': 'GET'})
+                payload = _json(service.health())
+                status, size = 200, len(payload)
+                await send(writer, 200, payload)
+            elif path == '/render':
+                if method != 'POST':
+                    raise HttpError(405, 'use POST', {'Allow': 'POST'})
+                config, output_format = parse_job(body, service.data_root)
+                try:
+                    data = await service.render(config, output_format)
+                except Saturated:
+                    raise HttpError(429, 'all workers are busy and the queue is full',
+                                    {'Retry-After': str(RETRY_AFTER)}) from None
+                except BrokenProcessPool:
+                    raise HttpError(503, 'a worker process died; retry the request',
+                                    {'Retry-After': str(RETRY_AFTER)}) from None
+                except Exception as e:
+                    raise HttpError(500, f'{type(e).__name__}: {e}') from None
+                etag = f'"{hashlib.sha256(data).hexdigest()}"'
+                if etag in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+                    status = 304
+                    await send(writer, 304, content_type=CONTENT_TYPES[output_format], headers={'ETag': etag})
+                else:
+                    status, size = 200, len(data)
+                    filename = f'{os.path.splitext(report.DEFAULT_OUTPUT)[0]}.{output_format}'
+                    await send(writer, 200, data, CONTENT_TYPES[output_format],
+                               {'Content-Disposition': f'attachment; filename="{filename}"', 'ETag': etag})
+            else:
+                raise HttpError(404, f'no such endpoint: {path}')
+        except HttpError as e:
+            status = e.status
+            payload = _json({'error': str(e)})
+            size = len(payload)
+            await send(writer, e.status, payload, headers=e.headers)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+        if log is not None:
+            print(f'{method} {path} {status} {size} {time.perf_counter() - started:.3f}s', file=log, flush=True)
+
+
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, log=None):
+    """Warm the service's workers, then start accepting connections; returns the asyncio server"""
+    await service.start()
+    return await asyncio.start_server(lambda r, w: handle(service, r, w, log), host, port)
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, max_queue=None, incremental=False,
+                data_root=None, log=sys.stderr):
+    service = ReportService(workers, max_queue, incremental, data_root)
+    try:
+        server = await start_server(service, host, port, log)
+        address = server.sockets[0].getsockname()
+        print(f'Serving reports on http://{address[0]}:{address[1]} with {service.workers} workers '
+              f'(queue {service.max_queue})', file=log, flush=True)
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(port=DEFAULT_PORT, host=DEFAULT_HOST, workers=None, max_queue=None, incremental=False, data_root=None):
+    """Run the service until interrupted; return the exit code"""
+    try:
+        asyncio.run(serve(host, port, workers, max_queue, incremental, data_root))
+    except KeyboardInterrupt:
+        pass
+    return 0
@@ -0,0 +1,347 @@
+"""Resolve report code snippets from the Flutter sources by symbol.
+
+Snippets are referenced as ``<path relative to petpal_app>::<symbol>``, e.g.
+``lib/services/storage_service.dart::StorageService`` for a whole class or
+``lib/blocs/pet/pet_bloc.dart::PetBloc._onPetCreated`` for a member.
+Unnamed constructors are ``Class.new``.
+
+``SymbolIndex`` scans every ``.dart`` file under ``lib/`` once, recording the
+line span of each top-level declaration and class member, and persists that
+index in the report cache with each file's mtime, size and content hash.
+Later runs only re-parse files whose hash changed, and resolving a snippet
+is a dictionary lookup plus reading one file.
+"""
+import bisect
+import json
+import os
+import re
+import textwrap
+
+import export_report_to_word as report
+
+# Bump whenever the scanner's output format or parsing rules change
+INDEX_VERSION = 1
+
+APP_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'petpal_app')
+SOURCE_DIR = 'lib'
+
+_TYPE_DECL = re.compile(r'\b(class|mixin|enum|extension)\s+(\w+)')
+_TYPEDEF = re.compile(r'\btypedef\s+(\w+)')
+_ANNOTATION = re.compile(r'@\w+(?:\.\w+)*(?:\s*\([^()]*\))?')
+_OPERATOR = re.compile(r'\boperator\s*([^\s(]+)\s*$')
+_ACCESSOR = re.compile(r'\b(?:get|set)\s+(\w+)\s*$')
+_CALLABLE = re.compile(r'([\w$]+(?:\.[\w$]+)?)\s*$')
+
+
+def mask_source(source):
+    """Blank out comments and string literals, keeping offsets and newlines
+
+    Braces inside strings and comments then no longer confuse the block
+    matcher. String interpolation (``${...}``) is blanked along with its string.
+    """
+    out = list(source)
+    i, n = 0, len(source)
+
+    def blank(start, end):
+        for k in range(start, end):
+            if out[k] != '\n':
+                out[k] = ' '
+
+    while i < n:
+        c = source[i]
+        if source.startswith('//', i):
+            end = source.find('\n', i)
+            end = n if end == -1 else end
+            blank(i, end)
+            i = end
+        elif source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end == -1 else end + 2
+            blank(i, end)
+            i = end
+        elif c in '\'"':
+            raw = i > 0 and source[i - 1] == 'r' and not (i > 1 and (source[i - 2].isalnum() or source[i - 2] == '_'))
+            quote = source[i:i + 3] if source.startswith(c * 3, i) else c
+            end = _string_end(source, i + len(quote), quote, raw)
+            blank(i, end)
+            i = end
+        else:
+            i += 1
+    return ''.join(out)
+
+
+def _string_end(source, i, quote, raw):
+    """Return the offset just past the literal whose body starts at ``i``"""
+    n = len(source)
+    while i < n:
+        if not raw and source[i] == '\\':
+            i += 2
+        elif source.startswith(quote, i):
+            return i + len(quote)
+        elif not raw and source.startswith('${', i):
+            depth, i = 1, i + 2
+            while i < n and depth:
+                if source[i] in '\'"':
+                    inner = source[i:i + 3] if source.startswith(source[i] * 3, i) else source[i]
+                    i = _string_end(source, i + len(inner), inner, False)
+                    continue
+                depth += {'{': 1, '}': -1}.get(source[i], 0)
+                i += 1
+        elif len(quote) == 1 and source[i] == '\n':
+            return i
+        else:
+            i += 1
+    return n
+
+
+def match_braces(masked):
+    """Map the offset of every '{' to the offset of its matching '}'"""
+    pairs, stack = {}, []
+    for i, c in enumerate(masked):
+        if c == '{':
+            stack.append(i)
+        elif c == '}' and stack:
+            pairs[stack.pop()] = i
+    return pairs
+
+
+def _statements(masked, pairs, start, end):
+    """Yield ``(start, body_open, end)`` for each declaration in ``masked[start:end]``
+
+    ``body_open`` is the offset of the block body's '{', or None for
+    declarations ending in ';' (fields, expression bodies, typedefs).
+    """
+    pos = start
+    while pos < end:
+        while pos < end and masked[pos].isspace():
+            pos += 1
+        if pos >= end:
+            return
+        stmt_start, parens, j = pos, 0, pos
+        while j < end:
+            c = masked[j]
+            if c in '([':
+                parens += 1
+            elif c in ')]':
+                parens -= 1
+            elif c == '{':
+                close = pairs.get(j, end - 1)
+                if parens == 0 and _is_block_header(masked[stmt_start:j]):
+                    yield stmt_start, j, close
+                    j = close + 1
+                    break
+                j = close
+            elif c == ';' and parens == 0:
+                yield stmt_start, None, j
+                j += 1
+                break
+            elif c == '}':
+                # Stray closer, e.g. unbalanced source; resynchronise after it
+                j += 1
+                break
+            j += 1
+        pos = j
+
+
+def _is_block_header(header):
+    """True if '{' after this header opens a declaration body, not a literal"""
+    header = _ANNOTATION.sub(' ', header)
+    if '=>' in header:
+        return False
+    before_params = header.split('(', 1)[0]
+    return '=' not in before_params
+
+
+def _declaration_name(header, has_body=True):
+    """Return ``(kind, name)`` for a declaration header, or None for fields"""
+    header = ' '.join(_ANNOTATION.sub(' ', header).split())
+    # 'final String? Function(String?)? validator;' is a field, not a function
+    if not has_body and '=>' not in header and '(' in header and not header.endswith(')'):
+        if not _TYPEDEF.search(header):
+            return None
+    match = _TYPE_DECL.search(header)
+    if match and '(' not in header[:match.start()]:
+        return match.group(1), match.group(2)
+    match = _TYPEDEF.search(header)
+    if match:
+        return 'typedef', match.group(1)
+    if '(' not in header:
+        match = _ACCESSOR.search(header.split('=>', 1)[0])
+        return ('accessor', match.group(1)) if match else None
+    before_params = header.split('(', 1)[0]
+    if '=' in before_params:
+        return None
+    match = _OPERATOR.search(before_params)
+    if match:
+        return 'function', f'operator{match.group(1)}'
+    match = _ACCESSOR.search(before_params)
+    if match:
+        return 'accessor', match.group(1)
+    match = _CALLABLE.search(_strip_type_params(before_params))
+    return ('function', match.group(1)) if match else None
+
+
+def _strip_type_params(text):
+    """Drop a trailing generic parameter list, e.g. 'Stream<T> map<T>' -> 'Stream<T> map'"""
+    text = text.rstrip()
+    if not text.endswith('>'):
+        return text
+    depth = 0
+    for i in range(len(text) - 1, -1, -1):
+        depth += {'>': 1, '<': -1}.get(text[i], 0)
+        if depth == 0:
+            return text[:i]
+    return text
+
+
+def scan_symbols(source):
+    """Return ``{symbol: [first_line, last_line]}`` (1-based, inclusive) for Dart source"""
+    masked = mask_source(source)
+    pairs = match_braces(masked)
+    line_starts = [0] + [i + 1 for i, c in enumerate(source) if c == '\n']
+
+    def line_of(offset):
+        return bisect.bisect_right(line_starts, offset)
+
+    symbols = {}
+    for start, body, end in _statements(masked, pairs, 0, len(masked)):
+        header = masked[start:body if body is not None else end]
+        declared = _declaration_name(header, body is not None)
+        if declared is None:
+            continue
+        kind, name = declared
+        symbols.setdefault(name, [line_of(start), line_of(end)])
+        if kind in ('class', 'mixin', 'extension') and body is not None:
+            for m_start, m_body, m_end in _statements(masked, pairs, body + 1, end):
+                member = _declaration_name(masked[m_start:m_body if m_body is not None else m_end], m_body is not None)
+                if member is None:
+                    continue
+                member_name = 'new' if member[1] == name else member[1].split('.')[-1]
+                symbols.setdefault(f'{name}.{member_name}', [line_of(m_start), line_of(m_end)])
+    return symbols
+
+
+class SymbolIndex:
+    """Persistent, incrementally refreshed index of Dart symbols under an app root"""
+
+    def __init__(self, root=APP_ROOT):
+        self.root = os.path.abspath(root)
+        self._key = report.content_hash(str(INDEX_VERSION), self.root)
+        self.files = {}
+        self.reparsed = 0
+        cached = report.read_cache('symbols', self._key, '.json')
+        if cached is not None:
+            try:
+                data = json.loads(cached)
+                if data.get('version') == INDEX_VERSION:
+                    self.files = data['files']
+            except (ValueError, KeyError, TypeError):
+                self.files = {}
+        self.refresh()
+
+    def refresh(self):
+        """Bring the index up to date, re-parsing only files whose content changed"""
+        seen, changed = set(), False
+        source_root = os.path.join(self.root, SOURCE_DIR)
+        for dirpath, dirnames, filenames in os.walk(source_root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith('.dart'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+                seen.add(rel)
+                stat = os.stat(path)
+                entry = self.files.get(rel)
+                if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                digest = report.content_hash(data)
+                if entry is None or entry['sha256'] != digest:
+                    symbols = scan_symbols(data.decode('utf-8', errors='replace'))
+                    self.reparsed += 1
+                else:
+                    symbols = entry['symbols']
+                self.files[rel] = {
+                    'mtime_ns': stat.st_mtime_ns,
+                    'size': stat.st_size,
+                    'sha256': digest,
+                    'symbols': symbols,
+                }
+                changed = True
+        for rel in set(self.files) - seen:
+            del self.files[rel]
+            changed = True
+        if changed:
+            payload = {'version': INDEX_VERSION, 'files': self.files}
+            report.write_cache('symbols', self._key, json.dumps(payload, sort_keys=True).encode('utf-8'), '.json')
+
+    def span(self, ref):
+        """Return ``(path, first_line, last_line)`` for a ``path::Symbol`` reference"""
+        path, sep, symbol = ref.partition('::')
+        if not sep:
+            raise ValueError(f'snippet reference must look like "lib/file.dart::Symbol", got {ref!r}')
+        full_path = os.path.join(self.root, path)
+        entry = self.files.get(path)
+        if entry is not None:
+            # A long-lived index (warm batch/service workers) may predate an edit
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                stat = None
+            if stat is None or entry['mtime_ns'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                self.refresh()
+                entry = self.files.get(path)
+        if entry is None:
+            raise LookupError(f'{path}: no such Dart file under {self.root}')
+        try:
+            first, last = entry['symbols'][symbol]
+        except KeyError:
+            raise LookupError(f'{path}: no symbol named {symbol!r}') from None
+        report.record_dependency(full_path, entry['sha256'])
+        return full_path, first, last
+
+    def resolve(self, ref, start=None, max_lines=None):
+        """Return the dedented source text of a symbol
+
+        ``start`` begins the excerpt at the first line containing that text,
+        and ``max_lines`` truncates it with a trailing ``// ...`` line.
+        """
+        path, first, last = self.span(ref)
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()[first - 1:last]
+        if start is not None:
+            try:
+                lines = lines[next(i for i, line in enumerate(lines) if start in line):]
+            except StopIteration:
+                raise LookupError(f'{ref}: no line containing {start!r}') from None
+        truncated = max_lines is not None and len(lines) > max_lines
+        if truncated:
+            lines = lines[:max_lines]
+        text = textwrap.dedent('\n'.join(lines)).rstrip()
+        if truncated:
+            indent = re.match(r'\s*', text.splitlines()[-1]).group()
+            text += f'\n{indent}// ...'
+        return text
+
+
+_index = None
+
+
+def source_index():
+    """Return the process-wide index for the PetPal app
+
+    The index is scanned once per process; ``SymbolIndex.span`` re-checks a
+    file's mtime and size before each lookup and refreshes the index if it
+    has changed since.
+    """
+    global _index
+    if _index is None:
+        _index = SymbolIndex()
+    return _index
+
+
+def resolve_snippet(ref, start=None, max_lines=None):
+    """Return the source text for a ``path::Symbol`` snippet reference"""
+    return source_index().resolve(ref, start=start, max_lines=max_lines)
@@ -0,0 +1,279 @@
+"""Compile the report content spec into a cached list of typed nodes.
+
+The static report content lives in a spec file (``report_spec.json``; YAML
+works too when PyYAML is installed) listing the sections in document order::
+
+    {"version": 1, "sections": [
+        {"name": "toc", "builtin": "toc"},
+        {"name": "executive_summary", "blocks": [
+            {"heading": "1. Executive Summary"},
+            {"paragraph": "PetPal is ..."},
+            {"bullets": ["First point", "Second point"], "indent": 0.25},
+            {"snippet": "lib/main.dart::main", "max_lines": 30},
+            {"page_break": true}]}]}
+
+A section with a ``variants`` list is only in those variants of the report
+(see report_variants.py); the others are in every variant. Variants other
+than the technical report are declared with the cover text they change::
+
+    "variants": {"owner": {"subtitle": "Pet Owner Guide"}}
+
+A ``builtin`` section is one of the data-driven sections written in Python
+(``report.BUILTIN_SECTIONS``). A ``blocks`` section is compiled into plain
+tuples, which the hub's ``render_nodes()`` replays against any backend:
+
+    ('heading', text, level, template)
+    ('paragraph', text, style, indent_emu, template)
+    ('code', code, language)
+    ('snippet', ref, language, start, max_lines)
+    ('page_break',)
+
+``template`` is True when the text holds ``{config_key}`` fields, which are
+filled in with ``str.format_map(config)`` at render time. Block types:
+
+    heading    text; "level" (default 1)
+    paragraph  text; "style", "indent" (inches)
+    bullets    list of List Bullet paragraphs; "indent" (inches)
+    numbered   list of paragraphs numbered "1. ", "2. ", ...
+    code       code as a string or list of lines; "language"
+    snippet    app source reference (see report_sources.py); "language",
+               "start", "max_lines"
+    page_break true
+
+The compiled spec is marshalled under the hash of the spec bytes, in memory
+and in the ``specs`` cache, so rendering again, in another format or for
+another config that uses the same spec never parses or validates it again.
+"""
+import json
+import marshal
+import os
+import string
+
+import export_report_to_word as report
+
+# Bump whenever compile_spec() changes what it produces
+SPEC_VERSION = 2
+
+BLOCK_TYPES = ('heading', 'paragraph', 'bullets', 'numbered', 'code', 'snippet', 'page_break')
+
+EMU_PER_INCH = 914400
+
+# Config keys a variant may override; they only change the cover and
+# document properties, so every variant can share one build of its sections
+VARIANT_KEYS = ('title', 'subtitle')
+
+# Compiled specs by cache key, and the section list built from each
+_compiled = {}
+_sections = {}
+
+
+def _fields(text, where):
+    """Return True if ``text`` is a template, checking the config keys it names"""
+    if '{' not in text and '}' not in text:
+        return False
+    try:
+        fields = [field for _, field, _, _ in string.Formatter().parse(text) if field is not None]
+    except ValueError as e:
+        raise ValueError(f'{where}: bad template {text!r}: {e}') from None
+    for field in fields:
+        key = field.split('.')[0].split('[')[0]
+        if key not in report.DEFAULT_CONFIG:
+            raise ValueError(f'{where}: unknown config key {key!r} in {text!r}')
+    return True
+
+
+def _text(block, key, where):
+    value = block[key]
+    if not isinstance(value, str):
+        raise ValueError(f'{where}: "{key}" must be a string')
+    return value
+
+
+def _lines(block, key, where):
+    value = block[key]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f'{where}: "{key}" must be a list of strings')
+    return value
+
+
+def _indent(block, where):
+    value = block.get('indent')
+    if value is None:
+        return None
+    if not isinstance(value, (int, float)) or isinstance(value, bool) or value < 0:
+        raise ValueError(f'{where}: "indent" must be a non-negative number of inches')
+    return round(value * EMU_PER_INCH)
+
+
+def compile_block(block, where):
+    """Compile one block into a list of nodes"""
+    if not isinstance(block, dict):
+        raise ValueError(f'{where}: block must be an object')
+    kinds = [kind for kind in BLOCK_TYPES if kind in block]
+    if len(kinds) != 1:
+        raise ValueError(f'{where}: block must have exactly one of {", ".join(BLOCK_TYPES)}')
+    kind = kinds[0]
+
+    if kind == 'heading':
+        text = _text(block, kind, where)
+        level = block.get('level', 1)
+        if not isinstance(level, int) or isinstance(level, bool) or not 0 <= level <= 9:
+            raise ValueError(f'{where}: "level" must be an integer from 0 to 9')
+        return [('heading', text, level, _fields(text, where))]
+    if kind == 'paragraph':
+        text = _text(block, kind, where)
+        style = block.get('style')
+        if style is not None and not isinstance(style, str):
+            raise ValueError(f'{where}: "style" must be a string')
+        return [('paragraph', text, style, _indent(block, where), _fields(text, where))]
+    if kind == 'bullets':
+        indent = _indent(block, where)
+        return [('paragraph', text, 'List Bullet', indent, _fields(text, where))
+                for text in _lines(block, kind, where)]
+    if kind == 'numbered':
+        return [('paragraph', f'{i}. {text}', None, None, _fields(text, where))
+                for i, text in enumerate(_lines(block, kind, where), 1)]
+    if kind == 'code':
+        code = block[kind]
+        code = code if isinstance(code, str) else '\n'.join(_lines(block, kind, where))
+        return [('code', code, block.get('language', ''))]
+    if kind == 'snippet':
+        start, max_lines = block.get('start'), block.get('max_lines')
+        if max_lines is not None and (not isinstance(max_lines, int) or isinstance(max_lines, bool) or max_lines < 1):
+            raise ValueError(f'{where}: "max_lines" must be a positive integer')
+        return [('snippet', _text(block, kind, where), block.get('language', 'dart'), start, max_lines)]
+    if block[kind] is not True:
+        raise ValueError(f'{where}: "page_break" must be true')
+    return [('page_break',)]
+
+
+def compile_variants(spec):
+    """Compile the spec's variant declarations into ``{name: overrides}``"""
+    declared = spec.get('variants', {})
+    if not isinstance(declared, dict):
+        raise ValueError('"variants" must be an object mapping variant names to config overrides')
+    variants = {report.DEFAULT_VARIANT: {}}
+    for name, overrides in declared.items():
+        if not isinstance(overrides, dict):
+            raise ValueError(f'variant {name!r}: overrides must be an object')
+        for key, value in overrides.items():
+            if key not in VARIANT_KEYS:
+                raise ValueError(f'variant {name!r}: can only override {", ".join(VARIANT_KEYS)}, not {key!r}')
+            if not isinstance(value, str):
+                raise ValueError(f'variant {name!r}: "{key}" must be a string')
+        variants[name] = dict(overrides)
+    return variants
+
+
+def _section_variants(section, variants, name):
+    listed = section.get('variants')
+    if listed is None:
+        return None
+    if not isinstance(listed, list) or not listed or not all(isinstance(v, str) for v in listed):
+        raise ValueError(f'section {name!r}: "variants" must be a non-empty list of variant names')
+    unknown = sorted(set(listed) - set(variants))
+    if unknown:
+        raise ValueError(f'section {name!r}: undeclared variants {", ".join(unknown)}')
+    return tuple(listed)
+
+
+def compile_spec(spec):
+    """Compile a parsed spec into ``(sections, variants)``
+
+    ``sections`` is a list of ``(name, builtin, nodes, variants)``:
+    ``builtin`` is None for sections described by blocks, ``nodes`` is None
+    for builtin sections, and ``variants`` is None for sections in every
+    variant. ``variants`` maps each variant to its config overrides. Raises
+    ValueError for an invalid spec.
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('sections'), list):
+        raise ValueError('report spec must be an object with a "sections" list')
+    if spec.get('version', 1) != 1:
+        raise ValueError(f'unsupported report spec version {spec.get("version")!r}')
+
+    variants = compile_variants(spec)
+    compiled, names = [], set()
+    for i, section in enumerate(spec['sections']):
+        name = section.get('name') if isinstance(section, dict) else None
+        if not isinstance(name, str) or not name:
+            raise ValueError(f'report spec section {i + 1} needs a "name"')
+        if name in names:
+            raise ValueError(f'report spec section {name!r} appears twice')
+        names.add(name)
+
+        if 'builtin' in section:
+            if section['builtin'] not in report.BUILTIN_SECTIONS:
+                raise ValueError(f'section {name!r}: unknown builtin {section["builtin"]!r}; '
+                                 f'expected one of {", ".join(report.BUILTIN_SECTIONS)}')
+            compiled.append((name, section['builtin'], None, _section_variants(section, variants, name)))
+            continue
+        blocks = section.get('blocks')
+        if not isinstance(blocks, list):
+            raise ValueError(f'section {name!r} needs a "blocks" list or a "builtin"')
+        nodes = []
+        for j, block in enumerate(blocks):
+            nodes.extend(compile_block(block, f'section {name!r} block {j + 1}'))
+        compiled.append((name, None, tuple(nodes), _section_variants(section, variants, name)))
+    return compiled, variants
+
+
+def parse_spec(data, path):
+    """Parse spec bytes as JSON, or as YAML for a .yaml/.yml file"""
+    text = data.decode('utf-8')
+    if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f'{path}: reading a YAML report spec needs PyYAML') from None
+        try:
+            return yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise ValueError(f'{path}: {e}') from None
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f'{path}: {e}') from None
+
+
+def load_spec(path):
+    """Return ``(key, compiled)`` for a spec file, compiling it only on a cache miss"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    key = report.content_hash(str(SPEC_VERSION), str(marshal.version), os.path.splitext(path)[1].lower(), data)
+    if key in _compiled:
+        return key, _compiled[key]
+    cached = report.read_cache('specs', key, '.marshal')
+    compiled = None
+    if cached is not None:
+        try:
+            compiled = marshal.loads(cached)
+        except (EOFError, ValueError, TypeError):
+            compiled = None
+    if compiled is None:
+        try:
+            compiled = compile_spec(parse_spec(data, path))
+        except ValueError as e:
+            raise ValueError(str(e) if str(e).startswith(path) else f'{path}: {e}') from None
+        report.write_cache('specs', key, marshal.dumps(compiled), '.marshal')
+    _compiled[key] = compiled
+    return key, compiled
+
+
+def load_sections(path):
+    """Return the ``[(name, add_section, variants)]`` list a spec file describes
+
+    The list is built once per spec content, so the section callables keep
+    their identity (and their cached fingerprints) across builds.
+    """
+    key, (compiled, _) = load_spec(path)
+    if key not in _sections:
+        _sections[key] = [
+            (name, report.BUILTIN_SECTIONS[builtin] if builtin else report.SpecSection(nodes), variants)
+            for name, builtin, nodes, variants in compiled
+        ]
+    return _sections[key]
+
+
+def load_variants(path):
+    """Return the ``{variant: overrides}`` a spec file declares, the technical report included"""
+    return load_spec(path)[1][1]
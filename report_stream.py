@@ -0,0 +1,361 @@
+"""Streaming OOXML writer for very large PetPal reports.
+
+``StreamingDocument`` serialises WordprocessingML block by block as content
+is added, instead of building an lxml tree that is only serialised on
+``doc.save()``. Peak memory therefore stays flat however many paragraphs,
+code blocks or table rows an appendix contains::
+
+    with StreamingDocument('activity_appendix.docx') as doc:
+        doc.add_heading('Appendix A. Activity Log', level=1)
+        doc.add_bulk_table(rows, header=('Date', 'Pet', 'Type', 'Notes'))
+
+``render_report`` renders the whole report this way for configs with
+``"streaming": true`` (``--stream``). Like ``report_pdf.PdfDocument`` it
+stands in for a python-docx ``Document``: sections call ``add_heading``,
+``add_paragraph``, ``add_page_break`` and ``add_picture`` on it, and the
+shared helpers (``add_code_block``, ``add_bulk_table``, ``add_photo_grid``
+and the table of contents) hand it their content through methods of the
+same name. A paragraph or heading can be styled until the next block is
+added, when it is written.
+
+Every other package part (styles, numbering, settings, theme, core
+properties...) and the base document's own body (the cover page) are copied
+from the base document, by default the styled one ``export_report_to_word``
+builds, so headings, bullets and code blocks look exactly as in the
+python-docx backend. The body is spooled to a temporary file as it is
+written and copied into the zip by ``close()``, which writes the table of
+contents, only known once every heading is in, ahead of the content that
+followed its placeholder. Images go into the zip as they are added.
+"""
+import io
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr
+
+import export_report_to_word as report
+from report_highlight import highlighted_runs
+from report_pdf import Paragraph
+
+DOCUMENT_PART = 'word/document.xml'
+DOCUMENT_RELS_PART = 'word/_rels/document.xml.rels'
+STYLES_PART = 'word/styles.xml'
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+IMAGE_RELATIONSHIP = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+
+# Body XML is held in memory up to this many bytes, then spooled to disk
+SPOOL_SIZE = 1 << 20
+
+# python-docx WD_PARAGRAPH_ALIGNMENT values -> w:jc
+_ALIGNMENTS = {0: 'left', 1: 'center', 2: 'right', 3: 'both'}
+
+
+def style_ids(styles_xml):
+    """Map lowercased style names (e.g. 'list bullet') to style IDs (e.g. 'ListBullet')
+
+    Built-in styles are stored under lowercase names ('heading 1'), so lookups
+    are case-insensitive to match the names python-docx accepts.
+    """
+    ids = {}
+    for style in ElementTree.fromstring(styles_xml).iter(f'{{{W_NS}}}style'):
+        name = style.find(f'{{{W_NS}}}name')
+        if name is not None:
+            ids[name.get(f'{{{W_NS}}}val').lower()] = style.get(f'{{{W_NS}}}styleId')
+    return ids
+
+
+class StreamingDocument:
+    """Write a .docx to a path or binary stream one block at a time
+
+    ``compression_level`` (0-9) is as for ``report.save_document``; with
+    ``date_time`` every zip entry is dated ``date_time``, for reproducible
+    output. Call ``close()`` once every block has been added, or use it as a
+    context manager, which calls ``discard()`` instead if the block raises.
+    """
+
+    backend = 'stream'
+
+    def __init__(self, out, base=None, compression_level=6, date_time=None, max_level=2):
+        base = zipfile.ZipFile(io.BytesIO(base or report.base_template()))
+        self._compression, self._compresslevel = report.zip_options(compression_level)
+        self._date_time = date_time
+        self._path = out if isinstance(out, (str, os.PathLike)) else None
+        self._zip = zipfile.ZipFile(out, 'w', self._compression, compresslevel=self._compresslevel)
+        # Parts that list the images are written on close()
+        held = (DOCUMENT_PART, DOCUMENT_RELS_PART, report.CONTENT_TYPES_MEMBER)
+        for name in base.namelist():
+            if name not in held:
+                self._write_entry(name, base.read(name))
+        self._content_types = base.read(report.CONTENT_TYPES_MEMBER).decode('utf-8')
+        self._rels = base.read(DOCUMENT_RELS_PART).decode('utf-8')
+
+        document_xml = base.read(DOCUMENT_PART).decode('utf-8')
+        sect_start = document_xml.rindex('<w:sectPr')
+        sect_end = document_xml.index('</w:body>')
+        # Anything already in the base body, such as a cover page, comes first
+        self._prologue = document_xml[:sect_start]
+        self._sect_pr = document_xml[sect_start:sect_end]
+        self._styles = style_ids(base.read(STYLES_PART))
+        self._text_width = self._section_text_width()
+
+        self.heading_index = self
+        self.max_level = max_level
+        self.entries = []
+        self._pending = None
+        self._toc = None
+        self._toc_start = None
+        # Body XML before the TOC placeholder, and after it once one is set
+        self._segments = [tempfile.SpooledTemporaryFile(SPOOL_SIZE)]
+        self._images = {}
+        self._new_types = {}
+        self._next_rel = max(map(int, re.findall(r'Id="rId(\d+)"', self._rels)), default=0) + 1
+        self._shape_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def _section_text_width(self):
+        """Usable page width in twips, read from the base document's section"""
+        width = re.search(r'<w:pgSz[^>]*w:w="(\d+)"', self._sect_pr)
+        left = re.search(r'<w:pgMar[^>]*w:left="(\d+)"', self._sect_pr)
+        right = re.search(r'<w:pgMar[^>]*w:right="(\d+)"', self._sect_pr)
+        if not (width and left and right):
+            return 8640
+        return int(width.group(1)) - int(left.group(1)) - int(right.group(1))
+
+    def _style_id(self, style):
+        try:
+            return self._styles[style.lower()]
+        except KeyError:
+            raise KeyError(f"no style with name '{style}'") from None
+
+    def _zip_info(self, name):
+        """Return the name or dated ZipInfo to write ``name`` under"""
+        if self._date_time is None:
+            return name
+        info = report.zip_entry(name, self._date_time)
+        info.compress_type = self._compression
+        # What ZipFile.open() sets for a name; it takes no level for a ZipInfo
+        info._compresslevel = self._compresslevel
+        return info
+
+    def _write_entry(self, name, data):
+        self._zip.writestr(self._zip_info(name), data, self._compression, self._compresslevel)
+
+    def _write(self, xml):
+        self._segments[-1].write(xml.encode('utf-8'))
+
+    def _paragraph(self, text='', style=None, ppr='', rpr='', runs=None):
+        if style and style != 'Normal':
+            ppr = f'<w:pStyle w:val="{self._style_id(style)}"/>{ppr}'
+        ppr = f'<w:pPr>{ppr}</w:pPr>' if ppr else ''
+        if runs is None:
+            runs = report.text_runs(text, rpr)
+        return f'<w:p>{ppr}{runs}</w:p>'
+
+    @staticmethod
+    def _run_properties(run):
+        font = run.font
+        rpr = ''
+        if font.name:
+            rpr += f'<w:rFonts w:ascii={quoteattr(font.name)} w:hAnsi={quoteattr(font.name)}/>'
+        if font.bold is not None:
+            rpr += '<w:b/>' if font.bold else '<w:b w:val="0"/>'
+        if font.italic is not None:
+            rpr += '<w:i/>' if font.italic else '<w:i w:val="0"/>'
+        if font.color.rgb is not None:
+            rpr += f'<w:color w:val="{font.color.rgb}"/>'
+        if font.size is not None:
+            # Lengths are EMU; w:sz is in half-points
+            rpr += f'<w:sz w:val="{font.size // 6350}"/>'
+        return rpr
+
+    def _flush(self):
+        """Write the pending paragraph, now that it can no longer change"""
+        if self._pending is None:
+            return
+        paragraph, bookmark = self._pending
+        self._pending = None
+        if paragraph is self._toc:
+            # close() writes the TOC between this segment and the next
+            self._segments.append(tempfile.SpooledTemporaryFile(SPOOL_SIZE))
+            return
+        fmt = paragraph.paragraph_format
+        ppr = ''
+        spacing = ''.join(f' w:{name}="{length // 635}"' for name, length in
+                          (('before', fmt.space_before), ('after', fmt.space_after)) if length is not None)
+        if spacing:
+            ppr += f'<w:spacing{spacing}/>'
+        if fmt.left_indent is not None:
+            ppr += f'<w:ind w:left="{fmt.left_indent // 635}"/>'
+        if paragraph.alignment is not None:
+            ppr += f'<w:jc w:val="{_ALIGNMENTS.get(int(paragraph.alignment), "left")}"/>'
+        runs = ''.join(report.text_runs(run.text, self._run_properties(run)) for run in paragraph.runs)
+        if bookmark is not None:
+            name, bookmark_id = bookmark
+            runs = (f'<w:bookmarkStart w:id="{bookmark_id}" w:name="{name}"/>{runs}'
+                    f'<w:bookmarkEnd w:id="{bookmark_id}"/>')
+        self._write(self._paragraph(style=paragraph.style, ppr=ppr, runs=runs))
+
+    def _add_image(self, image):
+        """Write an image part once per distinct image; return its relationship ID"""
+        if image.sha1 not in self._images:
+            rel_id = f'rId{self._next_rel}'
+            self._next_rel += 1
+            ext = image.ext.lower()
+            target = f'media/image{len(self._images) + 1}.{ext}'
+            self._write_entry(f'word/{target}', image.blob)
+            self._images[image.sha1] = (rel_id, target)
+            if f'Extension="{ext}"' not in self._content_types.lower():
+                self._new_types[ext] = image.content_type
+        return self._images[image.sha1][0]
+
+    def _drawing(self, image_descriptor, width=None, height=None):
+        """Return a ``w:drawing`` for an image path or stream; ``width``/``height`` are python-docx lengths"""
+        from docx.image.image import Image
+        from docx.oxml.shape import CT_Inline
+        from lxml import etree
+
+        image = Image.from_file(image_descriptor)
+        rel_id = self._add_image(image)
+        cx, cy = image.scaled_dimensions(width, height)
+        self._shape_id += 1
+        inline = CT_Inline.new_pic_inline(self._shape_id, rel_id, image.filename, cx, cy)
+        return f'<w:drawing>{etree.tostring(inline, encoding="unicode")}</w:drawing>'
+
+    # ----- python-docx API -----
+
+    def add_heading(self, text='', level=1):
+        """Add a heading paragraph; level 0 is the document title"""
+        if not 0 <= level <= 9:
+            raise ValueError(f'level must be in range 0-9, got {level}')
+        self._flush()
+        paragraph = Paragraph(text, 'Title' if level == 0 else f'Heading {level}')
+        paragraph.level = level
+        # Bookmarked and listed exactly as HeadingIndex does for the python-docx backend
+        name, bookmark_id = report.HeadingIndex.bookmark_ids(level, text, len(self.entries))
+        self.entries.append((level, text, name))
+        self._pending = paragraph, (name, bookmark_id)
+        return paragraph
+
+    def add_paragraph(self, text='', style=None):
+        """Add a paragraph of plain text"""
+        self._flush()
+        paragraph = Paragraph(text, style)
+        self._pending = paragraph, None
+        return paragraph
+
+    def add_bullet(self, text):
+        """Add a 'List Bullet' paragraph"""
+        return self.add_paragraph(text, 'List Bullet')
+
+    def add_page_break(self):
+        """Add a paragraph holding a page break"""
+        self._flush()
+        self._write('<w:p><w:r><w:br w:type="page"/></w:r></w:p>')
+
+    def add_picture(self, image_descriptor, width=None, height=None):
+        """Add an image in a paragraph of its own"""
+        self._flush()
+        self._write(f'<w:p><w:r>{self._drawing(image_descriptor, width, height)}</w:r></w:p>')
+
+    # ----- shared helpers -----
+
+    def set_placeholder(self, paragraph):
+        """Mark where the table of contents goes (see ``HeadingIndex.set_placeholder``)"""
+        self._toc = paragraph
+        self._toc_start = len(self.entries)
+
+    def add_code_block(self, code, language=''):
+        """Add a shaded, monospaced code block, syntax highlighted if the language is known"""
+        self._flush()
+        runs = highlighted_runs(code, language)
+        self._write(self._paragraph(code, report.CODE_BLOCK_STYLE, runs=runs))
+
+    def add_bulk_table(self, rows, header=None, cols=None, column_styles=None,
+                       style='Light Grid Accent 1', chunk_rows=None):
+        """Add a table from an iterable of rows, writing each row as it is consumed
+
+        Arguments are as for ``export_report_to_word.table_xml()``: the
+        header row repeats on every page and ``chunk_rows`` splits the rows
+        into several tables.
+        """
+        self._flush()
+        for xml in report.table_xml(rows, self._style_id(style), self._text_width, header=header, cols=cols,
+                                    column_styles=column_styles, chunk_rows=chunk_rows):
+            self._write(xml)
+
+    def add_image_grid(self, entries, width, columns):
+        """Add ``(caption, image bytes)`` pairs as a borderless table of centred, captioned images"""
+        self._flush()
+        if not entries:
+            return
+        cell_width = self._text_width // columns
+        grid = f'<w:gridCol w:w="{cell_width}"/>' * columns
+        self._write(f'<w:tbl><w:tblPr><w:tblW w:type="auto" w:w="0"/>{report.TABLE_LOOK}</w:tblPr>'
+                    f'<w:tblGrid>{grid}</w:tblGrid>')
+        caption_style = self._style_id('Caption')
+        cell_open = f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{cell_width}"/></w:tcPr>'
+        for start in range(0, len(entries), columns):
+            row = entries[start:start + columns]
+            cells = ''.join(
+                f'{cell_open}<w:p><w:pPr><w:jc w:val="center"/></w:pPr>'
+                f'<w:r>{self._drawing(io.BytesIO(data), width)}</w:r></w:p>'
+                f'<w:p><w:pPr><w:pStyle w:val="{caption_style}"/><w:jc w:val="center"/></w:pPr>'
+                f'{report.text_runs(caption)}</w:p></w:tc>'
+                for caption, data in row
+            )
+            # Every cell needs a paragraph, including the last row's empty ones
+            cells += f'{cell_open}<w:p/></w:tc>' * (columns - len(row))
+            self._write(f'<w:tr>{cells}</w:tr>')
+        self._write('</w:tbl>')
+
+    def close(self):
+        """Write document.xml, the image relationships and the content types; safe to call more than once"""
+        if self._zip is None:
+            return
+        self._flush()
+        toc = report.toc_xml(self.entries[self._toc_start:], self.max_level) if self._toc is not None else ''
+        with self._zip.open(self._zip_info(DOCUMENT_PART), 'w', force_zip64=True) as stream:
+            stream.write(self._prologue.encode('utf-8'))
+            for i, segment in enumerate(self._segments):
+                if i:
+                    stream.write(toc.encode('utf-8'))
+                segment.seek(0)
+                shutil.copyfileobj(segment, stream)
+                segment.close()
+            stream.write(f'{self._sect_pr}</w:body></w:document>'.encode('utf-8'))
+
+        rels = ''.join(f'<Relationship Id="{rel_id}" Type="{IMAGE_RELATIONSHIP}" Target="{target}"/>'
+                       for rel_id, target in self._images.values())
+        self._write_entry(DOCUMENT_RELS_PART, self._rels.replace('</Relationships>', f'{rels}</Relationships>'))
+        types = ''.join(f'<Default Extension="{ext}" ContentType="{content_type}"/>'
+                        for ext, content_type in self._new_types.items())
+        self._write_entry(report.CONTENT_TYPES_MEMBER, self._content_types.replace('</Types>', f'{types}</Types>'))
+        self._zip.close()
+        self._zip = None
+
+    def discard(self):
+        """Abandon a failed build: drop the spooled body and delete ``out`` if it is a path
+
+        A stream is left holding the package parts written so far, which
+        include no document.xml.
+        """
+        if self._zip is None:
+            return
+        for segment in self._segments:
+            segment.close()
+        self._zip.close()
+        self._zip = None
+        if self._path is not None:
+            os.remove(self._path)
@@ -0,0 +1,221 @@
+"""Optional timing and memory instrumentation for report builds.
+
+The exporter wraps the template, every section, its helpers (code blocks,
+snippets, tables, photo grids), the TOC and the save in spans::
+
+    with span('conclusion', 'section', doc):
+        add_section(doc, config)
+
+    @traced('helper')
+    def add_code_block(doc, code, language=''): ...
+
+Nothing is recorded unless a ``Tracer`` is enabled; until then ``span()``
+returns a shared no-op context manager and ``traced`` wrappers call straight
+through, so the cost is one global lookup per call::
+
+    tracer = report_trace.enable(memory=True)
+    report.render_report(config, 'report.docx')
+    report_trace.disable()
+    tracer.write_chrome_trace('trace.json')   # chrome://tracing or Perfetto
+    print(tracer.summary())
+
+Each span records its wall time, the number of body elements the document
+gained (python-docx documents only) and, with ``memory``, the net bytes
+allocated and the peak above its starting point, from tracemalloc. Memory
+tracing slows the build noticeably, so the times of a memory trace are
+inflated; tracemalloc also does not see the XML tree, which lxml allocates.
+"""
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+_tracer = None
+_NULL = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ('name', 'category', 'doc', 'args', 'start', 'elements', 'memory', 'peak', 'children')
+
+    def __init__(self, name, category, doc, args):
+        self.name = name
+        self.category = category
+        self.doc = doc
+        self.args = args
+        self.children = 0.0
+
+
+def _element_count(doc):
+    """Number of block elements in a python-docx document's body, else None"""
+    element = getattr(doc, 'element', None)
+    body = getattr(element, 'body', None)
+    return len(body) if body is not None else None
+
+
+class Tracer:
+    """Collect spans as Chrome trace events"""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self._stack = []
+        self._origin = time.perf_counter_ns()
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _fold_peak(self):
+        """Credit the peak since the last reset to every open span, then reset it"""
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_span in self._stack:
+            open_span.peak = max(open_span.peak, peak)
+        tracemalloc.reset_peak()
+
+    @contextlib.contextmanager
+    def span(self, name, category='report', doc=None, **args):
+        record = _Span(name, category, doc, args)
+        record.elements = _element_count(doc) if doc is not None else None
+        if self.memory:
+            self._fold_peak()
+            record.memory = record.peak = tracemalloc.get_traced_memory()[0]
+        self._stack.append(record)
+        record.start = time.perf_counter_ns()
+        try:
+            yield record
+        finally:
+            end = time.perf_counter_ns()
+            self._stack.pop()
+            self._close(record, end)
+
+    def _close(self, record, end):
+        duration = end - record.start
+        args = dict(record.args)
+        args['self_ms'] = round((duration - record.children) / 1e6, 3)
+        if record.elements is not None:
+            after = _element_count(record.doc)
+            if after is not None:
+                args['elements'] = after - record.elements
+        if self.memory:
+            self._stack.append(record)
+            self._fold_peak()
+            self._stack.pop()
+            current = tracemalloc.get_traced_memory()[0]
+            args['alloc_bytes'] = current - record.memory
+            args['peak_bytes'] = record.peak - record.memory
+        if self._stack:
+            self._stack[-1].children += duration
+        self.events.append({
+            'name': record.name,
+            'cat': record.category,
+            'ph': 'X',
+            'ts': (record.start - self._origin) / 1000,
+            'dur': duration / 1000,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        })
+
+    def annotate(self, **args):
+        """Add arguments to the innermost open span"""
+        if self._stack:
+            self._stack[-1].args.update(args)
+
+    def chrome_trace(self):
+        """Return the events in Chrome's trace event format"""
+        events = sorted(self.events, key=lambda event: event['ts'])
+        metadata = {'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': 'PetPal report'}}
+        return {'traceEvents': [metadata] + events, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f, separators=(',', ':'))
+
+    def totals(self):
+        """Aggregate events by name: ``[(name, category, stats)]``, slowest first"""
+        totals = {}
+        for event in self.events:
+            entry = totals.setdefault(event['name'], {
+                'category': event['cat'], 'calls': 0, 'total_ms': 0.0, 'self_ms': 0.0,
+                'elements': None, 'alloc_bytes': None, 'peak_bytes': None,
+            })
+            args = event['args']
+            entry['calls'] += 1
+            entry['total_ms'] += event['dur'] / 1000
+            entry['self_ms'] += args['self_ms']
+            for key in ('elements', 'alloc_bytes'):
+                if key in args:
+                    entry[key] = (entry[key] or 0) + args[key]
+            if 'peak_bytes' in args:
+                entry['peak_bytes'] = max(entry['peak_bytes'] or 0, args['peak_bytes'])
+        return sorted(((name, entry['category'], entry) for name, entry in totals.items()),
+                      key=lambda item: -item[2]['total_ms'])
+
+    def summary(self):
+        """Return a plain-text table of the totals"""
+        def size(value):
+            return '' if value is None else f'{value / 1024:,.1f}'
+
+        lines = [f'{"span":<28} {"kind":<8} {"calls":>6} {"total ms":>10} {"self ms":>10} '
+                 f'{"elements":>9} {"alloc KiB":>11} {"peak KiB":>11}']
+        for name, category, entry in self.totals():
+            elements = '' if entry['elements'] is None else f'{entry["elements"]:,}'
+            lines.append(f'{name[:28]:<28} {category[:8]:<8} {entry["calls"]:>6,} {entry["total_ms"]:>10.1f} '
+                         f'{entry["self_ms"]:>10.1f} {elements:>9} {size(entry["alloc_bytes"]):>11} '
+                         f'{size(entry["peak_bytes"]):>11}')
+        return '\n'.join(lines)
+
+
+def enable(memory=False):
+    """Start recording spans into a new ``Tracer`` and return it"""
+    global _tracer
+    disable()
+    _tracer = Tracer(memory)
+    _tracer.start()
+    return _tracer
+
+
+def disable():
+    """Stop recording; the last tracer keeps what it recorded"""
+    global _tracer
+    if _tracer is not None:
+        _tracer.stop()
+        _tracer = None
+
+
+def span(name, category='report', doc=None, **args):
+    """Return a context manager timing a block, or a no-op one when tracing is off"""
+    if _tracer is None:
+        return _NULL
+    return _tracer.span(name, category, doc, **args)
+
+
+def annotate(**args):
+    """Add arguments to the innermost open span, if tracing"""
+    if _tracer is not None:
+        _tracer.annotate(**args)
+
+
+def traced(category='helper'):
+    """Decorate a ``func(doc, ...)`` helper so each call is a span named after it"""
+    def decorate(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name, category, args[0] if args else None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
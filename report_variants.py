@@ -0,0 +1,167 @@
+"""Render several audience variants of the report from one shared build.
+
+The report spec marks role-specific sections with the variants they belong
+to (see report_spec.py); every other section is shared. Rather than build
+each variant from scratch::
+
+    python export_report_to_word.py --variants technical,owner,vet,sitter
+
+builds the union of the requested variants' sections once, recording
+which body elements and headings each section added. Each variant is then
+a deep copy of that body (a C-level lxml copy, far cheaper than rendering)
+with the other variants' sections removed, its own cover page and table of
+contents, and images no longer referenced left out of the package, so N
+variants cost about one build plus N copies and saves.
+
+A section is rendered once for all of its variants whose configs agree on
+every key the section reads, and again for each group that differs (the
+photo appendix is lettered A or B depending on whether the variant has a
+statistics appendix). PDFs and streaming builds are written as they are
+laid out, so a ``.pdf`` output, or any output of a ``streaming`` config,
+renders its variant in full.
+"""
+import copy
+import os
+
+import export_report_to_word as report
+from report_trace import span
+
+_RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def variant_path(out, variant):
+    """Return the output path for a variant: the technical report keeps ``out``"""
+    if variant == report.DEFAULT_VARIANT:
+        return out
+    stem, ext = os.path.splitext(out)
+    return f'{stem}_{variant}{ext}'
+
+
+def _body_end(body):
+    return len(body) - (body.sectPr is not None)
+
+
+class SharedBuild:
+    """The union of several variants' sections, built once"""
+
+    def __init__(self, config, variants, incremental=False):
+        self.config = report.resolve_config(config)
+        for variant in variants:
+            report.check_variant(self.config, variant)
+        with span('spec', 'template'):
+            sections = [
+                (name, add_section, listed)
+                for name, add_section, listed in self._spec_sections()
+                if listed is None or any(variant in listed for variant in variants)
+            ]
+        with span('template', 'template'):
+            self.doc = report.template_document(self.config)
+        self.index = report.HeadingIndex.attach(self.doc)
+        body = self.doc.element.body
+        self.cover_end = _body_end(body)
+
+        configs = {variant: report.variant_config(self.config, variant) for variant in variants}
+        # (variants, first element, end element, first heading, end heading)
+        self.ranges = []
+        for name, add_section, listed in sections:
+            members = [variant for variant in variants if listed is None or variant in listed]
+            while members:
+                base = configs[members[0]]
+                tracked = report._ConfigReads(base)
+                start, headings = _body_end(body), len(self.index.entries)
+                report.add_report_section(self.doc, name, add_section, tracked, incremental)
+                group = tuple(variant for variant in members
+                              if all(configs[variant].get(key) == base.get(key) for key in tracked.reads))
+                self.ranges.append((group, start, _body_end(body), headings, len(self.index.entries)))
+                members = [variant for variant in members if variant not in group]
+        placeholder = self.index.placeholder
+        self.placeholder = body.index(placeholder) if placeholder is not None else None
+
+    def _spec_sections(self):
+        from report_spec import load_sections
+
+        return load_sections(self.config['spec'] or report.DEFAULT_SPEC)
+
+    def _cover(self, config):
+        """Return the cover page elements for a variant's config"""
+        if all(config[key] == self.config[key] for key in ('title', 'subtitle')):
+            return None
+        body = report.template_document(config).element.body
+        return list(body)[:_body_end(body)]
+
+    def variant_body(self, config, variant):
+        """Return a copy of the shared body holding only ``variant``'s sections"""
+        body = copy.deepcopy(self.doc.element.body)
+        children = list(body)
+        entries = []
+        for group, start, end, first, last in self.ranges:
+            if variant in group:
+                entries.extend(range(first, last))
+            else:
+                for element in children[start:end]:
+                    body.remove(element)
+        cover = self._cover(config)
+        if cover is not None:
+            for element in cover:
+                children[0].addprevious(element)
+            for element in children[:self.cover_end]:
+                body.remove(element)
+        if self.placeholder is not None and children[self.placeholder].getparent() is body:
+            toc_start = self.index.toc_start
+            report.fill_toc(children[self.placeholder],
+                            [self.index.entries[i] for i in entries if i >= toc_start], self.index.max_level)
+        return body
+
+    def save(self, variant, out):
+        """Save ``variant`` to a path or writable binary stream"""
+        from docx.opc.constants import RELATIONSHIP_TYPE as RT
+
+        config = report.variant_config(self.config, variant)
+        document = self.doc.element
+        shared = document.body
+        rels = self.doc.part.rels
+        all_rels = list(rels.items())
+        with span(f'variant:{variant}', 'variant', self.doc):
+            body = self.variant_body(config, variant)
+            # Leave out images only the dropped sections showed
+            used = {value for element in body.iter() for name, value in element.attrib.items()
+                    if name.startswith(_RELATIONSHIP_NS)}
+            for rId, rel in all_rels:
+                if rel.reltype == RT.IMAGE and rId not in used:
+                    del rels[rId]
+            document.replace(shared, body)
+            try:
+                report.set_core_properties(self.doc, config)
+                date_time = config['report_date'].timetuple()[:6] if config['reproducible'] else None
+                report.save_document(self.doc, out, config['compression_level'], date_time)
+            finally:
+                document.replace(body, shared)
+                rels.clear()
+                rels.update(all_rels)
+
+
+def render_variants(config, outputs, incremental=False):
+    """Render each ``{variant: out}`` from one shared build; ``out`` is a path or binary stream
+
+    Outputs that are ``.pdf`` paths, and every output of a ``streaming``
+    config, are rendered on their own.
+    """
+    config = report.resolve_config(config)
+    shared = {variant: out for variant, out in outputs.items()
+              if report.resolve_output_format(out) == 'docx' and not config['streaming']}
+    for variant, out in outputs.items():
+        if variant not in shared:
+            report.render_report(dict(config, variant=variant), out)
+    if shared:
+        build = SharedBuild(config, list(shared), incremental)
+        for variant, out in shared.items():
+            build.save(variant, out)
+
+
+def main(config, variants, output, incremental=False):
+    """Render the named variants next to ``output``; return the exit code"""
+    outputs = {variant: variant_path(output, variant) for variant in variants}
+    render_variants(config, outputs, incremental)
+    for path in outputs.values():
+        print(f'Document successfully created at: {path}')
+    return 0
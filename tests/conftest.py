@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The report modules live at the repository root and are not installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import export_report_to_word as report  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Give every test an empty report cache of its own"""
+    path = tmp_path / 'cache'
+    monkeypatch.setattr(report, 'CACHE_DIR', str(path))
+    return path
@@ -0,0 +1,89 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+import export_report_to_word as report
+import report_schema
+import report_sources
+
+CONFIG = {'report_date': '2026-01-01', 'reproducible': True}
+
+
+def document_xml(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        return package.read('word/document.xml').decode('utf-8')
+
+
+@pytest.fixture
+def app_copy(tmp_path, monkeypatch):
+    """A copy of the app's Dart sources and rules for snippets and the schema to be read from"""
+    root = tmp_path / 'petpal_app'
+    shutil.copytree(os.path.join(report_sources.APP_ROOT, report_sources.SOURCE_DIR),
+                    root / report_sources.SOURCE_DIR)
+    shutil.copy(os.path.join(report_sources.APP_ROOT, report_schema.RULES_FILE), root / report_schema.RULES_FILE)
+    monkeypatch.setattr(report_sources, '_index', report_sources.SymbolIndex(str(root)))
+    monkeypatch.setattr(report_schema.load_schema, '__defaults__', (str(root),))
+    return root
+
+
+def test_incremental_rebuild_matches_full_build(app_copy):
+    full = report.render_bytes(CONFIG)
+    assert report.render_bytes(CONFIG, incremental=True) == full
+    assert report.render_bytes(CONFIG, incremental=True) == full
+
+
+def test_incremental_rebuild_after_source_edit_matches_full_build(app_copy):
+    report.render_bytes(CONFIG, incremental=True)
+
+    # Shift every line of the file and change a line of the AppUser.toMap snippet
+    path = app_copy / 'lib' / 'models' / 'app_user.dart'
+    source = path.read_text(encoding='utf-8')
+    assert "'name': name," in source
+    path.write_text('// Edited\n\n\n' + source.replace("'name': name,", "'fullName': name,"), encoding='utf-8')
+
+    rebuilt = report.render_bytes(CONFIG, incremental=True)
+    assert 'fullName' in document_xml(rebuilt)
+    assert rebuilt == report.render_bytes(CONFIG)
+
+
+def test_incremental_rebuild_after_adding_a_model_matches_full_build(app_copy):
+    report.render_bytes(CONFIG, incremental=True)
+
+    (app_copy / 'lib' / 'models' / 'zz_new.dart').write_text(
+        'class Zebra {\n'
+        '  final String stripes;\n'
+        '\n'
+        '  const Zebra({required this.stripes});\n'
+        '\n'
+        '  Map<String, dynamic> toMap() {\n'
+        "    return {'stripes': stripes};\n"
+        '  }\n'
+        '}\n', encoding='utf-8')
+
+    rebuilt = report.render_bytes(CONFIG, incremental=True)
+    assert 'Zebra' in document_xml(rebuilt)
+    assert rebuilt == report.render_bytes(CONFIG)
+
+
+def test_script_run_records_source_dependencies(tmp_path, cache_dir):
+    # Run as a script, the helper modules must share the running exporter to
+    # record the files each section read
+    script = os.path.join(os.path.dirname(report.__file__), 'export_report_to_word.py')
+    config = tmp_path / 'config.json'
+    config.write_text(json.dumps(CONFIG), encoding='utf-8')
+    subprocess.run([sys.executable, script, '--config', str(config), '-o', str(tmp_path / 'report.docx'),
+                    '--incremental'], check=True, capture_output=True,
+                   env=dict(os.environ, PETPAL_REPORT_CACHE=str(cache_dir)))
+
+    dependencies = set()
+    for name in os.listdir(cache_dir / 'sections'):
+        entry = json.loads((cache_dir / 'sections' / name).read_text(encoding='utf-8'))
+        if isinstance(entry, dict):
+            dependencies.update(entry['deps'])
+    assert os.path.join(report_sources.APP_ROOT, 'lib', 'models', 'app_user.dart') in dependencies
@@ -0,0 +1,48 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+import export_report_to_word as report
+
+CONFIG = {'report_date': '2026-01-01', 'reproducible': True}
+
+
+@pytest.fixture
+def photo_config(tmp_path):
+    """A reproducible config whose report has statistics charts and a photo appendix"""
+    image = pytest.importorskip('PIL.Image')
+    bookings = tmp_path / 'bookings.ndjson'
+    bookings.write_text(''.join(
+        json.dumps({'ownerId': f'o{i}', 'petId': f'p{i % 3}', 'status': ('completed', 'cancelled')[i % 2],
+                    'date': 1735689600000 + i * 86400000 * 9, 'vetId': f'v{i % 2}'}) + '\n'
+        for i in range(40)), encoding='utf-8')
+    images = tmp_path / 'images'
+    (images / 'pets').mkdir(parents=True)
+    pets = []
+    for i, color in enumerate(('red', 'green', 'blue')):
+        image.new('RGB', (64, 48), color).save(images / 'pets' / f'p{i}.png')
+        pets.append({'id': f'pet{i}', 'name': f'Pet {i}', 'species': 'Dog', 'imageUrl': f'pets/p{i}.png'})
+    export = tmp_path / 'pets.json'
+    export.write_text(json.dumps(pets), encoding='utf-8')
+    return dict(CONFIG, bookings_export=str(bookings), pets_export=str(export), images_dir=str(images))
+
+
+def test_repeated_builds_are_identical(photo_config):
+    data = report.render_bytes(photo_config)
+    assert report.render_bytes(photo_config) == data
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        assert {info.date_time for info in package.infolist()} == {(2026, 1, 1, 0, 0, 0)}
+        document = package.read('word/document.xml')
+    assert b'Appendix B. Pet and Provider Photos' in document
+    assert document.count(b'<wp:docPr') > 3
+
+
+def test_parallel_build_matches_serial_build(photo_config):
+    assert report.render_bytes(photo_config, workers=2) == report.render_bytes(photo_config)
+
+
+def test_source_date_epoch_is_the_default_report_date(monkeypatch):
+    monkeypatch.setenv('SOURCE_DATE_EPOCH', '1767225600')
+    assert report.render_bytes({'reproducible': True}) == report.render_bytes(CONFIG)
@@ -0,0 +1,109 @@
+import asyncio
+import http.client
+import io
+import json
+import threading
+import zipfile
+
+import pytest
+
+import export_report_to_word as report
+import report_service
+
+CONFIG = {'report_date': '2026-01-01', 'reproducible': True}
+
+
+@pytest.fixture(scope='module')
+def service(tmp_path_factory):
+    """A one-worker service with no queue, listening on a free local port"""
+    with pytest.MonkeyPatch.context() as patch:
+        # Workers are forked with the cache the service starts with
+        patch.setattr(report, 'CACHE_DIR', str(tmp_path_factory.mktemp('cache')))
+        service = report_service.ReportService(workers=1, max_queue=0)
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(report_service.start_server(service, '127.0.0.1', 0))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        try:
+            service.port = server.sockets[0].getsockname()[1]
+            yield service
+        finally:
+            loop.call_soon_threadsafe(server.close)
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+            service.close()
+
+
+def post(service, body, headers=None):
+    connection = http.client.HTTPConnection('127.0.0.1', service.port, timeout=60)
+    try:
+        connection.request('POST', '/render', json.dumps(body), headers or {})
+        response = connection.getresponse()
+        return response.status, response.getheader('ETag'), response.getheader('Retry-After'), response.read()
+    finally:
+        connection.close()
+
+
+def test_render_and_not_modified(service):
+    status, etag, _, data = post(service, CONFIG)
+    assert status == 200
+    assert data.startswith(b'PK')
+    assert post(service, CONFIG)[:2] == (200, etag)
+
+    status, same, _, data = post(service, CONFIG, {'If-None-Match': etag})
+    assert (status, same, data) == (304, etag, b'')
+
+
+def test_unknown_variant_is_a_bad_request(service):
+    status, _, _, data = post(service, dict(CONFIG, variant='groomer'))
+    assert status == 400
+    assert 'groomer' in json.loads(data)['error']
+
+
+@pytest.mark.parametrize('key', report.PATH_KEYS)
+def test_file_paths_are_refused_without_a_data_root(service, key):
+    status, _, _, data = post(service, dict(CONFIG, **{key: report.DEFAULT_SPEC}))
+    assert status == 400
+    assert key in json.loads(data)['error']
+
+
+def test_saturated_service_answers_429(service):
+    service.in_flight = service.capacity
+    try:
+        status, _, retry_after, _ = post(service, CONFIG)
+    finally:
+        service.in_flight = 0
+    assert status == 429
+    assert retry_after == str(report_service.RETRY_AFTER)
+
+
+def test_paths_must_stay_inside_the_data_root(tmp_path):
+    (tmp_path / 'pets.json').write_text('[]', encoding='utf-8')
+    config, _ = report_service.parse_job(json.dumps({'pets_export': 'pets.json'}).encode(), str(tmp_path))
+    assert config['pets_export'] == str((tmp_path / 'pets.json').resolve())
+    with pytest.raises(report_service.HttpError) as error:
+        report_service.parse_job(json.dumps({'pets_export': '../pets.json'}).encode(), str(tmp_path))
+    assert error.value.status == 400
+
+
+def test_exports_cannot_embed_images_outside_the_data_root(tmp_path):
+    image = pytest.importorskip('PIL.Image')
+    root = tmp_path / 'data'
+    (root / 'images').mkdir(parents=True)
+    image.new('RGB', (64, 48), 'red').save(root / 'images' / 'inside.png')
+    outside = tmp_path / 'outside.png'
+    image.new('RGB', (64, 48), 'blue').save(outside)
+    pets = [{'id': 'pet0', 'name': 'Inside', 'imageUrl': 'inside.png'},
+            {'id': 'pet1', 'name': 'Absolute', 'imageUrl': str(outside)},
+            {'id': 'pet2', 'name': 'Relative', 'imageUrl': '../../outside.png'}]
+    (root / 'pets.json').write_text(json.dumps(pets), encoding='utf-8')
+
+    body = dict(CONFIG, pets_export='pets.json', images_dir='images')
+    config, output_format = report_service.parse_job(json.dumps(body).encode(), str(root))
+    data = report_service.render_job(config, output_format, False)
+    with zipfile.ZipFile(io.BytesIO(data)) as package:
+        media = [name for name in package.namelist() if name.startswith('word/media/')]
+        document = package.read('word/document.xml').decode('utf-8')
+    assert len(media) == 1
+    assert 'Inside' in document and 'Absolute' not in document